@@ -0,0 +1,10 @@
+"""Benchmarks of the garbling, evaluation, OT and end-to-end protocol.
+
+Run from source_code/src:
+
+    python -m benchmarks all --output results.json
+    python -m benchmarks micro --compare results.json
+
+Results are written as JSON (see harness.report) and can be compared with
+a previous run to catch regressions (see harness.compare).
+"""
@@ -0,0 +1,96 @@
+import argparse
+import json
+import sys
+import ot
+import yao
+from . import end_to_end, harness, micro
+
+
+def _print_result(record):
+    stats = record["stats"]
+    flag = "" if record.get("correct", True) else " [WRONG OUTPUT]"
+    print(f"{record['name']:<16} {harness.format_params(record['params']):<56} median "
+          f"{1000 * stats['median']:>10.3f} ms  min {1000 * stats['min']:>10.3f} ms{flag}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark the garbling, evaluation, OT and Yao protocol.")
+    parser.add_argument("suite", nargs="?", choices=["micro", "end-to-end", "all"], default="all",
+                        help="the benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=harness.DEFAULT_REPEAT,
+                        help="timed samples of each benchmark (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true",
+                        help="smaller circuits, sets and sweeps, e.g. for a smoke test")
+    parser.add_argument("--output", metavar="FILE", help="write the JSON results to FILE instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="compare the timings with the JSON results of a previous run, the exit "
+                             "status is 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=harness.DEFAULT_THRESHOLD,
+                        help="relative slowdown reported as a regression (default: %(default)s)")
+    parser.add_argument("--statistic", choices=harness.STATISTICS, default="median",
+                        help="timing compared with the baseline (default: %(default)s)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="numbers of processes garbling and of threads evaluating the circuits of the "
+                             "micro suite (default: 1)")
+    parser.add_argument("--operations", type=int, nargs="+", choices=[0, 1], default=[0, 1],
+                        help="operations of the end-to-end sweep (default: 0 1)")
+    parser.add_argument("--bits", type=int, nargs="+", default=list(end_to_end.DEFAULT_BITS),
+                        help="bit widths of the values of the end-to-end sweep")
+    parser.add_argument("--alice", type=int, nargs="+", default=list(end_to_end.DEFAULT_CARDINALITIES),
+                        help="cardinalities of Alice's set of the end-to-end sweep")
+    parser.add_argument("--bob", type=int, nargs="+", default=list(end_to_end.DEFAULT_CARDINALITIES),
+                        help="cardinalities of Bob's set of the end-to-end sweep")
+    parser.add_argument("--grid", action="store_true",
+                        help="run every combination of bits and cardinalities instead of varying "
+                             "one parameter at a time")
+    parser.add_argument("--seed", type=int, default=end_to_end.DEFAULT_SEED,
+                        help="seed of the sets of the end-to-end sweep (default: %(default)s)")
+    parser.add_argument("--ot-mode", choices=ot.OT_MODES,
+                        help="OT mode of the end-to-end runs (default: lockstep, extension over asyncio)")
+    parser.add_argument("--scheme", choices=yao.SCHEMES, default="classic",
+                        help="garbling scheme of the end-to-end runs (default: %(default)s)")
+    parser.add_argument("--backend", choices=yao.BACKENDS, default="aes-cbc",
+                        help="garbling backend of the end-to-end runs (default: %(default)s)")
+    parser.add_argument("--transport", choices=end_to_end.TRANSPORTS, default="tcp",
+                        help="transport of the end-to-end runs, loopback runs both parties in this process "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.ot_mode is None:
+        args.ot_mode = "extension" if args.transport == "asyncio" else "lockstep"
+
+    results = []
+    if args.suite in ("micro", "all"):
+        results += micro.run(args.repeat, args.quick, args.workers, _print_result)
+    if args.suite in ("end-to-end", "all"):
+        if args.quick:
+            points = [(8, 2, 2), (16, 2, 2)]
+        else:
+            points = end_to_end.sweep_points(args.bits, args.alice, args.bob, args.grid)
+        alice_kwargs = {"ot_mode": args.ot_mode, "scheme": args.scheme, "backend": args.backend}
+        results += end_to_end.bench_protocol(args.operations, points, args.repeat, alice_kwargs,
+                                             seed=args.seed, progress=_print_result,
+                                             transport=args.transport)
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ("output", "compare", "threshold", "statistic")}
+    document = harness.report(results, config)
+    if args.output:
+        with open(args.output, mode="w") as output_file:
+            json.dump(document, output_file, indent=2)
+    else:
+        json.dump(document, sys.stdout, indent=2)
+        print()
+
+    status = 0 if all(record.get("correct", True) for record in results) else 1
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            rows = harness.compare(json.load(baseline_file), document, args.threshold, args.statistic)
+        harness.print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import main
+import util
+from . import harness
+
+DEFAULT_BITS = (8, 16, 32)
+DEFAULT_CARDINALITIES = (2, 4, 8)
+DEFAULT_SEED = 2024
+READY_TIMEOUT = 30  # seconds to wait for Bob to listen
+TRANSPORTS = ("tcp", "asyncio", "loopback")
+
+
+def make_sets(bits, alice_set_cardinality, bob_set_cardinality, seed=DEFAULT_SEED):
+    """Return reproducible sets of 'bits'-bit values.
+
+    Half of the smaller set is common to both sets, so that operation 1
+    finds some common values.
+
+    Returns:
+        A pair (alice_set, bob_set) of lists of ints.
+    """
+    low, high = 1 << (bits - 1), 1 << bits
+    if high - low < alice_set_cardinality + bob_set_cardinality:
+        raise ValueError(f"Not enough {bits}-bit values for sets of {alice_set_cardinality} "
+                         f"and {bob_set_cardinality} values")
+    rng = random.Random(f"{seed}-{bits}-{alice_set_cardinality}-{bob_set_cardinality}")
+    values = rng.sample(range(low, high), alice_set_cardinality + bob_set_cardinality)
+    alice_set, bob_set = values[:alice_set_cardinality], values[alice_set_cardinality:]
+    common = min(alice_set_cardinality, bob_set_cardinality) // 2
+    bob_set[:common] = alice_set[:common]
+    return alice_set, bob_set
+
+
+def sweep_points(bits=DEFAULT_BITS, alice=DEFAULT_CARDINALITIES, bob=DEFAULT_CARDINALITIES, grid=False):
+    """Return the (bits, alice cardinality, bob cardinality) points of a sweep.
+
+    By default each parameter varies alone, the others being at the middle
+    of their range; with 'grid' every combination is returned.
+    """
+    if grid:
+        return list(itertools.product(bits, alice, bob))
+    base = (bits[len(bits) // 2], alice[len(alice) // 2], bob[len(bob) // 2])
+    points = [(b, base[1], base[2]) for b in bits]
+    points += [(base[0], a, base[2]) for a in alice]
+    points += [(base[0], base[1], b) for b in bob]
+    return list(dict.fromkeys(points))
+
+
+def _serve_bob(bob_set, bob_kwargs, async_transport, ready):
+    sys.stdout = open(os.devnull, "w")
+    bob = (main.AsyncBob if async_transport else main.Bob)(bob_set, **bob_kwargs)
+    ready.set()
+    main.listen(bob)
+
+
+@contextlib.contextmanager
+def _kept_sets():
+    # Alice's expected output is read from the set files, restore the user's sets afterwards
+    saved = {}
+    for actor in ("alice", "bob"):
+        path = os.path.join(os.path.dirname(os.path.abspath(main.__file__)), "sets", f"{actor}_set.txt")
+        with open(path) as set_file:
+            saved[path] = set_file.read()
+    try:
+        yield
+    finally:
+        for path, text in saved.items():
+            with open(path, mode="w") as set_file:
+                set_file.write(text)
+
+
+def run_protocol(operation, alice_set, bob_set, alice_kwargs=None, bob_kwargs=None, transport="tcp"):
+    """Run Alice and Bob once.
+
+    Over "tcp" and "asyncio", Bob listens on the default port of loopback
+    TCP in a separate process, which is terminated afterwards; with
+    "asyncio", the parties are main.AsyncAlice and main.AsyncBob. Over
+    "loopback", both parties run in this process with no socket and no
+    serialization (see main.run_in_process), so that the time is the one
+    of the cryptography and the circuits. The time covers Alice from the
+    connection to the last result, the circuits being looked up in the
+    circuit cache.
+
+    Returns:
+        A tuple (seconds, correct, bit_length): the duration, whether Alice
+        got the expected output and the bit width of the circuits.
+    """
+    main.save_set_to_file("alice", alice_set)
+    main.save_set_to_file("bob", bob_set)
+    circuits = {"filename": "bench.json", "id_name": "bench", "circuit_name": "bench"}
+    output = io.StringIO()
+    if transport == "loopback":
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            alice = main.run_in_process(circuits, alice_set, bob_set, bob_kwargs=bob_kwargs, operation=operation,
+                                        **(alice_kwargs or {}))
+            seconds = time.perf_counter() - start
+        return seconds, "[CORRECT]" in output.getvalue(), alice.max_bit_length
+
+    async_transport = transport == "asyncio"
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    bob = context.Process(target=_serve_bob, args=(bob_set, bob_kwargs or {}, async_transport, ready),
+                          daemon=True)
+    bob.start()
+    try:
+        if not ready.wait(READY_TIMEOUT):
+            raise RuntimeError("Bob did not start listening")
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            if async_transport:
+                alice = main.AsyncAlice(circuits, alice_set, operation=operation, **(alice_kwargs or {}))
+                asyncio.run(alice.start())
+            else:
+                alice = main.Alice(circuits, alice_set, operation=operation, **(alice_kwargs or {}))
+                alice.start()
+            seconds = time.perf_counter() - start
+        alice.socket.socket.close(linger=0)
+    finally:
+        bob.terminate()
+        bob.join()
+    return seconds, "[CORRECT]" in output.getvalue(), alice.max_bit_length
+
+
+def bench_protocol(operations=(0, 1), points=None, repeat=harness.DEFAULT_REPEAT, alice_kwargs=None, bob_kwargs=None,
+                   seed=DEFAULT_SEED, progress=None, transport="tcp"):
+    """Time end-to-end runs of the protocol over a sweep.
+
+    A first run of each point is not timed: it fills the circuit cache, so
+    the samples do not depend on the state of the cache. The prime group
+    of the OT is generated once for the whole sweep and passed to Alice.
+
+    Args:
+        operations: Optional; the operations to run (Default: 0 and 1).
+        points: Optional; the (bits, alice cardinality, bob cardinality)
+            points, see sweep_points (Default: sweep_points()).
+        repeat: Optional; the number of timed runs of each point.
+        alice_kwargs: Optional; keyword arguments of main.Alice, e.g. the
+            OT mode or garbling scheme.
+        bob_kwargs: Optional; keyword arguments of main.Bob.
+        seed: Optional; the seed of the sets, see make_sets.
+        progress: Optional; a function called with each result.
+        transport: Optional; one of TRANSPORTS, see run_protocol
+            (Default: tcp).
+
+    Returns:
+        The list of results, see harness.result.
+    """
+    points = sweep_points() if points is None else points
+    alice_kwargs = dict(alice_kwargs or {})
+    results = []
+    with tempfile.TemporaryDirectory() as directory, _kept_sets():
+        if alice_kwargs.get("oblivious_transfer", True) and "prime_groups" not in alice_kwargs:
+            alice_kwargs["prime_groups"] = util.save_prime_groups(os.path.join(directory, "groups.json"), 1)
+        options = {key: value for key, value in alice_kwargs.items() if key != "prime_groups"}
+        if transport != "tcp":  # no key otherwise, the results stay comparable with older runs
+            options["transport"] = transport
+        for operation in operations:
+            for bits, alice_cardinality, bob_cardinality in points:
+                alice_set, bob_set = make_sets(bits, alice_cardinality, bob_cardinality, seed)
+                runs = [run_protocol(operation, alice_set, bob_set, alice_kwargs, bob_kwargs, transport)
+                        for _ in range(repeat + 1)]
+                params = {"operation": operation, "bits": bits, "alice": alice_cardinality,
+                          "bob": bob_cardinality, **options}
+                record = harness.result("protocol", params, harness.summarize([run[0] for run in runs[1:]]),
+                                        correct=all(run[1] for run in runs), bit_length=runs[0][2])
+                results.append(record)
+                if progress is not None:
+                    progress(record)
+    return results
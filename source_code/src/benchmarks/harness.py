@@ -0,0 +1,157 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+SCHEMA_VERSION = 1  # bumped when results of a version are not comparable with the previous one
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25  # slowdown reported as a regression
+STATISTICS = ("median", "min")  # statistics compared between runs, min is less sensitive to noise
+
+
+def summarize(samples, number=1):
+    """Return the statistics of timings.
+
+    Args:
+        samples: A list of durations in seconds, each one of 'number' calls.
+        number: Optional; the number of calls of each sample (Default: 1).
+
+    Returns:
+        A dict of the min, median, mean and standard deviation of the
+        duration of one call in seconds, with the number of samples and of
+        calls per sample.
+    """
+    per_call = [sample / number for sample in samples]
+    return {
+        "min": min(per_call),
+        "median": statistics.median(per_call),
+        "mean": statistics.fmean(per_call),
+        "stdev": statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        "repeat": len(per_call),
+        "number": number,
+    }
+
+
+def measure(func, repeat=DEFAULT_REPEAT, number=1, warmup=1):
+    """Time a function called without arguments.
+
+    Args:
+        func: The function to time.
+        repeat: Optional; the number of samples (Default: DEFAULT_REPEAT).
+        number: Optional; the number of calls of each sample (Default: 1).
+        warmup: Optional; the number of calls before the first sample,
+            e.g. to fill caches (Default: 1).
+
+    Returns:
+        The statistics of the calls, see summarize.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, number)
+
+
+def result(name, params, stats, **extra):
+    """Return the record of a benchmark.
+
+    Args:
+        name: The name of the benchmark.
+        params: A dict of the parameters of this run of the benchmark; the
+            name and params identify the run when comparing results.
+        stats: The statistics returned by measure or summarize.
+        extra: Other values to report, e.g. the number of gates.
+    """
+    return {"name": name, "params": params, "stats": stats, **extra}
+
+
+def _git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(__file__), check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ("-dirty" if dirty else "")
+
+
+def environment():
+    """Return a description of the machine and code the benchmarks ran on."""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "revision": _git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def report(results, config):
+    """Return the JSON document of a benchmark run.
+
+    Args:
+        results: A list of records returned by result.
+        config: A dict of the options of the run.
+    """
+    return {"schema": SCHEMA_VERSION, "environment": environment(), "config": config, "results": results}
+
+
+def _run_key(record):
+    return record["name"], json.dumps(record["params"], sort_keys=True)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, statistic="median"):
+    """Compare the timings of two benchmark runs.
+
+    Args:
+        baseline: A document returned by report, e.g. of the last release.
+        current: A document returned by report.
+        threshold: Optional; the relative slowdown reported as a regression
+            (Default: DEFAULT_THRESHOLD).
+        statistic: Optional; the statistic compared, see STATISTICS
+            (Default: median).
+
+    Returns:
+        A list of dicts (name, params, baseline, current, ratio, regression)
+        for the runs found in both documents, the timings being in seconds.
+
+    Raises:
+        ValueError: The documents have different schema versions.
+    """
+    if baseline.get("schema") != current.get("schema"):
+        raise ValueError(f"Cannot compare results of schema {baseline.get('schema')} "
+                         f"and {current.get('schema')}")
+    timings = {_run_key(record): record["stats"][statistic] for record in baseline["results"]}
+    rows = []
+    for record in current["results"]:
+        before = timings.get(_run_key(record))
+        if before is None:
+            continue
+        after = record["stats"][statistic]
+        ratio = after / before if before else float("inf")
+        rows.append({"name": record["name"], "params": record["params"], "baseline": before,
+                     "current": after, "ratio": ratio, "regression": ratio > 1 + threshold})
+    return rows
+
+
+def format_params(params):
+    """Return the parameters of a run as "key=value" pairs."""
+    return " ".join(f"{key}={value}" for key, value in params.items())
+
+
+def print_comparison(rows, file=sys.stderr):
+    """Print the rows returned by compare, regressions being flagged."""
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<16} {format_params(row['params']):<56} {1000 * row['baseline']:>10.3f} ms "
+              f"-> {1000 * row['current']:>10.3f} ms  x{row['ratio']:.2f} {flag}", file=file)
@@ -0,0 +1,231 @@
+import contextlib
+import io
+import pickle
+import random
+import threading
+import circuit_generator
+import ot
+import util
+import yao
+from . import harness
+
+GATE = {"id": 3, "type": "AND", "in": [1, 2]}
+
+
+def _combinations():
+    # half gates always use the fixed-key AES hash
+    return [(scheme, backend) for scheme in yao.SCHEMES for backend in yao.BACKENDS
+            if not (scheme == "half-gates" and backend == "aes-cbc")]
+
+
+def build_circuits(operation=1, bits=16, alice_set_cardinality=8):
+    """Return the circuits of an operation, as built for Alice.
+
+    Args:
+        operation: Optional; 0 (set sum) or 1 (set comparison) (Default: 1).
+        bits: Optional; the bit width of the circuit inputs (Default: 16).
+        alice_set_cardinality: Optional; the number of Alice's values
+            compared by operation 1 (Default: 8).
+
+    Returns:
+        A pair (circuits, params): the list of circuit dicts and the dict
+        of parameters describing them in the results.
+    """
+    params = {"bit_number": bits, "name": "bench", "id_name": "bench", "operation": operation}
+    described = {"operation": operation, "bits": bits}
+    if operation == 1:
+        params["alice_set_cardinality"] = described["alice"] = alice_set_cardinality
+    with contextlib.redirect_stdout(io.StringIO()):
+        return circuit_generator.build_circuit(**params)["circuits"], described
+
+
+def bench_garble_gate(repeat=harness.DEFAULT_REPEAT, number=1000):
+    """Garble a single AND gate with yao.GarbledGate for each backend."""
+    keys = {wire: (yao.random_key(0), yao.random_key(1)) for wire in (1, 2, 3)}
+    pbits = dict.fromkeys((1, 2, 3), 0)
+    return [harness.result("garble_gate", {"backend": backend},
+                           harness.measure(lambda: yao.GarbledGate(GATE, keys, pbits, backend),
+                                           repeat, number))
+            for backend in yao.BACKENDS]
+
+
+def bench_garble_circuit(circuits, circuit_params, repeat=harness.DEFAULT_REPEAT, workers=(1,)):
+    """Garble circuits with yao.GarbledCircuit for each scheme and backend.
+
+    Args:
+        circuits: A list of circuit dicts, see build_circuits.
+        circuit_params: The dict of parameters describing the circuits.
+        repeat: Optional; the number of samples.
+        workers: Optional; the numbers of garbling processes to try. The
+            counts above 1 are skipped for the half-gates scheme and for
+            circuits smaller than yao.PARALLEL_MIN_GATES, which are always
+            garbled in one process.
+    """
+    results = []
+    gates = sum(len(circuit["gates"]) for circuit in circuits)
+    pooled = all(len(circuit["gates"]) >= yao.PARALLEL_MIN_GATES for circuit in circuits)
+    for scheme, backend in _combinations():
+        for count in workers:
+            if count > 1 and (scheme == "half-gates" or not pooled):  # always garbled in one process
+                continue
+
+            def garble():
+                for circuit in circuits:
+                    yao.GarbledCircuit(circuit, scheme=scheme, backend=backend, workers=count)
+
+            results.append(harness.result("garble_circuit",
+                                          {**circuit_params, "scheme": scheme, "backend": backend,
+                                           "workers": count},
+                                          harness.measure(garble, repeat), gates=gates))
+    return results
+
+
+def _garbled_inputs(circuit, garbled):
+    keys, pbits = garbled.get_keys(), garbled.get_pbits()
+    inputs = {}
+    for wire in circuit["alice"] + circuit["bob"]:
+        bit = random.randint(0, 1)
+        inputs[wire] = (keys[wire][bit], pbits[wire] ^ bit)
+    a_inputs = {wire: inputs[wire] for wire in circuit["alice"]}
+    b_inputs = {wire: inputs[wire] for wire in circuit["bob"]}
+    return a_inputs, b_inputs, {wire: pbits[wire] for wire in circuit["out"]}
+
+
+def bench_evaluate(circuits, circuit_params, repeat=harness.DEFAULT_REPEAT, workers=(1,)):
+    """Evaluate garbled circuits with yao.evaluate for each scheme and backend.
+
+    Args:
+        circuits: A list of circuit dicts, see build_circuits.
+        circuit_params: The dict of parameters describing the circuits.
+        repeat: Optional; the number of samples.
+        workers: Optional; the numbers of evaluating threads to try. The
+            counts above 1 are skipped for the backends not in
+            yao.PARALLEL_BACKENDS and for circuits without a level of
+            yao.PARALLEL_MIN_WIDTH gates, which are evaluated in one thread.
+    """
+    results = []
+    gates = sum(len(circuit["gates"]) for circuit in circuits)
+    threaded = any(len(level) >= yao.PARALLEL_MIN_WIDTH
+                   for circuit in circuits for level in yao.CompiledCircuit(circuit).get_levels())
+    for scheme, backend in _combinations():
+        runs = []
+        for circuit in circuits:
+            garbled = yao.GarbledCircuit(circuit, scheme=scheme, backend=backend)
+            compiled, tables = garbled.compiled, garbled.get_garbled_tables()
+            runs.append((compiled, tables) + _garbled_inputs(circuit, garbled))
+
+        for count in workers:
+            if count > 1 and (backend not in yao.PARALLEL_BACKENDS or not threaded):  # evaluated in one thread
+                continue
+
+            def evaluate():
+                for compiled, tables, a_inputs, b_inputs, pbits_out in runs:
+                    yao.evaluate(compiled, tables, pbits_out, a_inputs, b_inputs, scheme=scheme,
+                                 backend=backend, workers=count)
+
+            results.append(harness.result("evaluate",
+                                          {**circuit_params, "scheme": scheme, "backend": backend,
+                                           "workers": count},
+                                          harness.measure(evaluate, repeat), gates=gates))
+    return results
+
+
+def bench_prime_group(repeat=harness.DEFAULT_REPEAT):
+    """Generate a util.PrimeGroup (a random prime and generator).
+
+    The time depends on the factorization of the random prime - 1, so the
+    samples vary more than the other benchmarks.
+    """
+    return [harness.result("prime_group", {"bits": util.PRIME_BITS},
+                           harness.measure(util.PrimeGroup, repeat, warmup=0))]
+
+
+def bench_ot(repeat=harness.DEFAULT_REPEAT, number=50):
+    """Run ObliviousTransfer.ot_garbler and ot_evaluator over loopback TCP.
+
+    Bob evaluates in a thread, each OT is followed by an acknowledgement to
+    keep the REQ/REP sockets in step.
+    """
+    evaluator_socket = util.EvaluatorSocket("tcp://127.0.0.1:*")
+    endpoint = evaluator_socket.socket.getsockopt_string(util.zmq.LAST_ENDPOINT)
+    garbler_socket = util.GarblerSocket(endpoint)
+    group = util.PrimeGroup()
+    garbler = ot.ObliviousTransfer(garbler_socket)
+    evaluator = ot.ObliviousTransfer(evaluator_socket)
+    garbler.group = evaluator.group = group
+    msgs = (pickle.dumps((yao.random_key(0), 0)), pickle.dumps((yao.random_key(1), 1)))
+    total = 1 + repeat * number  # with the warmup call
+
+    def serve():
+        for i in range(total):
+            evaluator.ot_evaluator(i & 1)
+            evaluator_socket.send(True)
+
+    def transfer():
+        garbler.ot_garbler(msgs)
+        garbler_socket.receive()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        stats = harness.measure(transfer, repeat, number)
+    finally:
+        thread.join()
+        garbler_socket.socket.close(linger=0)
+        evaluator_socket.socket.close(linger=0)
+    return [harness.result("ot", {"bits": util.PRIME_BITS}, stats)]
+
+
+def bench_psi_hashing(repeat=harness.DEFAULT_REPEAT, count=10000, hashes=3):
+    """Cuckoo-hash and simple-hash 'count' values into the bins of operation 4."""
+    rng = random.Random(count)
+    values = rng.sample(range(1 << 32), count)
+    bins = util.cuckoo_bin_count(count, hashes)
+    seed = bytes(16)
+    params = {"values": count, "hashes": hashes}
+    return [
+        harness.result("cuckoo_hash", params,
+                       harness.measure(lambda: util.cuckoo_hash(values, bins, hashes, 0), repeat, warmup=0)),
+        harness.result("simple_hash", params,
+                       harness.measure(lambda: util.simple_hash(values, seed, hashes, bins), repeat, warmup=0)),
+    ]
+
+
+def run(repeat=harness.DEFAULT_REPEAT, quick=False, workers=(1,), progress=None):
+    """Run all the microbenchmarks.
+
+    Args:
+        repeat: Optional; the number of samples of each benchmark.
+        quick: Optional; benchmark smaller circuits and fewer values.
+        workers: Optional; the numbers of processes garbling the circuits
+            and of threads evaluating them. With counts above 1, the
+            garbling and the evaluation are also measured for each count
+            on a compare circuit of over yao.PARALLEL_MIN_GATES gates with
+            levels of over yao.PARALLEL_MIN_WIDTH gates.
+        progress: Optional; a function called with each result.
+
+    Returns:
+        The list of results, see harness.result.
+    """
+    circuits, circuit_params = build_circuits(bits=8 if quick else 16, alice_set_cardinality=2 if quick else 8)
+    benchmarks = [
+        lambda: bench_garble_gate(repeat, 100 if quick else 1000),
+        lambda: bench_garble_circuit(circuits, circuit_params, repeat),
+        lambda: bench_evaluate(circuits, circuit_params, repeat),
+        lambda: bench_prime_group(repeat),
+        lambda: bench_ot(repeat, 10 if quick else 50),
+        lambda: bench_psi_hashing(repeat, 1000 if quick else 10000),
+    ]
+    if any(count > 1 for count in workers):
+        # the scaling from 1 to N workers, on a compare circuit large enough for the process pool and with
+        # levels wide enough for the thread pool
+        large, large_params = build_circuits(bits=8 if quick else 16, alice_set_cardinality=128 if quick else 100)
+        benchmarks.append(lambda: bench_garble_circuit(large, large_params, repeat, workers))
+        benchmarks.append(lambda: bench_evaluate(large, large_params, repeat, workers))
+    results = []
+    for benchmark in benchmarks:
+        for record in benchmark():
+            results.append(record)
+            if progress is not None:
+                progress(record)
+    return results
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+import circuit_generator
+import optimizer
+import yao
+
+DEFAULT_DIRECTORY = os.path.join(os.path.dirname(__file__), "circuits", "cache")
+DEFAULT_CAPACITY = 8  # circuits kept in memory
+MAGIC = b"YAOCIRC1"
+
+
+def _generator_digest():
+    digest = hashlib.sha256()
+    for module in (circuit_generator, optimizer):
+        with open(module.__file__, "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+# a change of the generator or of the optimizer invalidates the cached circuits
+GENERATOR_DIGEST = _generator_digest()
+
+
+def cache_key(params, optimize=False):
+    """Return the cache key of the circuits built with 'params'.
+
+    Args:
+        params: A dict of keyword arguments of circuit_generator.build_circuit.
+        optimize: Optional; whether the circuits are optimized, see
+            optimizer.optimize_circuits (Default: False).
+
+    Returns:
+        A hex digest of the parameters and of the generator source.
+    """
+    text = json.dumps({"generator": GENERATOR_DIGEST, "params": params,
+                       "optimize": optimize}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def dump_circuits(circuits):
+    """Serialize circuits into a compact binary format.
+
+    The format is MAGIC, the length of a JSON header (uint64), the header
+    padded to 8 bytes and, for each circuit, the int64 arrays of Alice's
+    wires, Bob's wires, outputs, gate IDs, first and second gate inputs (-1
+    for NOT gates), then the uint8 array of gate types (see yao.GATE_TYPES).
+    The header holds the sizes of the arrays and the SHA-256 of the arrays.
+
+    Args:
+        circuits: A dict as read from a circuit JSON file.
+
+    Returns:
+        The bytes of the circuits, to be read with load_circuits.
+    """
+    header = {"name": circuits["name"], "byteorder": sys.byteorder,
+              "circuits": []}
+    arrays = []
+    for circuit in circuits["circuits"]:
+        gates = circuit["gates"]
+        header["circuits"].append({
+            "id": circuit["id"],
+            "alice": len(circuit.get("alice", [])),
+            "bob": len(circuit.get("bob", [])),
+            "out": len(circuit["out"]),
+            "gates": len(gates),
+        })
+        arrays += [
+            array("q", circuit.get("alice", [])),
+            array("q", circuit.get("bob", [])),
+            array("q", circuit["out"]),
+            array("q", [gate["id"] for gate in gates]),
+            array("q", [gate["in"][0] for gate in gates]),
+            array("q", [gate["in"][1] if len(gate["in"]) > 1 else -1
+                        for gate in gates]),
+            array("B", [yao.GATE_CODES[gate["type"]] for gate in gates]),
+        ]
+    payload = b"".join(values.tobytes() for values in arrays)
+    header["digest"] = hashlib.sha256(payload).hexdigest()
+    header = json.dumps(header).encode()
+    header += b" " * (-len(header) % 8)  # keep the int64 arrays aligned
+    return MAGIC + struct.pack("<Q", len(header)) + header + payload
+
+
+def load_circuits(data):
+    """Read circuits from the bytes written by dump_circuits.
+
+    Args:
+        data: A bytes-like object.
+
+    Returns:
+        A dict as read from a circuit JSON file.
+
+    Raises:
+        ValueError: The data is not a valid dump of this machine.
+    """
+    data = memoryview(data)
+    start = len(MAGIC) + 8
+    if len(data) < start or bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a cached circuit")
+    (length,) = struct.unpack("<Q", data[len(MAGIC):start])
+    header = json.loads(bytes(data[start:start + length]))  # a ValueError if truncated
+    payload = data[start + length:]
+    if (not isinstance(header, dict)
+            or not {"name", "byteorder", "digest", "circuits"} <= header.keys()
+            or header["byteorder"] != sys.byteorder
+            or hashlib.sha256(payload).hexdigest() != header["digest"]):
+        raise ValueError("Corrupted cached circuit")
+
+    offset = 0
+
+    def take(typecode, count):
+        nonlocal offset
+        size = array(typecode).itemsize * count
+        values = payload[offset:offset + size].cast(typecode).tolist()
+        offset += size
+        return values
+
+    circuits = []
+    try:
+        for spec in header["circuits"]:
+            alice = take("q", spec["alice"])
+            bob = take("q", spec["bob"])
+            out = take("q", spec["out"])
+            gate_ids, in_a, in_b = (take("q", spec["gates"]) for _ in range(3))
+            types = [yao.GATE_TYPES[code] for code in take("B", spec["gates"])]
+            gates = [{"id": g, "type": t, "in": [a] if b < 0 else [a, b]}
+                     for g, t, a, b in zip(gate_ids, types, in_a, in_b)]
+            circuits.append({"id": spec["id"], "alice": alice, "bob": bob,
+                             "out": out, "gates": gates})
+    except (KeyError, IndexError, TypeError) as error:  # sizes or IDs missing or wrong
+        raise ValueError("Corrupted cached circuit") from error
+    if offset != len(payload):
+        raise ValueError("Corrupted cached circuit")
+    return {"name": header["name"], "circuits": circuits}
+
+
+class CircuitCache:
+    """A cache of the circuits built by circuit_generator.build_circuit.
+
+    Circuits are kept in memory, the least recently used being evicted
+    first, and on disk in the format of dump_circuits, one file per key.
+    Cached circuits are shared and must not be modified.
+
+    Attributes:
+        directory: The directory of the cached files, None to only cache
+            circuits in memory.
+        capacity: The number of circuits kept in memory.
+        memory_hits: The number of lookups found in memory.
+        disk_hits: The number of lookups found on disk.
+        misses: The number of lookups that built the circuits.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY, capacity=DEFAULT_CAPACITY):
+        self.directory = directory
+        self.capacity = capacity
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key):
+        """Return the circuits of a key, or None if they are not cached."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return self._entries[key]
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as cache_file:
+                circuits = load_circuits(cache_file.read())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            os.remove(self._path(key))
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, circuits)
+        return circuits
+
+    def put(self, key, circuits):
+        """Cache the circuits of a key in memory and on disk."""
+        self._remember(key, circuits)
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"  # Alices may run in threads
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(dump_circuits(circuits))
+        os.replace(tmp_path, self._path(key))  # readers never see a partial file
+
+    def _remember(self, key, circuits):
+        with self._lock:
+            self._entries[key] = circuits
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, params, optimize=False, verbose=False):
+        """Return the circuits built with 'params', building them on a miss.
+
+        Args:
+            params: A dict of keyword arguments of
+                circuit_generator.build_circuit.
+            optimize: Optional; cache the circuits as optimized by
+                optimizer.optimize_circuits (Default: False).
+            verbose: Optional; print the statistics of the circuits built
+                and optimized on a miss (Default: False).
+        """
+        key = cache_key(params, optimize)
+        circuits = self.get(key)
+        if circuits is None:
+            with self._lock:
+                self.misses += 1
+            circuits = circuit_generator.build_circuit(**params, verbose=verbose)
+            if optimize:
+                circuits = optimizer.optimize_circuits(circuits, verbose)
+            self.put(key, circuits)
+        return circuits
+
+    def stats(self):
+        """Return the hit and miss counts."""
+        with self._lock:
+            return {"memory_hits": self.memory_hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """Return the cache shared by the Alices of this process."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CircuitCache()
+    return _default_cache
@@ -1,199 +1,697 @@
-import os
-
-"""
-IMPORTANT: don't move this script 
-"""
-
-"""
-:param bit_number: the number of bits involved in the operation
-:param start_index: the first id of the input
-"""
-def addition(bits_number, start_index=1):
-    index = start_index
-    # creating the circuit
-    step = bits_number
-    gates = []
-    alice = []
-    bob = []
-    outputs = []
-
-    for i in range(0, bits_number):
-        alice.append(index)
-        index += 1
-
-    for i in range(0, bits_number):
-        bob.append(index)
-        index += 1
-
-    carry_index = None
-
-    for i in range(1, bits_number+1):
-        if i == 1:
-            # we don't have the carry
-            gates.append({"id": index, "type": "XOR", "in": [i, i+step]})
-            outputs.append(index)  # saving output
-            index += 1
-            gates.append({"id": index, "type": "AND", "in": [i, i+step]})
-            carry_index = index
-            if bits_number == i:
-                outputs.append(carry_index)
-            index += 1
-
-        else:
-            # we have the carry
-            gates.append({"id": index, "type": "XOR", "in": [i, i + step]})
-            xor_result = index
-            index += 1
-            gates.append({"id": index, "type": "AND", "in": [i, i + step]})
-            and_result_1 = index
-            index += 1
-            gates.append({"id": index, "type": "XOR", "in": [xor_result, carry_index]})
-            outputs.append(index)  # save output
-            index += 1
-            gates.append({"id": index, "type": "AND", "in": [xor_result, carry_index]})
-            and_result_2 = index
-            index += 1
-            gates.append({"id": index, "type": "OR", "in": [and_result_1, and_result_2]})
-            carry_index = index
-            index += 1
-            if bits_number == i:
-                outputs.append(carry_index)
-
-    return alice, bob, outputs, gates
-
-
-"""
-:param bit_length: the number of bits involved in the operation
-:param alice_set_cardinality: the number of values of alice's set
-"""
-def compare(bit_length, alice_set_cardinality):
-    b = bit_length
-    k = alice_set_cardinality
-
-    gates = []
-    alice = []
-    bob = []
-    outputs = []
-
-    index = 0
-
-    for i in range(0, b*k):
-        index += 1
-        alice.append(index)
-
-    for i in range(0, b):
-        index += 1
-        bob.append(index)
-
-    index = index + 1  # so I can start from this index for the following loops
-
-    equality_gates_indexes = []
-    for value_index in range(k):
-        not_indexes = []
-        for bit_index in range(b):
-            xor_index = index
-            gates.append({"id": index, "type": "XOR", "in": [alice[b*value_index+bit_index], bob[bit_index]]})
-            index += 1
-            not_index = index
-            gates.append({"id": index, "type": "NOT", "in": [xor_index]})
-            not_indexes.append(not_index)
-            index += 1
-
-        and_index = not_indexes[0]
-        for i in range(1, len(not_indexes)):
-            gates.append({"id": index, "type": "AND", "in": [and_index, not_indexes[i]]})
-            and_index = index
-            index += 1
-
-        equality_gates_indexes.append(and_index)
-
-    ## setting equality output bit ####
-    equality_index = equality_gates_indexes[0]
-    for i in range(1, len(equality_gates_indexes)):
-        gates.append({"id": index, "type": "OR", "in": [equality_index, equality_gates_indexes[i]]})
-        equality_index = index
-        index += 1
-
-    outputs.append(equality_index)
-
-    ## setting equal value ##
-    for bit_index in range(b):
-        check_gates = []
-        for value_index in range(k):
-            gates.append({"id": index, "type": "AND", "in": [alice[value_index*b+bit_index], equality_gates_indexes[value_index]]})
-            check_gates.append(index)
-            index += 1
-
-        first_or_index = check_gates[0]
-        for index_check_gate in range(1, len(check_gates)):
-            gates.append({"id": index, "type": "OR", "in": [first_or_index, check_gates[index_check_gate]]})
-            first_or_index = index
-            index += 1
-
-        outputs.append(first_or_index)
-
-    return alice, bob, outputs, gates
-
-
-"""
-:param file_name: the name of the created file
-:param bit_number: the major number of bits the circuit will have to deal with
-:param name: the name of the circuit
-:param id_name: the id name of the circuit
-:param operation: the type of circuit you want to build (0: sum, 1: compare)
-:param alice_set_cardinality: useful only if operation=1
-
-It creates the json file that contains the circuit for the operation. The file will be saved within ./circuits
-"""
-
-
-def create_circuit(file_name, bit_number, name, id_name, operation=0, alice_set_cardinality=None):
-    circuit = {"name": name, "circuits": [{}]}
-
-    # cleaning the filename
-    json_path = os.path.dirname(__file__)+"/circuits/"+file_name
-    json_path = json_path.replace(".json", "")
-    json_path = json_path + '.json'
-
-    if operation == 0:
-        alice, bob, outs, gates = addition(bit_number, 1)
-        out = outs
-
-        circuit["circuits"][0]["id"] = id_name
-        circuit["circuits"][0]["alice"] = alice
-        circuit["circuits"][0]["bob"] = bob
-        circuit["circuits"][0]["out"] = out
-        circuit["circuits"][0]["gates"] = gates
-
-        circuit_string = str(circuit).replace('\'', '"')
-
-        with open(json_path, mode='w+') as json_file:  # create file if not exists
-            json_file.write(circuit_string)
-            json_file.close()
-
-    if operation == 1:
-        alice, bob, outs, gates = compare(bit_number, alice_set_cardinality)
-        out = outs
-
-        circuit["circuits"][0]["id"] = id_name
-        circuit["circuits"][0]["alice"] = alice
-        circuit["circuits"][0]["bob"] = bob
-        circuit["circuits"][0]["out"] = out
-        circuit["circuits"][0]["gates"] = gates
-
-        circuit_string = str(circuit).replace('\'', '"')
-
-        with open(json_path, mode='w+') as json_file:  # create file if not exists
-            json_file.write(circuit_string)
-            json_file.close()
-
-    return json_path
-
-
-"""
-How to call the method:
-> create_circuit(file_name, num_bits, name, id_name, operation (optional), alice_set_cardinality (optional))
-"""
-
-
-
+import math
+import os
+import secrets
+import util
+
+"""
+IMPORTANT: don't move this script 
+"""
+
+# Adders built by addition:
+#   ripple: ripple-carry adder, depth O(n)
+#   kogge-stone: parallel-prefix adder, depth O(log n), O(n log n) AND gates
+#   brent-kung: parallel-prefix adder, depth O(log n), O(n) AND gates
+#   carry-select: blocks of sqrt(n) bits added for both carries, depth O(sqrt(n))
+ADDERS = ("ripple", "kogge-stone", "brent-kung", "carry-select")
+
+"""
+:param bit_number: the number of bits involved in the operation
+:param start_index: the first id of the input
+:param adder: the type of adder, see ADDERS
+
+The outputs are the sum bits, least significant first, followed by the carry.
+"""
+def addition(bits_number, start_index=1, adder="ripple"):
+    if adder not in ADDERS:
+        raise ValueError(f"Unknown adder '{adder}'")
+    index = start_index
+    # creating the circuit
+    step = bits_number
+    gates = []
+    alice = []
+    bob = []
+    outputs = []
+
+    for i in range(0, bits_number):
+        alice.append(index)
+        index += 1
+
+    for i in range(0, bits_number):
+        bob.append(index)
+        index += 1
+
+    if adder in ("kogge-stone", "brent-kung"):
+        outputs, gates = parallel_prefix_adder(alice, bob, index, adder)
+        return alice, bob, outputs, gates
+    if adder == "carry-select":
+        outputs, gates = carry_select_adder(alice, bob, index)
+        return alice, bob, outputs, gates
+
+    carry_index = None
+
+    for i in range(1, bits_number+1):
+        if i == 1:
+            # we don't have the carry
+            gates.append({"id": index, "type": "XOR", "in": [i, i+step]})
+            outputs.append(index)  # saving output
+            index += 1
+            gates.append({"id": index, "type": "AND", "in": [i, i+step]})
+            carry_index = index
+            if bits_number == i:
+                outputs.append(carry_index)
+            index += 1
+
+        else:
+            # we have the carry
+            gates.append({"id": index, "type": "XOR", "in": [i, i + step]})
+            xor_result = index
+            index += 1
+            gates.append({"id": index, "type": "AND", "in": [i, i + step]})
+            and_result_1 = index
+            index += 1
+            gates.append({"id": index, "type": "XOR", "in": [xor_result, carry_index]})
+            outputs.append(index)  # save output
+            index += 1
+            gates.append({"id": index, "type": "AND", "in": [xor_result, carry_index]})
+            and_result_2 = index
+            index += 1
+            gates.append({"id": index, "type": "OR", "in": [and_result_1, and_result_2]})
+            carry_index = index
+            index += 1
+            if bits_number == i:
+                outputs.append(carry_index)
+
+    return alice, bob, outputs, gates
+
+
+"""
+:param alice: the wires of the first operand, least significant bit first
+:param bob: the wires of the second operand, least significant bit first
+:param index: the id of the first gate
+:param adder: kogge-stone or brent-kung
+:return: the output wires (sum bits and carry) and the gates
+
+The prefix of bits i..j is a pair (G, P) of generate and propagate bits and two adjacent prefixes combine into
+(G_hi ^ (P_hi & G_lo), P_hi & P_lo). G_hi and P_hi & G_lo are never both 1, so the XOR (a free gate with the
+free-xor scheme) replaces the usual OR. P is not computed for prefixes starting at bit 0.
+"""
+def parallel_prefix_adder(alice, bob, index, adder):
+    gates = []
+
+    def gate(gate_type, *inputs):
+        nonlocal index
+        gates.append({"id": index, "type": gate_type, "in": list(inputs)})
+        index += 1
+        return index - 1
+
+    n = len(alice)
+    propagate = [gate("XOR", alice[i], bob[i]) for i in range(n)]
+    generate = [gate("AND", alice[i], bob[i]) for i in range(n)]
+    prefix_g, prefix_p = list(generate), list(propagate)
+    low = list(range(n))  # lowest bit of each prefix
+
+    def combine(i, j):  # prefix i absorbs the adjacent lower prefix j
+        prefix_g[i] = gate("XOR", prefix_g[i], gate("AND", prefix_p[i], prefix_g[j]))
+        if low[j] > 0:
+            prefix_p[i] = gate("AND", prefix_p[i], prefix_p[j])
+        low[i] = low[j]
+
+    distances = []
+    d = 1
+    while d < n:
+        distances.append(d)
+        d *= 2
+
+    if adder == "kogge-stone":
+        for d in distances:
+            for i in reversed(range(d, n)):  # from the top, so prefix j is the one of the previous level
+                combine(i, i - d)
+    else:
+        for d in distances:  # up-sweep
+            for i in range(2 * d - 1, n, 2 * d):
+                combine(i, i - d)
+        for d in reversed(distances):  # down-sweep
+            for i in range(3 * d - 1, n, 2 * d):
+                combine(i, i - d)
+
+    # carry into bit i is the generate bit of prefix 0..i-1
+    outputs = [propagate[0]] + [gate("XOR", propagate[i], prefix_g[i - 1]) for i in range(1, n)]
+    outputs.append(prefix_g[n - 1])
+    return outputs, gates
+
+
+"""
+:param alice: the wires of the first operand, least significant bit first
+:param bob: the wires of the second operand, least significant bit first
+:param index: the id of the first gate
+:return: the output wires (sum bits and carry) and the gates
+
+Bits are split into blocks of about sqrt(n) bits. Each block but the first is added twice, for an incoming carry
+of 0 and 1, and the incoming carry selects the results with multiplexers x ^ (c & (x ^ y)).
+"""
+def carry_select_adder(alice, bob, index):
+    gates = []
+
+    def gate(gate_type, *inputs):
+        nonlocal index
+        gates.append({"id": index, "type": gate_type, "in": list(inputs)})
+        index += 1
+        return index - 1
+
+    def ripple(bits, carry_in):  # full adders with s = p ^ c and c' = g ^ (p & c)
+        sums = []
+        carry = None
+        for i in bits:
+            propagate = gate("XOR", alice[i], bob[i])
+            if carry is None:
+                if carry_in:
+                    sums.append(gate("NOT", propagate))
+                    carry = gate("OR", alice[i], bob[i])
+                else:
+                    sums.append(propagate)
+                    carry = gate("AND", alice[i], bob[i])
+                continue
+            sums.append(gate("XOR", propagate, carry))
+            carry = gate("XOR", gate("AND", alice[i], bob[i]), gate("AND", propagate, carry))
+        return sums, carry
+
+    def mux(carry, wire0, wire1):
+        return gate("XOR", wire0, gate("AND", carry, gate("XOR", wire0, wire1)))
+
+    n = len(alice)
+    size = math.isqrt(n - 1) + 1  # ceil(sqrt(n))
+    blocks = [range(i, min(i + size, n)) for i in range(0, n, size)]
+
+    outputs, carry = ripple(blocks[0], 0)
+    for block in blocks[1:]:
+        sums0, carry0 = ripple(block, 0)
+        sums1, carry1 = ripple(block, 1)
+        outputs += [mux(carry, s0, s1) for s0, s1 in zip(sums0, sums1)]
+        carry = mux(carry, carry0, carry1)
+    outputs.append(carry)
+    return outputs, gates
+
+
+"""
+:param gates: the list of gates where the new gates are appended
+:param index: the id of the first new gate
+:param wires: the wires to reduce (at least one)
+:param gate_type: the type of the 2-input gates (e.g. AND, OR)
+:param balanced: build a balanced binary tree of depth log2(len(wires)) instead of a chain
+:return: the reduced wire and the next free id
+
+Both shapes use len(wires) - 1 gates.
+"""
+def reduction_tree(gates, index, wires, gate_type, balanced=False):
+    wires = list(wires)
+    if not balanced:
+        result = wires[0]
+        for wire in wires[1:]:
+            gates.append({"id": index, "type": gate_type, "in": [result, wire]})
+            result = index
+            index += 1
+        return result, index
+
+    while len(wires) > 1:
+        reduced = []
+        for i in range(0, len(wires) - 1, 2):
+            gates.append({"id": index, "type": gate_type, "in": [wires[i], wires[i + 1]]})
+            reduced.append(index)
+            index += 1
+        if len(wires) % 2:  # the last wire goes up a level unchanged
+            reduced.append(wires[-1])
+        wires = reduced
+    return wires[0], index
+
+
+"""
+:param bit_length: the number of bits involved in the operation
+:param alice_set_cardinality: the number of values of alice's set
+:param balanced: reduce with balanced trees (O(log b + log k) depth) instead of chains (O(b + k) depth)
+"""
+def compare(bit_length, alice_set_cardinality, balanced=False):
+    b = bit_length
+    k = alice_set_cardinality
+
+    gates = []
+    alice = []
+    bob = []
+    outputs = []
+
+    index = 0
+
+    for i in range(0, b*k):
+        index += 1
+        alice.append(index)
+
+    for i in range(0, b):
+        index += 1
+        bob.append(index)
+
+    index = index + 1  # so I can start from this index for the following loops
+
+    equality_gates_indexes = []
+    for value_index in range(k):
+        not_indexes = []
+        for bit_index in range(b):
+            xor_index = index
+            gates.append({"id": index, "type": "XOR", "in": [alice[b*value_index+bit_index], bob[bit_index]]})
+            index += 1
+            not_index = index
+            gates.append({"id": index, "type": "NOT", "in": [xor_index]})
+            not_indexes.append(not_index)
+            index += 1
+
+        and_index, index = reduction_tree(gates, index, not_indexes, "AND", balanced)
+        equality_gates_indexes.append(and_index)
+
+    ## setting equality output bit ####
+    equality_index, index = reduction_tree(gates, index, equality_gates_indexes, "OR", balanced)
+    outputs.append(equality_index)
+
+    ## setting equal value ##
+    for bit_index in range(b):
+        check_gates = []
+        for value_index in range(k):
+            gates.append({"id": index, "type": "AND", "in": [alice[value_index*b+bit_index], equality_gates_indexes[value_index]]})
+            check_gates.append(index)
+            index += 1
+
+        first_or_index, index = reduction_tree(gates, index, check_gates, "OR", balanced)
+        outputs.append(first_or_index)
+
+    return alice, bob, outputs, gates
+
+
+"""
+:param bit_length: the number of bits of each value
+:param alice_set_cardinality: the number of values of alice's set
+:param bob_set_cardinality: the number of values of bob's set
+:param balanced: reduce with balanced trees instead of chains
+
+Compares every value of alice with every value of bob in a single circuit. For each value of bob, the outputs are
+the bit telling whether alice has the value, followed by the value bits (least significant first) if she has it and
+zeros otherwise.
+"""
+def all_pairs_intersection(bit_length, alice_set_cardinality, bob_set_cardinality, balanced=False):
+    b = bit_length
+    k = alice_set_cardinality
+    m = bob_set_cardinality
+
+    gates = []
+    alice = list(range(1, b*k + 1))
+    bob = list(range(b*k + 1, b*(k + m) + 1))
+    outputs = []
+
+    index = b*(k + m) + 1
+
+    for bob_index in range(m):
+        bob_value = bob[b*bob_index:b*(bob_index + 1)]
+        equality_gates_indexes = []
+        for value_index in range(k):
+            xnor_indexes = []
+            for bit_index in range(b):
+                gates.append({"id": index, "type": "XNOR", "in": [alice[b*value_index+bit_index],
+                                                                   bob_value[bit_index]]})
+                xnor_indexes.append(index)
+                index += 1
+
+            and_index, index = reduction_tree(gates, index, xnor_indexes, "AND", balanced)
+            equality_gates_indexes.append(and_index)
+
+        match_index, index = reduction_tree(gates, index, equality_gates_indexes, "OR", balanced)
+        outputs.append(match_index)
+
+        for bit_index in range(b):
+            gates.append({"id": index, "type": "AND", "in": [match_index, bob_value[bit_index]]})
+            outputs.append(index)
+            index += 1
+
+    return alice, bob, outputs, gates
+
+
+"""
+:param alice_set_cardinality: the number of values of alice's set
+:param bob_set_cardinality: the number of values of bob's set
+:return: the number of values of the merged list (a power of two), of which alice holds all but bob's values
+"""
+def merged_list_size(alice_set_cardinality, bob_set_cardinality):
+    return max(2, 1 << (alice_set_cardinality + bob_set_cardinality - 1).bit_length())
+
+
+"""
+:param size: the number of elements of a Benes network (a power of two)
+:return: the number of switches of the network
+"""
+def benes_switch_count(size):
+    if size < 2:
+        return 0
+    if size == 2:
+        return 1
+    return size + 2 * benes_switch_count(size // 2)
+
+
+"""
+:param permutation: a list mapping each input position of a Benes network to its output position
+:return: the switch bits routing the permutation, in the order consumed by benes_network
+
+Looping algorithm: the two inputs (and the two outputs) of an outer switch go through different subnetworks.
+"""
+def benes_switch_bits(permutation):
+    size = len(permutation)
+    if size < 2:
+        return []
+    if size == 2:
+        return [int(permutation[0] == 1)]
+
+    inverse = [0] * size
+    for position, destination in enumerate(permutation):
+        inverse[destination] = position
+
+    subnetwork = [None] * size  # 0: top, 1: bottom, for each input
+    for start in range(0, size, 2):
+        position = start
+        while subnetwork[position] is None:
+            subnetwork[position] = 0
+            subnetwork[position ^ 1] = 1
+            # the input sent to the other output of the same output switch goes through the bottom subnetwork
+            position = inverse[permutation[position] ^ 1] ^ 1
+
+    top, bottom = [0] * (size // 2), [0] * (size // 2)
+    for position, destination in enumerate(permutation):
+        (bottom if subnetwork[position] else top)[position // 2] = destination // 2
+
+    input_bits = [subnetwork[2 * i] for i in range(size // 2)]
+    output_bits = [subnetwork[inverse[2 * j]] for j in range(size // 2)]
+    return input_bits + benes_switch_bits(top) + benes_switch_bits(bottom) + output_bits
+
+
+"""
+:param bit_length: the number of bits of each value
+:param alice_set_cardinality: the number of values of alice's set
+:param bob_set_cardinality: the number of values of bob's set
+:param balanced: reduce the equality bits with balanced trees instead of chains
+
+Sort-compare-shuffle set intersection with O((k + m) log(k + m) b) gates:
+    - alice's values sorted in ascending order, padded with dummy values, followed by bob's values sorted in
+      descending order form a bitonic list of merged_list_size(k, m) values of b + 1 bits (the top bit is set for
+      dummy values only), merged by a bitonic merge network
+    - each value is compared with the next one, two equal values being a common value
+    - the (match bit, value bits if it matches) elements are shuffled by a Benes network whose switches are bob's
+      inputs, so the positions of common values, which depend on the ranks of the values, are not revealed
+alice's inputs are her values (see sort_compare_shuffle_alice_values), bob's inputs are his values then the switch
+bits (see sort_compare_shuffle_bob_bits). The outputs are merged_list_size(k, m) elements of b + 1 bits: the match
+bit followed by the value bits, least significant first.
+"""
+def sort_compare_shuffle(bit_length, alice_set_cardinality, bob_set_cardinality, balanced=False):
+    b = bit_length
+    w = b + 1
+    m = bob_set_cardinality
+    size = merged_list_size(alice_set_cardinality, bob_set_cardinality)
+
+    alice = list(range(1, w*(size - m) + 1))
+    bob = list(range(w*(size - m) + 1, w*size + benes_switch_count(size) + 1))
+    gates = []
+    index = len(alice) + len(bob) + 1
+
+    def gate(gate_type, *inputs):
+        nonlocal index
+        gates.append({"id": index, "type": gate_type, "in": list(inputs)})
+        index += 1
+        return index - 1
+
+    def greater(x, y):  # x > y, i.e. not (y >= x) with the carry of y + not(x) + 1, 1 AND per bit
+        carry = gate("OR", y[0], gate("NOT", x[0]))
+        for i in range(1, len(x)):
+            carry = gate("XOR", carry, gate("AND", gate("XOR", y[i], carry), gate("XNOR", x[i], carry)))
+        return gate("NOT", carry)
+
+    def swap(bit, x, y):  # (y, x) if bit else (x, y), 1 AND per bit
+        masks = [gate("AND", bit, gate("XOR", x[i], y[i])) for i in range(len(x))]
+        return ([gate("XOR", x[i], masks[i]) for i in range(len(x))],
+                [gate("XOR", y[i], masks[i]) for i in range(len(y))])
+
+    values = [alice[w*i:w*(i + 1)] for i in range(size - m)] + [bob[w*i:w*(i + 1)] for i in range(m)]
+
+    # bitonic merge, in ascending order
+    half = size // 2
+    while half:
+        for start in range(0, size, 2 * half):
+            for i in range(start, start + half):
+                x, y = values[i], values[i + half]
+                values[i], values[i + half] = swap(greater(x, y), x, y)
+        half //= 2
+
+    # compare adjacent values, the dummy values being distinct and larger than all values
+    elements = []
+    for i in range(size - 1):
+        xnor_indexes = [gate("XNOR", values[i][bit], values[i + 1][bit]) for bit in range(w)]
+        match_index, index = reduction_tree(gates, index, xnor_indexes, "AND", balanced)
+        elements.append([match_index] + [gate("AND", match_index, values[i][bit]) for bit in range(b)])
+    zero = gate("XOR", alice[0], alice[0])
+    elements.append([zero] * w)
+
+    # shuffle
+    switches = iter(bob[w*m:])
+
+    def benes_network(elements):
+        if len(elements) == 1:
+            return elements
+        if len(elements) == 2:
+            return list(swap(next(switches), elements[0], elements[1]))
+        top, bottom = [], []
+        for i in range(0, len(elements), 2):
+            x, y = swap(next(switches), elements[i], elements[i + 1])
+            top.append(x)
+            bottom.append(y)
+        top, bottom = benes_network(top), benes_network(bottom)
+        outputs = []
+        for x, y in zip(top, bottom):
+            outputs += swap(next(switches), x, y)
+        return outputs
+
+    outputs = [wire for element in benes_network(elements) for wire in element]
+    return alice, bob, outputs, gates
+
+
+"""
+:param alice_set: the values of alice
+:param bob_set_cardinality: the number of distinct values of bob's set
+:param bit_length: the number of bits of each value
+:return: alice's input values of sort_compare_shuffle: her distinct values sorted in ascending order followed by
+         distinct dummy values, whose bit 'bit_length' is set
+
+The duplicates are removed, equal neighbours of the merged list being matches: the circuit is built for
+len(set(alice_set)) values of alice.
+"""
+def sort_compare_shuffle_alice_values(alice_set, bob_set_cardinality, bit_length):
+    alice_values = sorted(dict.fromkeys(alice_set))
+    dummies = merged_list_size(len(alice_values), bob_set_cardinality) - len(alice_values) - bob_set_cardinality
+    if dummies > 1 << bit_length:
+        raise ValueError(f"{dummies} dummy values do not fit in {bit_length} bits")
+    return alice_values + [(1 << bit_length) | i for i in range(dummies)]
+
+
+"""
+:param bob_set: the values of bob
+:param alice_set_cardinality: the number of distinct values of alice's set
+:param bit_length: the number of bits of each value
+:return: bob's input bits of sort_compare_shuffle: his distinct values sorted in descending order (bit_length + 1
+         bits each, least significant first), then the switch bits of a random shuffle
+
+The duplicates are removed as in sort_compare_shuffle_alice_values: the circuit is built for len(set(bob_set))
+values of bob.
+"""
+def sort_compare_shuffle_bob_bits(bob_set, alice_set_cardinality, bit_length):
+    bob_values = sorted(dict.fromkeys(bob_set), reverse=True)
+    bits = []
+    for value in bob_values:
+        bits += [(value >> i) & 1 for i in range(bit_length + 1)]
+    permutation = list(range(merged_list_size(alice_set_cardinality, len(bob_values))))
+    secrets.SystemRandom().shuffle(permutation)
+    return bits + benes_switch_bits(permutation)
+
+
+"""
+:param bit_length: the number of bits of each value
+:param bin_capacities: the number of values of alice in each bin, bob has one value per bin
+:param batch_size: the number of bins of each circuit
+:param balanced: reduce with balanced trees instead of chains
+:return: a list of circuits (alice, bob, outputs, gates), one per batch of bins
+
+Compares the value of bob in each bin with the values of alice in the same bin, with one compare circuit per bin.
+Values have bit_length + 1 bits, the last one being set for the dummy values of empty slots. The bins of a batch are
+numbered one after the other in a single circuit. For each bin, the outputs are the ones of compare: the bit telling
+whether the values match, followed by the bit_length + 1 value bits (least significant first).
+"""
+def bucketed_intersection(bit_length, bin_capacities, batch_size, balanced=False):
+    batches = []
+    for start in range(0, len(bin_capacities), batch_size):
+        alice = []
+        bob = []
+        outputs = []
+        gates = []
+        offset = 0
+        for capacity in bin_capacities[start:start + batch_size]:
+            bin_alice, bin_bob, bin_outputs, bin_gates = compare(bit_length + 1, capacity, balanced)
+            alice += [wire + offset for wire in bin_alice]
+            bob += [wire + offset for wire in bin_bob]
+            outputs += [wire + offset for wire in bin_outputs]
+            for gate in bin_gates:
+                gates.append({"id": gate["id"] + offset, "type": gate["type"],
+                              "in": [wire + offset for wire in gate["in"]]})
+            offset = gates[-1]["id"]
+        batches.append((alice, bob, outputs, gates))
+    return batches
+
+
+"""
+:param alice_set: the values of alice
+:param seed: the key of the hash functions chosen by bob
+:param hashes: the number of hash functions
+:param bins: the number of bins of bob's cuckoo table
+:param stash_size: the number of values of bob's stash
+:param bit_length: the number of bits of each value
+:return: alice's bins: the bins of her simple hashing table, each one padded to the same capacity with the dummy
+         value 2^bit_length, followed by a bin with all her values for each stash slot of bob
+"""
+def bucketed_alice_bins(alice_set, seed, hashes, bins, stash_size, bit_length):
+    table = util.simple_hash(alice_set, seed, hashes, bins)
+    # a public bound, the actual maximum load is only used when it is exceeded (probability below 2^-40)
+    capacity = max([util.max_bin_load(hashes * len(alice_set), bins)] + [len(values) for values in table])
+    dummy = 1 << bit_length
+    alice_bins = [values + [dummy] * (capacity - len(values)) for values in table]
+    return alice_bins + [list(dict.fromkeys(alice_set)) for _ in range(stash_size)]
+
+
+"""
+:param table: the bins of bob's cuckoo table, holding a value or None
+:param stash: the values of bob's stash
+:param stash_size: the number of values of bob's stash
+:param bit_length: the number of bits of each value
+:return: bob's values, one per bin of bucketed_alice_bins: the values of his cuckoo table then of his stash, where
+         the empty slots hold the dummy value 2^bit_length + 1 (which never matches alice's dummy value)
+"""
+def bucketed_bob_values(table, stash, stash_size, bit_length):
+    dummy = (1 << bit_length) | 1
+    values = [dummy if value is None else value for value in table]
+    return values + stash + [dummy] * (stash_size - len(stash))
+
+
+"""
+:param inputs: the input wires of the circuit
+:param gates: the gates of the circuit, each one after the gates computing its inputs
+:return: a dict with the number of gates, the depth (number of levels) and the width (maximum number of gates
+         of a level) of the circuit
+"""
+def circuit_stats(inputs, gates):
+    depth = dict.fromkeys(inputs, 0)
+    widths = []
+    for gate in gates:
+        level = max(depth[wire] for wire in gate["in"])
+        depth[gate["id"]] = level + 1
+        if level == len(widths):
+            widths.append(0)
+        widths[level] += 1
+    return {"gates": len(gates), "depth": len(widths), "width": max(widths, default=0)}
+
+
+"""
+:param bit_number: the major number of bits the circuit will have to deal with
+:param name: the name of the circuit
+:param id_name: the id name of the circuit
+:param operation: the type of circuit you want to build (0: sum, 1: compare, 2: all-pairs intersection,
+                  3: sort-compare-shuffle intersection, 4: bucketed intersection)
+:param alice_set_cardinality: useful only if operation=1, 2 or 3
+:param balanced: useful only if operation=1, 2, 3 or 4, build the circuit with balanced reduction trees
+:param adder: useful only if operation=0, the type of adder (see ADDERS)
+:param bob_set_cardinality: useful only if operation=2 or 3
+:param bin_capacities: useful only if operation=4, the number of values of alice in each bin
+:param batch_size: useful only if operation=4, the number of bins of each circuit
+:param verbose: print the number of gates, depth and width of each circuit
+:return: the circuits of the operation, as read from a circuit json file ({"name": ..., "circuits": [...]})
+"""
+def build_circuit(bit_number, name, id_name, operation=0, alice_set_cardinality=None, balanced=False,
+                  adder="ripple", bob_set_cardinality=None, bin_capacities=None, batch_size=256, verbose=False):
+    circuit = {"name": name, "circuits": [{}]}
+
+    if operation == 0:
+        alice, bob, outs, gates = addition(bit_number, 1, adder)
+    if operation == 1:
+        alice, bob, outs, gates = compare(bit_number, alice_set_cardinality, balanced)
+    if operation == 2:
+        alice, bob, outs, gates = all_pairs_intersection(bit_number, alice_set_cardinality, bob_set_cardinality,
+                                                         balanced)
+    if operation == 3:
+        alice, bob, outs, gates = sort_compare_shuffle(bit_number, alice_set_cardinality, bob_set_cardinality,
+                                                       balanced)
+
+    if operation == 4:
+        batches = bucketed_intersection(bit_number, bin_capacities, batch_size, balanced)
+
+        circuit["circuits"] = []
+        for batch_index, (alice, bob, outs, gates) in enumerate(batches):
+            circuit["circuits"].append({"id": f"{id_name}_{batch_index}", "alice": alice, "bob": bob,
+                                        "out": outs, "gates": gates})
+    else:
+        circuit["circuits"][0]["id"] = id_name
+        circuit["circuits"][0]["alice"] = alice
+        circuit["circuits"][0]["bob"] = bob
+        circuit["circuits"][0]["out"] = outs
+        circuit["circuits"][0]["gates"] = gates
+
+    for circuit_spec in circuit["circuits"] if verbose else []:
+        stats = circuit_stats(circuit_spec["alice"] + circuit_spec["bob"], circuit_spec["gates"])
+        print(f"Circuit {circuit_spec['id']}: {stats['gates']} gates, depth {stats['depth']}, "
+              f"width {stats['width']}")
+
+    return circuit
+
+
+"""
+:param file_name: the name of the created file
+:param bit_number: the major number of bits the circuit will have to deal with
+:param name: the name of the circuit
+:param id_name: the id name of the circuit
+:param operation: the type of circuit you want to build, see build_circuit
+:param alice_set_cardinality: see build_circuit
+:param balanced: see build_circuit
+:param adder: see build_circuit
+:param bob_set_cardinality: see build_circuit
+:param bin_capacities: see build_circuit
+:param batch_size: see build_circuit
+:param verbose: see build_circuit
+
+It creates the json file that contains the circuit for the operation. The file will be saved within ./circuits
+"""
+
+
+def create_circuit(file_name, bit_number, name, id_name, operation=0, alice_set_cardinality=None,
+                   balanced=False, adder="ripple", bob_set_cardinality=None, bin_capacities=None,
+                   batch_size=256, verbose=False):
+    circuit = build_circuit(bit_number, name, id_name, operation, alice_set_cardinality, balanced, adder,
+                            bob_set_cardinality, bin_capacities, batch_size, verbose)
+
+    # cleaning the filename
+    json_path = os.path.dirname(__file__)+"/circuits/"+file_name
+    json_path = json_path.replace(".json", "")
+    json_path = json_path + '.json'
+
+    circuit_string = str(circuit).replace('\'', '"')
+
+    with open(json_path, mode='w+') as json_file:  # create file if not exists
+        json_file.write(circuit_string)
+        json_file.close()
+
+    return json_path
+
+
+"""
+How to call the method:
+> create_circuit(file_name, num_bits, name, id_name, operation (optional), alice_set_cardinality (optional),
+                 balanced (optional), adder (optional), bob_set_cardinality (optional), bin_capacities (optional),
+                 batch_size (optional), verbose (optional))
+"""
+
+
+
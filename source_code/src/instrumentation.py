@@ -0,0 +1,153 @@
+import contextlib
+import os
+import time
+from collections import Counter, defaultdict
+
+PREFIX = "yao"  # prefix of the Prometheus metric names
+
+# Counters of a session (see Metrics.count)
+COUNTERS = {
+    "messages_sent": "Messages sent.",
+    "messages_received": "Messages received.",
+    "bytes_sent": "Bytes of the messages sent.",
+    "bytes_received": "Bytes of the messages received.",
+    "round_trips": "Messages received in reply to a message sent.",
+    "circuits": "Circuits garbled (Alice) or received (Bob).",
+    "evaluations": "Circuit evaluations, one per value of Bob's set for operation 1.",
+    "ots": "Oblivious transfers of Bob's input keys.",
+    "base_ots": "Public-key base OTs of the OT extension.",
+    "random_ots": "Random OTs added to the OT pool.",
+}
+
+
+class Metrics:
+    """Metrics of a session of a party.
+
+    Phases accumulate wall time, counters accumulate integers and gates are
+    counted by type, e.g. the gates garbled by Alice or evaluated by Bob.
+    Phases may nest, the time of an inner phase is then also part of the
+    outer one.
+
+    Args:
+        party: The name of the party, "alice" or "bob".
+
+    Attributes:
+        enabled: True, see NullMetrics.
+        party: The name of the party.
+        start: The time.time of the start of the session.
+        phases: A dict mapping each phase to its wall time in seconds.
+        counters: A dict mapping each counter to its value.
+        gates: A dict mapping a stage ("garbled" or "evaluated") to a
+            Counter of gate types.
+    """
+    enabled = True
+
+    def __init__(self, party):
+        self.party = party
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.phases = defaultdict(float)
+        self.counters = Counter()
+        self.gates = defaultdict(Counter)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Return a context manager adding its wall time to a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        """Add 'value' to a counter."""
+        self.counters[name] += value
+
+    def count_gates(self, stage, types):
+        """Count gates by type.
+
+        Args:
+            stage: "garbled" or "evaluated".
+            types: An iterable of gate types, e.g. "AND", or a mapping of
+                gate types to counts (see yao.gate_type_counts).
+        """
+        self.gates[stage].update(types)
+
+    def report(self):
+        """Return a dict of the metrics of the session, e.g. to dump as JSON."""
+        return {
+            "party": self.party,
+            "start": self.start,
+            "seconds": time.perf_counter() - self._start,
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+            "gates": {stage: dict(types) for stage, types in self.gates.items()},
+        }
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        party = _labels(party=self.party)
+        lines = [
+            f"# HELP {PREFIX}_session_start_time_seconds Start of the session, in seconds since the epoch.",
+            f"# TYPE {PREFIX}_session_start_time_seconds gauge",
+            f"{PREFIX}_session_start_time_seconds{party} {self.start}",
+            f"# HELP {PREFIX}_session_seconds Wall time of the session.",
+            f"# TYPE {PREFIX}_session_seconds gauge",
+            f"{PREFIX}_session_seconds{party} {time.perf_counter() - self._start}",
+            f"# HELP {PREFIX}_phase_seconds Wall time spent in each phase of the session.",
+            f"# TYPE {PREFIX}_phase_seconds gauge",
+        ]
+        lines += [f"{PREFIX}_phase_seconds{_labels(party=self.party, phase=phase)} {seconds}"
+                  for phase, seconds in sorted(self.phases.items())]
+        for name in sorted(set(COUNTERS) | set(self.counters)):
+            lines += [f"# HELP {PREFIX}_{name}_total {COUNTERS.get(name, name)}",
+                      f"# TYPE {PREFIX}_{name}_total counter",
+                      f"{PREFIX}_{name}_total{party} {self.counters[name]}"]
+        lines += [f"# HELP {PREFIX}_gates_total Gates garbled or evaluated, by type.",
+                  f"# TYPE {PREFIX}_gates_total counter"]
+        lines += [f"{PREFIX}_gates_total{_labels(party=self.party, stage=stage, type=gate_type)} {count}"
+                  for stage, types in sorted(self.gates.items()) for gate_type, count in sorted(types.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the metrics to a file in the Prometheus text format.
+
+        The file is replaced atomically, so that it can be read at any time,
+        e.g. by the textfile collector of the node exporter.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, mode="w") as metrics_file:
+            metrics_file.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+
+class NullMetrics:
+    """Metrics that record nothing, used when the metrics are disabled.
+
+    It has the methods of Metrics, which do nothing, so that instrumented
+    code does not test whether the metrics are enabled, except to skip
+    computing what it records.
+    """
+    enabled = False
+    _phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, value=1):
+        pass
+
+    def count_gates(self, stage, types):
+        pass
+
+    def report(self):
+        return None
+
+
+NULL_METRICS = NullMetrics()
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
@@ -1,31 +1,59 @@
 #!/usr/bin/env python3
+import asyncio
+import collections
+import json
+import pickle
 import ot
 import util
 import yao
 from abc import ABC, abstractmethod
+import circuit_cache
 import circuit_generator
+import instrumentation
+import optimizer
+import simulator
 import os
 import atexit
+import time
+import threading
 
 
 class YaoGarbler(ABC):
-    """An abstract class for Yao garblers (e.g. Alice)."""
-    def __init__(self, circuits):
-        circuits = util.parse_json(circuits)
+    """An abstract class for Yao garblers (e.g. Alice).
+
+    With lazy garbling, circuits are garbled while their tables are streamed
+    (see yao.GarbledCircuit.stream), so the entries have no garbled tables
+    and their output p-bits are only known after streaming.
+
+    The circuits are either the path of a circuit JSON file or its parsed
+    content. The garbling time and gates are recorded in 'metrics' (see
+    instrumentation.Metrics).
+    """
+    def __init__(self, circuits, scheme="classic", backend="aes-cbc", lazy=False, workers=1,
+                 metrics=instrumentation.NULL_METRICS):
+        if not isinstance(circuits, dict):
+            circuits = util.parse_json(circuits)
         self.name = circuits["name"]
         self.circuits = []
 
         for circuit in circuits["circuits"]:
-            garbled_circuit = yao.GarbledCircuit(circuit)
+            with metrics.phase("garbling"):
+                garbled_circuit = yao.GarbledCircuit(circuit, scheme=scheme, backend=backend,
+                                                     lazy=lazy, workers=workers)
+            metrics.count("circuits")
+            if metrics.enabled:
+                metrics.count_gates("garbled", yao.gate_type_counts(circuit))
             pbits = garbled_circuit.get_pbits()
             entry = {
                 "circuit": circuit,
+                "scheme": scheme,
+                "backend": backend,
                 "garbled_circuit": garbled_circuit,
-                "garbled_tables": garbled_circuit.get_garbled_tables(),
+                "garbled_tables": None if lazy else garbled_circuit.get_garbled_tables(),
                 "keys": garbled_circuit.get_keys(),
                 "pbits": pbits,
-                "pbits_out": {w: pbits[w]
-                              for w in circuit["out"]},
+                "pbits_out": None if lazy else {w: pbits[w]
+                                                for w in circuit["out"]},
             }
             self.circuits.append(entry)
 
@@ -55,10 +83,82 @@ class Alice(YaoGarbler):
         operation: Optional; Possible values:
                                 0: set sum
                                 1: common values between two sets
+                                2: common values between two sets, all
+                                   pairs compared in a single evaluation
+                                3: common values between two sets, with a
+                                   sort-compare-shuffle circuit
+                                4: common values between two sets, with
+                                   cuckoo and simple hashing into bins
                     Default: 0
+        prime_groups: Optional; path of a JSON file of precomputed prime
+            groups for the Oblivious Transfer (a new group is generated for
+            each session by default).
+        ot_mode: Optional; the ObliviousTransfer mode, "lockstep",
+            "batched", "extension" or "pool" (Default: lockstep).
+        ot_pool: Optional; a pair (size, threshold) configuring the random
+            OT pool of the "pool" mode (Default: (4096, 1024)).
+        scheme: Optional; the garbling scheme, see yao.SCHEMES
+            (Default: classic).
+        backend: Optional; the garbling backend, see yao.BACKENDS
+            (Default: aes-cbc).
+        wire_format: Optional; how circuits are sent to Bob, see
+            yao.WIRE_FORMATS (Default: pickle).
+        stream: Optional; a number of gates per chunk to garble the circuit
+            while streaming its tables to Bob, who evaluates each chunk as
+            it arrives (Default: None, the circuit is garbled and sent at
+            once). The chunks are always pickled.
+        workers: Optional; the number of processes garbling the circuits
+            (Default: 1), see yao.GarbledCircuit. Streamed circuits are
+            garbled in one process.
+        balanced: Optional; build the compare circuits with balanced
+            reduction trees instead of chains (Default: False).
+        adder: Optional; the adder of the set sum circuit, see
+            circuit_generator.ADDERS (Default: ripple).
+        bucketing: Optional; a tuple (hashes, stash, batch) configuring
+            operation 4: the number of hash functions, the stash size of
+            Bob's cuckoo table and the number of bins per circuit
+            (Default: (3, 0, 256)).
+        cache: Optional; look the circuits up in the circuit cache of the
+            process (see circuit_cache.get_default_cache) instead of
+            generating them into ./circuits (Default: True).
+        check: Optional; evaluate the circuits in plaintext on random
+            inputs before garbling them, see simulator.check_circuits
+            (Default: False).
+        optimize: Optional; optimize the circuits before garbling them,
+            see optimizer.optimize_circuits (Default: True).
+        circuit_stats: Optional; print the gates, depth and width of the
+            circuits built and their gate counts before and after the
+            optimization (Default: False).
+        metrics: Optional; record the metrics of the session in the
+            'metrics' attribute (see instrumentation.Metrics) and print
+            them at the end of start (Default: False).
+        metrics_file: Optional; a path where the metrics are written in
+            the Prometheus text format at the end of start, which implies
+            'metrics' (Default: None).
+        socket: Optional; the socket connected to Bob, e.g. an end of
+            util.loopback_pair (Default: a new util.GarblerSocket).
     """
-    def __init__(self, circuits, set, oblivious_transfer=True, print_mode="circuit", operation=0):
-        self.__operation = operation
+    def __init__(self, circuits, set, oblivious_transfer=True, print_mode="circuit", operation=0,
+                 prime_groups=None, ot_mode="lockstep", ot_pool=(4096, 1024), scheme="classic",
+                 backend="aes-cbc", wire_format="pickle", stream=None, workers=1, balanced=False, adder="ripple",
+                 bucketing=(3, 0, 256), cache=True, check=False, optimize=True, circuit_stats=False,
+                 metrics=False, metrics_file=None, socket=None):
+        if operation != 0 and not set:  # the circuits would have no value of Alice
+            raise ValueError("The set intersection needs at least one value of Alice")
+        self._operation = operation
+        self.metrics_file = metrics_file
+        if metrics or metrics_file is not None:
+            self.metrics = instrumentation.Metrics("alice")
+        else:
+            self.metrics = instrumentation.NULL_METRICS
+        self.cache = cache
+        self.check = check
+        self.optimize = optimize
+        self.circuit_stats = circuit_stats
+        self.balanced = balanced
+        self.adder = adder
+        self.wire_format = wire_format
+        self.stream = stream if print_mode == "circuit" else None
         self._print_mode = print_mode
         self.modes = {
             "circuit": self.print,
@@ -66,38 +166,129 @@ class Alice(YaoGarbler):
         }
         self.set = set
         self.max_bit_length = 0
-        self.socket = util.GarblerSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
-        self.__exchange_max_bit_length()
-        if self.__share_chosen_operation():
-            circuit_path = self.__create_circuit(circuits['filename'], circuits['id_name'], circuits['circuit_name'])
-            super().__init__(circuit_path)
+        self.bob_set_cardinality = None
+        self.bucketing = bucketing
+        self.bins = None  # Alice's bins of operation 4, see circuit_generator.bucketed_alice_bins
+        self.bin_cursor = 0  # the first bin of the next circuit
+        self.common_values = None  # accumulated over the circuits of operation 4
+        self.circuits = []
+        self._circuit_names = circuits
+        self._garbling = {"scheme": scheme, "backend": backend, "lazy": self.stream is not None,
+                          "workers": workers}
+        if prime_groups is not None:
+            prime_groups = util.load_prime_groups(prime_groups)
+        self._connect(oblivious_transfer, prime_groups, ot_mode, ot_pool, socket)
 
         self.expected_output = ExpectedOutput(operation)
         self.expected_output.print_expected_output()
 
+    def _connect(self, oblivious_transfer, prime_groups, ot_mode, ot_pool, socket=None):
+        """Connect to Bob, agree on the session and garble the circuits."""
+        self.socket = util.GarblerSocket() if socket is None else socket
+        self.socket.metrics = self.metrics
+        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer, prime_groups=prime_groups,
+                                       mode=ot_mode, pool_size=ot_pool[0], pool_threshold=ot_pool[1],
+                                       metrics=self.metrics)
+        self.__exchange_max_bit_length()
+        self.ot.start_session()
+        self.ot.precompute()  # offline phase of the "pool" mode
+        if self.__share_chosen_operation():
+            if self._operation in (1, 2, 3):
+                self.__exchange_bob_set_cardinality()
+            if self._operation == 4:
+                self.__exchange_bucketing()
+            self._garble()
+
+    def _garble(self):
+        """Create the circuits of the operation and garble them."""
+        with self.metrics.phase("circuit"):
+            created_circuits = self._create_circuit(self._circuit_names['filename'],
+                                                    self._circuit_names['id_name'],
+                                                    self._circuit_names['circuit_name'])
+        super().__init__(created_circuits, metrics=self.metrics, **self._garbling)
+
     def __exchange_max_bit_length(self):
         max_bit_length = self.socket.send_wait({"question": 1, "length": len(bin(sum(self.set))[2:])})
         # 1 means give me max dim set
         self.max_bit_length = max_bit_length + 1
 
     def __share_chosen_operation(self):
-        return self.socket.send_wait({"operation":self.__operation})
-
-    def __create_circuit(self, circuit_filename, id_name, circuit_name):
+        return self.socket.send_wait({"operation":self._operation})
+
+    def __exchange_bob_set_cardinality(self):
+        # 2 means give me the number of values of your set
+        self.bob_set_cardinality = self.socket.send_wait({"question": 2, "cardinality": self._cardinality()})
+        self._check_bob_set_cardinality()
+
+    def _check_bob_set_cardinality(self):
+        if self.bob_set_cardinality == 0:  # the circuits would have no value of Bob, or would not be evaluated
+            raise ValueError("The set intersection needs at least one value of Bob")
+
+    def _cardinality(self):
+        """Return the number of values of the set in the circuit, distinct ones for operation 3."""
+        # see circuit_generator.sort_compare_shuffle_alice_values
+        return len(set(self.set)) if self._operation == 3 else len(self.set)
+
+    def __exchange_bucketing(self):
+        # 3 means hash your set into a cuckoo table and give me its seed and number of bins
+        hashes, stash_size, _ = self.bucketing
+        table = self.socket.send_wait({"question": 3, "hashes": hashes, "stash": stash_size})
+        self.bins = circuit_generator.bucketed_alice_bins(self.set, table["seed"], hashes, table["bins"],
+                                                          stash_size, self.max_bit_length)
+
+    def _create_circuit(self, circuit_filename, id_name, circuit_name):
         # Alice is the circuit creator
-        return circuit_generator.create_circuit(circuit_filename, self.max_bit_length, circuit_name,
-                                         id_name, operation=self.__operation, alice_set_cardinality=len(self.set))
-
-    def __interpret_result(self, str_results):
-        if self.__operation == 0:  # sum
+        # only the parameters used by the operation, so that they make a cache key
+        params = {"bit_number": self.max_bit_length, "name": circuit_name, "id_name": id_name,
+                  "operation": self._operation}
+        if self._operation in (1, 2, 3):
+            params["alice_set_cardinality"] = self._cardinality()
+        if self._operation in (2, 3):
+            params["bob_set_cardinality"] = self.bob_set_cardinality
+        if self._operation == 0:
+            params["adder"] = self.adder
+        else:
+            params["balanced"] = self.balanced
+        if self._operation == 4:
+            params["bin_capacities"] = [len(b) for b in self.bins]
+            params["batch_size"] = self.bucketing[2]
+
+        if self.cache:
+            cache = circuit_cache.get_default_cache()
+            circuits = cache.get_or_build(params, self.optimize, self.circuit_stats)
+            stats = cache.stats()
+            print(f"Circuit cache: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+                  f"{stats['misses']} misses")
+        else:
+            circuits = circuit_generator.create_circuit(circuit_filename, **params, verbose=self.circuit_stats)
+            if self.optimize:
+                circuits = optimizer.optimize_circuits(util.parse_json(circuits), self.circuit_stats)
+
+        if self.check:  # the circuits actually garbled, optimized or not
+            if not isinstance(circuits, dict):
+                circuits = util.parse_json(circuits)
+            self._check_circuits(circuits, params)
+        return circuits
+
+    def _check_circuits(self, circuits, params):
+        # pre-flight check: raises a ValueError before anything is garbled if a circuit is wrong
+        start = time.perf_counter()
+        circuits_stats = simulator.check_circuits(circuits, params)
+        for circuit_id, stats in circuits_stats.items():
+            print(f"Checked {circuit_id}: {stats['gates']} gates ({stats['non_free']} non-free), "
+                  f"depth {stats['depth']}, width {stats['width']}")
+        print(f"Pre-flight check of {len(circuits_stats)} circuits on {simulator.DEFAULT_VECTORS} input "
+              f"vectors: OK in {1000 * (time.perf_counter() - start):.1f} ms")
+
+    def _interpret_result(self, str_results, last=True):
+        if self._operation == 0:  # sum
             for str_result in str_results:
                 result = str_result.replace(' ', "")
                 result = int(result[::-1], 2)
                 print(f'The sum of the elements is: {result}')
             self.expected_output.compare_outputs(result)
 
-        if self.__operation == 1:  # compare
+        if self._operation in (1, 2, 3, 4):  # compare
             common_values = set()
             for str_result in str_results:
                 result = str_result.replace(' ', "")
@@ -105,6 +296,13 @@ class Alice(YaoGarbler):
                 if equality_bit == "1":
                     common_values.add(int(result[1:][::-1], 2))
 
+            if self._operation == 4:  # each circuit holds a batch of bins
+                if self.common_values is not None:
+                    common_values |= self.common_values
+                self.common_values = common_values
+                if not last:
+                    return
+
             print("Common values: ", end=" ")
             for val in common_values:
                 print(val, end=" ")
@@ -114,14 +312,44 @@ class Alice(YaoGarbler):
     def start(self):
         """Start Yao protocol."""
         for circuit in self.circuits:
-            to_send = {
-                "circuit": circuit["circuit"],
-                "garbled_tables": circuit["garbled_tables"],
-                "pbits_out": circuit["pbits_out"],
-            }
             if self._print_mode == "circuit":
-                self.socket.send_wait(to_send)
+                with self.metrics.phase("send_circuit"):
+                    self._send_circuit(circuit)
             self.modes[self._print_mode](circuit)
+        self.socket.send_wait({"end": True})  # Bob may release the session, see server.EvaluatorServer
+        self._report_metrics()
+
+    def _report_metrics(self):
+        if self.metrics.enabled:
+            print(f"Session metrics: {json.dumps(self.metrics.report())}")
+        if self.metrics_file is not None:
+            self.metrics.write_prometheus(self.metrics_file)
+
+    def _send_circuit(self, entry):
+        """Send a garbled circuit to Bob in the chosen wire format."""
+        if self.stream:  # the tables are sent by _stream_results
+            self.socket.send_wait({
+                "circuit": entry["circuit"],
+                "stream": True,
+                "scheme": entry["scheme"],
+                "backend": entry["backend"],
+            })
+        elif self.wire_format == "binary":
+            frames = yao.pack_circuit(entry["garbled_circuit"].compiled,
+                                      entry["garbled_tables"],
+                                      entry["pbits_out"],
+                                      scheme=entry["scheme"],
+                                      backend=entry["backend"])
+            self.socket.send_frames(frames)
+            self.socket.receive()
+        else:
+            self.socket.send_wait({
+                "circuit": entry["circuit"],
+                "garbled_tables": entry["garbled_tables"],
+                "pbits_out": entry["pbits_out"],
+                "scheme": entry["scheme"],
+                "backend": entry["backend"],
+            })
 
     def _print_tables(self, entry):
         """Print garbled tables."""
@@ -133,75 +361,150 @@ class Alice(YaoGarbler):
         Args:
             entry: A dict representing the circuit to evaluate.
         """
+        a_inputs, b_keys, bits_a = self._inputs(entry)
+        # Send Alice's encrypted inputs and keys to Bob
+        results = self._get_results(entry, a_inputs, b_keys)
+        self._print_results(entry, bits_a, results)
+
+    def _inputs(self, entry):
+        """Return the inputs of Alice and the keys of Bob of a circuit.
+
+        For operation 4, the bins of Alice's inputs are those following the
+        bins of the previous call.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+
+        Returns:
+            A tuple (a_inputs, b_keys, bits_a): a dict mapping Alice's wires
+            to (key, encr_bit) inputs, a dict mapping each Bob's wire to a
+            pair (key, encr_bit) and the list of Alice's input bits.
+        """
         circuit, pbits, keys = entry["circuit"], entry["pbits"], entry["keys"]
-        outputs = circuit["out"]
         a_wires = circuit.get("alice", [])  # Alice's wires
-        a_inputs = {}  # map from Alice's wires to (key, encr_bit) inputs
         b_wires = circuit.get("bob", [])  # Bob's wires
         b_keys = {  # map from Bob's wires to a pair (key, encr_bit)
-            w: self._get_encr_bits(pbits[w], key0, key1)
-            for w, (key0, key1) in keys.items() if w in b_wires
+            w: self._get_encr_bits(pbits[w], *keys[w])
+            for w in b_wires
         }
-        N = len(a_wires) + len(b_wires)
-
-        print(f"======== {circuit['id']} ========")
-
-        """print(f"  Alice{a_wires} = {str_bits_a} "
-                  f"Bob{b_wires} = {str_bits_b}  "
-                  f"Outputs{outputs} = {str_result}")
-                  
-                  FOR DEBUGGING """
-        str_results = []
 
-        if self.__operation == 0:
+        if self._operation == 0:
             bits_a = [int(i) for i in bin(sum(self.set))[2:][::-1]]  # Alice's inputs
             if len(bits_a) < self.max_bit_length:
                 for i in range(self.max_bit_length - len(bits_a)):
                     bits_a.append(0)
-            # Map Alice's wires to (key, encr_bit)
-            for i in range(len(a_wires)):
-                a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
-                                        pbits[a_wires[i]] ^ bits_a[i])
-
-            # Send Alice's encrypted inputs and keys to Bob
-            result = self.ot.get_result(a_inputs, b_keys)
-            str_bits_a = [str(i) for i in bits_a]
-            str_bits_a = ' '.join(str_bits_a[:len(a_wires)])
-            str_result = ' '.join([str(result[w]) for w in outputs])
-            str_results.append(str_result)
-            print(f"Alice{a_wires} = {str_bits_a}\t\t"
-                  f"Outputs{outputs} = {str_result}")
 
-        if self.__operation == 1:
+        if self._operation in (1, 2, 3, 4):
+            values, bit_length = self.set, self.max_bit_length
+            if self._operation == 3:  # see circuit_generator.sort_compare_shuffle
+                values = circuit_generator.sort_compare_shuffle_alice_values(self.set, self.bob_set_cardinality,
+                                                                             self.max_bit_length)
+                bit_length = self.max_bit_length + 1
+            if self._operation == 4:  # the values of the next bins, see circuit_generator.bucketed_intersection
+                bins_number = len(b_wires) // (self.max_bit_length + 1)
+                bins = self.bins[self.bin_cursor:self.bin_cursor + bins_number]
+                self.bin_cursor += bins_number
+                values = [value for values_bin in bins for value in values_bin]
+                bit_length = self.max_bit_length + 1
             bits_a = []
-            for value in self.set:
+            for value in values:
                 bits_value = [int(i) for i in bin(value)[2:][::-1]]
-                if len(bits_value) < self.max_bit_length:
-                    for i in range(self.max_bit_length - len(bits_value)):
+                if len(bits_value) < bit_length:
+                    for i in range(bit_length - len(bits_value)):
                         bits_value.append(0)
                 bits_a = bits_a + bits_value
 
-            # Map Alice's wires to (key, encr_bit)
-            for i in range(len(a_wires)):
-                a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]],
-                                        pbits[a_wires[i]] ^ bits_a[i])
+        # Map Alice's wires to (key, encr_bit)
+        a_inputs = {a_wires[i]: (keys[a_wires[i]][bits_a[i]], pbits[a_wires[i]] ^ bits_a[i])
+                    for i in range(len(a_wires))}
+        return a_inputs, b_keys, bits_a
+
+    def _print_results(self, entry, bits_a, results):
+        """Print and check the results of Bob's evaluations of a circuit.
+
+        Args:
+            entry: A dict representing the evaluated circuit.
+            bits_a: The list of Alice's input bits, see _inputs.
+            results: A list of dicts mapping output wires with their result
+                bit, see _get_results.
+        """
+        circuit = entry["circuit"]
+        outputs = circuit["out"]
+        a_wires = circuit.get("alice", [])  # Alice's wires
+        str_bits_a = ' '.join([str(i) for i in bits_a][:len(a_wires)])
+        str_results = []
+
+        print(f"======== {circuit['id']} ========")
 
-            # Send Alice's encrypted inputs and keys to Bob
-            result = self.ot.get_result(a_inputs, b_keys)
+        if self._operation == 0:
+            str_result = ' '.join([str(results[0][w]) for w in outputs])
+            str_results.append(str_result)
+            print(f"Alice{a_wires} = {str_bits_a}\t\t"
+                  f"Outputs{outputs} = {str_result}")
 
-            str_bits_a = [str(i) for i in bits_a]
-            str_bits_a = ' '.join(str_bits_a[:len(a_wires)])
+        if self._operation in (1, 2, 3, 4):
             print(f"Alice{a_wires} = {str_bits_a}\t\t")
-            while result.get("end") is None:
-                str_result = ' '.join([str(result[w]) for w in outputs])
-                str_results.append(str_result)
-                print(f"Outputs{outputs} = {str_result}")
-                result = self.ot.get_result(a_inputs, b_keys)
+            if self._operation == 1:  # one result per value of Bob
+                value_outputs = [outputs]
+            else:  # the outputs of all Bob's values in a single result
+                size = self.max_bit_length + (2 if self._operation == 4 else 1)
+                value_outputs = [outputs[i:i + size] for i in range(0, len(outputs), size)]
+            for result in results:
+                for outs in value_outputs:
+                    str_result = ' '.join([str(result[w]) for w in outs])
+                    str_results.append(str_result)
+                    print(f"Outputs{outs} = {str_result}")
 
         # Format output
-        self.__interpret_result(str_results)
+        self._interpret_result(str_results, last=entry is self.circuits[-1])
         print()
 
+    def _get_results(self, entry, a_inputs, b_keys):
+        """Send Alice's inputs and return the results of Bob's evaluations.
+
+        Bob evaluates the circuit once per value of his set for operation 1
+        and once otherwise.
+
+        Args:
+            entry: A dict representing the circuit to evaluate.
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+
+        Returns:
+            A list of dicts mapping output wires with their result bit.
+        """
+        with self.metrics.phase("results"):  # OT, Bob's evaluation and garbling of streamed circuits
+            if self.stream:
+                return self._stream_results(entry, a_inputs, b_keys)
+            evaluations = self.bob_set_cardinality if self._operation == 1 else 1
+            return [self.ot.get_result(a_inputs, b_keys) for _ in range(evaluations)]
+
+    def _stream_results(self, entry, a_inputs, b_keys):
+        """Streaming version of _get_results.
+
+        Bob first receives his inputs for each of his values, then the
+        garbled tables are streamed by chunks. Alice garbles the next chunk
+        while Bob evaluates the previous one for all his values.
+        """
+        more = True
+        while more:  # Bob answers True until he has the inputs of all his values
+            self.ot.send_inputs(a_inputs, b_keys)
+            more = self.socket.receive()
+
+        garbled_circuit = entry["garbled_circuit"]
+        sent = False
+        for tables in garbled_circuit.stream(self.stream):
+            if sent:
+                self.socket.receive()  # Bob has evaluated the previous chunk
+            self.socket.send({"tables": tables})
+            sent = True
+        if sent:
+            self.socket.receive()
+
+        pbits = garbled_circuit.get_pbits()
+        entry["pbits_out"] = {w: pbits[w] for w in entry["circuit"]["out"]}
+        return self.socket.send_wait({"pbits_out": entry["pbits_out"]})
+
     @staticmethod
     def _get_encr_bits(pbit, key0, key1):
         return (key0, 0 ^ pbit), (key1, 1 ^ pbit)
@@ -217,14 +520,37 @@ class Bob:
         set: the set of values of Alice (only integers)
         oblivious_transfer: Optional; enable the Oblivious Transfer protocol
             (True by default).
+        workers: Optional; the number of threads evaluating each level of
+            the circuits of the aes-cbc backend (Default: 1), see
+            yao.evaluate.
+        metrics: Optional; record the metrics of each session with Alice in
+            the 'metrics' attribute (see instrumentation.Metrics) and print
+            them after each circuit (Default: False).
+        metrics_file: Optional; a path where the metrics of the session are
+            written in the Prometheus text format after each circuit, which
+            implies 'metrics' (Default: None).
+        socket: Optional; the socket of the sessions, e.g. the socket of a
+            session of a server.EvaluatorServer (Default: a new
+            util.EvaluatorSocket).
     """
-    __operation = None
-
-    def __init__(self, set, oblivious_transfer=True):
-        self.socket = util.EvaluatorSocket()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+    _operation = None
+
+    def __init__(self, set, oblivious_transfer=True, workers=1, metrics=False, metrics_file=None, socket=None):
+        self.workers = workers
+        self.metrics_enabled = metrics or metrics_file is not None
+        self.metrics_file = metrics_file
+        self.metrics = instrumentation.NULL_METRICS  # replaced when a session starts
+        self._bind(oblivious_transfer, socket)
         self.set = set
         self.max_bit_length = 0
+        self.alice_set_cardinality = None
+        self.bins = None  # Bob's values of operation 4, see circuit_generator.bucketed_bob_values
+        self.bin_cursor = 0  # the first bin of the next circuit
+
+    def _bind(self, oblivious_transfer, socket=None):
+        """Create the socket Alice connects to and the OT of the sessions."""
+        self.socket = util.EvaluatorSocket() if socket is None else socket
+        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
 
     def update_set(self, new_set):
         self.set = new_set
@@ -236,85 +562,400 @@ class Bob:
             for entry in self.socket.poll_socket():
                 #entry = self.socket.receive()
 
-                if not entry.get("operation") is None:
-                    self.__operation = entry["operation"]
+                if isinstance(entry, list):  # binary wire format
+                    circuit = yao.unpack_circuit(entry)
                     self.socket.send(True)
+                    self.send_evaluation(circuit)
+                    self._report_metrics()
+                elif not entry.get("ot") is None:
+                    self.socket.send(self.ot.serve_session(entry))
+                elif not entry.get("operation") is None:
+                    self._operation = entry["operation"]
+                    self.socket.send(True)
+                elif entry.get("end") is not None:  # the session is over
+                    self.socket.send(True)
+                elif entry.get("question") == 2:
+                    self.alice_set_cardinality = entry.get("cardinality")
+                    self.socket.send(self._cardinality())
+                elif entry.get("question") == 3:
+                    self.socket.send(self.hash_set(entry["hashes"], entry["stash"]))
                 elif not entry.get("question") is None and entry["question"] == 1:
-                    print("\nAlice asks for max bit length ...")
-                    length = len(bin(sum(self.set))[2:])
-                    if length > entry["length"]:
-                        self.max_bit_length = length + 1
-                        self.socket.send(length)
-                    else:
-                        self.max_bit_length = entry["length"] + 1
-                        self.socket.send(entry["length"])
+                    self._start_metrics()  # first message of a session
+                    self.socket.send(self._exchange_max_bit_length(entry["length"]))
                 else:
                     self.socket.send(True)
                     self.send_evaluation(entry)
+                    self._report_metrics()
         except KeyboardInterrupt:
             print("Closing connection")
 
+    def _exchange_max_bit_length(self, length):
+        """Return the bit length of the sums of both sets, given Alice's one."""
+        print("\nAlice asks for max bit length ...")
+        length = max(len(bin(sum(self.set))[2:]), length)
+        self.max_bit_length = length + 1
+        return length
+
+    def _cardinality(self):
+        """Return the number of values of the set in the circuit, distinct ones for operation 3."""
+        # see circuit_generator.sort_compare_shuffle_bob_bits
+        return len(set(self.set)) if self._operation == 3 else len(self.set)
+
+    def _start_metrics(self):
+        if self.metrics_enabled:
+            self.metrics = instrumentation.Metrics("bob")
+            self.socket.metrics = self.ot.metrics = self.metrics
+
+    def _report_metrics(self):
+        if self.metrics.enabled:
+            print(f"Session metrics: {json.dumps(self.metrics.report())}")
+        if self.metrics_file is not None:
+            self.metrics.write_prometheus(self.metrics_file)
+
+    def hash_set(self, hashes, stash_size):
+        """Cuckoo-hash Bob's set into bins for operation 4.
+
+        Args:
+            hashes: The number of hash functions.
+            stash_size: The maximum number of values of the stash.
+
+        Returns:
+            A dict with the seed of the hash functions and the number of
+            bins, which Alice needs to hash her set into the same bins.
+        """
+        bins = util.cuckoo_bin_count(len(self.set), hashes)
+        with self.metrics.phase("hashing"):
+            seed, table, stash = util.cuckoo_hash(self.set, bins, hashes, stash_size)
+        self.bins = circuit_generator.bucketed_bob_values(table, stash, stash_size, self.max_bit_length)
+        self.bin_cursor = 0
+        print(f"Bob's set hashed into {bins} bins, {len(stash)} values in the stash")
+        return {"seed": seed, "bins": bins}
 
     def send_evaluation(self, entry):
         """Evaluate yao circuit for all Bob and Alice's inputs and
         send back the results.
 
         Args:
-            entry: A dict representing the circuit to evaluate.
+            entry: A dict representing the circuit to evaluate, whose circuit
+                is either a dict or an unpacked CompiledCircuit (see
+                yao.unpack_circuit).
         """
-        circuit, pbits_out = entry["circuit"], entry["pbits_out"]
-        garbled_tables = entry["garbled_tables"]
-        a_wires = circuit.get("alice", [])  # list of Alice's wires
+        job = self._prepare_evaluation(entry)
+        if entry.get("stream"):
+            self._evaluate_stream(job["compiled"], job["b_inputs_list"], job["scheme"], job["backend"])
+            return
+
+        # Evaluate and send result to Alice
+        for b_inputs_clear in job["b_inputs_list"]:
+            self.ot.send_result(job["compiled"], job["garbled_tables"], job["pbits_out"],
+                                b_inputs_clear, scheme=job["scheme"], backend=job["backend"],
+                                workers=self.workers)
+
+    def _prepare_evaluation(self, entry):
+        """Compile a received circuit and compute Bob's inputs.
+
+        For operation 4, the bins of Bob's inputs are those following the
+        bins of the previous call.
+
+        Args:
+            entry: A dict representing the circuit to evaluate, see
+                send_evaluation.
+
+        Returns:
+            A dict with the CompiledCircuit ("compiled"), its
+            "garbled_tables" in evaluation order, "pbits_out", "scheme",
+            "backend" and the list of dicts mapping Bob's wires to (clear)
+            input bits of each evaluation ("b_inputs_list").
+        """
+        circuit, pbits_out = entry["circuit"], entry.get("pbits_out")
+        scheme = entry.get("scheme", "classic")
+        backend = entry.get("backend", "aes-cbc")
+        self.metrics.count("circuits")
+        if isinstance(circuit, yao.CompiledCircuit):
+            compiled, garbled_tables = circuit, entry["garbled_tables"]
+            circuit = compiled.circuit
+        else:
+            # compile once, the circuit is evaluated for each of Bob's inputs
+            with self.metrics.phase("compile"):
+                compiled = yao.CompiledCircuit(circuit)
+                garbled_tables = None if entry.get("stream") else compiled.order_tables(
+                    entry["garbled_tables"])
         b_wires = circuit.get("bob", [])  # list of Bob's wires
-        N = len(a_wires) + len(b_wires)
 
         print(f"Received {circuit['id']}")
 
-        if self.__operation == 0:
-            bits_b = [int(i) for i in bin(sum(self.set))[2:][::-1]]  # Bob's inputs
-            if len(bits_b) < self.max_bit_length:
-                for i in range(self.max_bit_length - len(bits_b)):
-                    bits_b.append(0)
+        bit_length = self.max_bit_length
+        if self._operation == 0:
+            values = [sum(self.set)]
+        elif self._operation == 3:  # the values are sorted by sort_compare_shuffle_bob_bits
+            values = []
+        elif self._operation == 4:  # the values of the next bins, see circuit_generator.bucketed_intersection
+            bit_length = self.max_bit_length + 1
+            bins_number = len(b_wires) // bit_length
+            values = self.bins[self.bin_cursor:self.bin_cursor + bins_number]
+            self.bin_cursor += bins_number
+        else:
+            # create permutation
+            values = util.get_single_permutation(self.set)
 
-            # Create dict mapping each wire of Bob to Bob's input
-            b_inputs_clear = {
-                b_wires[i]: bits_b[i]
-                for i in range(len(b_wires))
-            }
+        values_bits = []
+        for value in values:
+            bits_b = [int(i) for i in bin(value)[2:][::-1]]  # Bob's inputs
+            if len(bits_b) < bit_length:
+                for i in range(bit_length - len(bits_b)):
+                    bits_b.append(0)
+            values_bits.append(bits_b)
 
             str_bits_b = [str(i) for i in bits_b]
             str_bits_b = ' '.join(str_bits_b[:len(b_wires)])
             print(f"Bob{b_wires} = {str_bits_b}\t\t")
-            # Evaluate and send result to Alice
-            self.ot.send_result(circuit, garbled_tables, pbits_out,
-                                b_inputs_clear)
 
-        if self.__operation == 1:
+        if self._operation in (2, 4):  # all Bob's values are inputs of a single evaluation
+            values_bits = [[bit for bits_b in values_bits for bit in bits_b]]
 
-            # create permutation
-            bob_permutated_inputs = util.get_single_permutation(self.set)
+        if self._operation == 3:  # sorted values and shuffle switches
+            values_bits = [circuit_generator.sort_compare_shuffle_bob_bits(self.set, self.alice_set_cardinality,
+                                                                          self.max_bit_length)]
+            print(f"Bob's values in descending order: {sorted(set(self.set), reverse=True)}")
 
-            for value in bob_permutated_inputs:
-                bits_b = [int(i) for i in bin(value)[2:][::-1]]  # Bob's inputs
-                if len(bits_b) < self.max_bit_length:
-                    for i in range(self.max_bit_length - len(bits_b)):
-                        bits_b.append(0)
+        # Create dicts mapping each wire of Bob to Bob's input
+        b_inputs_list = [{
+            b_wires[i]: bits_b[i]
+            for i in range(len(b_wires))
+        } for bits_b in values_bits]
 
-                # Create dict mapping each wire of Bob to Bob's input
-                b_inputs_clear = {
-                    b_wires[i]: bits_b[i]
-                    for i in range(len(b_wires))
-                }
+        return {"compiled": compiled, "garbled_tables": garbled_tables, "pbits_out": pbits_out,
+                "scheme": scheme, "backend": backend, "b_inputs_list": b_inputs_list}
 
-                str_bits_b = [str(i) for i in bits_b]
-                str_bits_b = ' '.join(str_bits_b[:len(b_wires)])
-                print(f"Bob{b_wires} = {str_bits_b}\t\t")
-                # Evaluate and send result to Alice
-                self.ot.send_result(circuit, garbled_tables, pbits_out,
-                                    b_inputs_clear)
+    def _evaluate_stream(self, compiled, b_inputs_list, scheme, backend):
+        """Evaluate a streamed circuit for all Bob's inputs at once.
 
-            self.ot.send_result(circuit, garbled_tables, pbits_out,
-                                b_inputs_clear, end=True)
+        Bob receives the inputs of each evaluation, then evaluates each
+        chunk of garbled tables as it arrives and finally sends the list of
+        results to Alice.
+
+        Args:
+            compiled: The CompiledCircuit of the circuit.
+            b_inputs_list: A list of dicts mapping Bob's wires to (clear)
+                input bits, one per evaluation.
+            scheme: The garbling scheme of the circuit.
+            backend: The garbling backend of the circuit.
+        """
+        inputs = []
+        for i, b_inputs_clear in enumerate(b_inputs_list):
+            inputs.append(self.ot.receive_inputs(b_inputs_clear))
+            self.socket.send(i + 1 < len(b_inputs_list))  # more inputs to come
+
+        evaluator = yao.StreamEvaluator(compiled, inputs, scheme, backend)
+        entry = self.socket.receive()
+        while entry.get("tables") is not None:
+            with self.metrics.phase("evaluation"):
+                evaluator.feed(entry["tables"])
+            self.socket.send(True)
+            entry = self.socket.receive()
+        self.socket.send(evaluator.get_results(entry["pbits_out"]))
+        if self.metrics.enabled:
+            self.metrics.count("evaluations", len(inputs))
+            self.metrics.count_gates("evaluated", {gate_type: count * len(inputs) for gate_type, count
+                                                   in yao.gate_type_counts(compiled).items()})
+
+
+class AsyncAlice(Alice):
+    """Alice over the asyncio transport, with pipelined messages.
+
+    The session starts with a single exchange of the bit length, the
+    operation, Bob's set cardinality or cuckoo table and the OT session
+    parameters. Every circuit is then sent along with Alice's inputs and
+    her first OT message, without waiting for Bob, who answers with his OT
+    request for all his values (see ot.AsyncObliviousTransfer); Alice's
+    reply is the last message before his results. No message is an
+    acknowledgement: a circuit costs four messages with the OT and two
+    without, whatever the number of Bob's values, and Bob receives the
+    next circuits while Alice answers his requests.
+
+    The constructor does not communicate with Bob, who must run an
+    AsyncBob: start is a coroutine running the whole session, e.g.
+    asyncio.run(alice.start()).
+
+    Args:
+        circuits: See Alice.
+        set: See Alice.
+        endpoint: Optional; the ZeroMQ endpoint of Bob (Default: the
+            endpoint of util.GarblerSocket).
+        ot_mode: Optional; "batched" or "extension", see
+            ot.AsyncObliviousTransfer (Default: extension).
+        kwargs: The other arguments of Alice, except 'stream' and
+            'ot_pool'.
+    """
+    def __init__(self, circuits, set, endpoint=f"tcp://{util.SERVER_HOST}:{util.SERVER_PORT}",
+                 ot_mode="extension", **kwargs):
+        if kwargs.get("stream") is not None:
+            raise ValueError("Streaming is not supported over the asyncio transport")
+        self.endpoint = endpoint
+        super().__init__(circuits, set, ot_mode=ot_mode, **kwargs)
+
+    def _connect(self, oblivious_transfer, prime_groups, ot_mode, ot_pool, socket=None):
+        self.socket = util.AsyncGarblerSocket(self.endpoint) if socket is None else socket
+        self.socket.metrics = self.metrics
+        self.ot = ot.AsyncObliviousTransfer(self.socket, enabled=oblivious_transfer, prime_groups=prime_groups,
+                                            mode=ot_mode, metrics=self.metrics)
+
+    async def start(self):
+        """Start Yao protocol."""
+        await self._hello()
+        self._garble()
+        if self._print_mode == "circuit":
+            waiting = collections.deque()  # (entry, b_keys, bits_a, c) of the circuits sent
+            await asyncio.gather(self._send_circuits(waiting), self._receive_results(waiting))
+        else:
+            for circuit in self.circuits:
+                self.modes[self._print_mode](circuit)
+        self._report_metrics()
+
+    async def _hello(self):
+        """Agree on the session with Bob in a single round trip."""
+        hello = {"length": len(bin(sum(self.set))[2:]), "operation": self._operation,
+                 "ot": self.ot.session_request()}
+        if self._operation in (2, 3):
+            hello["cardinality"] = self._cardinality()
+        if self._operation == 4:
+            hello["hashing"] = self.bucketing[:2]
+        reply = (await self.socket.send_wait({"hello": hello}))["hello"]
+
+        self.max_bit_length = reply["length"] + 1
+        self.bob_set_cardinality = reply.get("cardinality")
+        self._check_bob_set_cardinality()
+        if self._operation == 4:
+            hashes, stash_size, _ = self.bucketing
+            self.bins = circuit_generator.bucketed_alice_bins(self.set, reply["table"]["seed"], hashes,
+                                                              reply["table"]["bins"], stash_size,
+                                                              self.max_bit_length)
+        await self.ot.start_session(reply["ot"])
+
+    async def _send_circuits(self, waiting):
+        """Send every circuit with Alice's inputs, without waiting for Bob."""
+        for entry in self.circuits:
+            a_inputs, b_keys, bits_a = self._inputs(entry)
+            inputs, c = self.ot.inputs_message(a_inputs, b_keys)
+            waiting.append((entry, b_keys, bits_a, c))
+            with self.metrics.phase("send_circuit"):
+                if self.wire_format == "binary":
+                    frames = yao.pack_circuit(entry["garbled_circuit"].compiled, entry["garbled_tables"],
+                                              entry["pbits_out"], scheme=entry["scheme"],
+                                              backend=entry["backend"])
+                    await self.socket.send_frames([pickle.dumps(inputs, pickle.DEFAULT_PROTOCOL)] + frames)
+                else:
+                    await self.socket.send({
+                        "circuit": entry["circuit"],
+                        "garbled_tables": entry["garbled_tables"],
+                        "pbits_out": entry["pbits_out"],
+                        "scheme": entry["scheme"],
+                        "backend": entry["backend"],
+                        "inputs": inputs,
+                    })
+
+    async def _receive_results(self, waiting):
+        """Answer Bob's OT requests and print his results.
+
+        Bob handles the circuits in order, so his requests and results
+        are those of the oldest circuits without one.
+        """
+        answered = waiting if not self.ot.enabled else collections.deque()  # no request without OT
+        printed = 0
+        while printed < len(self.circuits):
+            message = await self.socket.receive()
+            if message.get("base") is not None:
+                self.ot.finish_session(message["base"])
+            elif message.get("request") is not None:
+                circuit = waiting.popleft()
+                await self.ot.send_replies(message["request"], circuit[1], circuit[3])
+                answered.append(circuit)
+            else:
+                entry, _, bits_a, _ = answered.popleft()
+                self._print_results(entry, bits_a, message["results"])
+                printed += 1
+
+
+class AsyncBob(Bob):
+    """Bob over the asyncio transport, the evaluator of AsyncAlice.
+
+    Bob sends his OT request as soon as a circuit arrives and evaluates it
+    for all his values once Alice's replies arrive, the circuits waiting
+    for their replies being handled in order.
+
+    listen is a coroutine, e.g. asyncio.run(bob.listen()).
+
+    Args:
+        set: See Bob.
+        endpoint: Optional; the ZeroMQ endpoint to bind (Default: the
+            endpoint of util.EvaluatorSocket).
+        kwargs: The other arguments of Bob.
+    """
+    def __init__(self, set, endpoint=f"tcp://*:{util.LOCAL_PORT}", **kwargs):
+        self.endpoint = endpoint
+        self.pending = collections.deque()  # circuits waiting for Alice's OT replies
+        super().__init__(set, **kwargs)
+
+    def _bind(self, oblivious_transfer, socket=None):
+        self.socket = util.AsyncEvaluatorSocket(self.endpoint) if socket is None else socket
+        self.ot = ot.AsyncObliviousTransfer(self.socket, enabled=oblivious_transfer)
+
+    async def listen(self):
+        """Start listening for Alice messages."""
+        async for entry in self.socket.poll_socket():
+            if isinstance(entry, list):  # binary wire format, Alice's inputs in the first frame
+                await self._receive_circuit(yao.unpack_circuit(entry[1:]), pickle.loads(entry[0]))
+            elif entry.get("hello") is not None:
+                await self.socket.send({"hello": self._hello(entry["hello"])})
+            elif entry.get("ot") is not None:  # base OTs of the extension
+                await self.socket.send({"base": self.ot.serve_session(entry)})
+            elif entry.get("replies") is not None:
+                await self._evaluate(entry["replies"])
+            else:
+                await self._receive_circuit(entry, entry["inputs"])
+
+    def _hello(self, hello):
+        """Start a session, see AsyncAlice._hello.
+
+        Returns:
+            The reply to send back to Alice.
+        """
+        self._start_metrics()  # first message of a session
+        self.pending.clear()
+        self._operation = hello["operation"]
+        reply = {"length": self._exchange_max_bit_length(hello["length"])}
+        if hello.get("cardinality") is not None:
+            self.alice_set_cardinality = hello["cardinality"]
+            reply["cardinality"] = self._cardinality()
+        if hello.get("hashing") is not None:
+            reply["table"] = self.hash_set(*hello["hashing"])
+        reply["ot"] = self.ot.serve_session(hello["ot"])
+        return reply
+
+    async def _receive_circuit(self, entry, inputs):
+        """Request Bob's inputs of a received circuit through OT."""
+        job = self._prepare_evaluation(entry)
+        job["a_inputs"] = inputs["a_inputs"]
+        job["ot"] = await self.ot.request_inputs(inputs, job["b_inputs_list"])
+        self.pending.append(job)
+        if not self.ot.enabled:  # Bob has his inputs, Alice does not reply
+            await self._evaluate(None)
+
+    async def _evaluate(self, replies):
+        """Evaluate the oldest pending circuit and send the results to Alice."""
+        job = self.pending.popleft()
+        results = []
+        for b_inputs in self.ot.decrypt_inputs(job["ot"], replies):
+            with self.metrics.phase("evaluation"):
+                results.append(yao.evaluate(job["compiled"], job["garbled_tables"], job["pbits_out"],
+                                            job["a_inputs"], b_inputs, job["scheme"], job["backend"],
+                                            self.workers))
+        if self.metrics.enabled:
+            self.metrics.count("evaluations", len(results))
+            self.metrics.count_gates("evaluated", {gate_type: count * len(results) for gate_type, count
+                                                   in yao.gate_type_counts(job["compiled"]).items()})
+        await self.socket.send({"results": results})
+        self._report_metrics()
 
 
 class ExpectedOutput:
@@ -334,12 +975,12 @@ class ExpectedOutput:
         file_path = file_path + '.txt'
 
         with open(file_path, 'r') as setfile:
-            self.alice_set = [int(x) for x in next(setfile).split()]
+            self.alice_set = [int(x) for x in next(setfile, "").split()]  # the set may be empty
             setfile.close()
 
         file_path = file_path.replace("alice", "bob")
         with open(file_path, 'r') as setfile:
-            self.bob_set = [int(x) for x in next(setfile).split()]
+            self.bob_set = [int(x) for x in next(setfile, "").split()]
             setfile.close()
 
     def print_expected_output(self):
@@ -347,7 +988,7 @@ class ExpectedOutput:
             self.expected_output = sum(self.alice_set)+sum(self.bob_set)
             print(f"The sum of the elements from Bob and Alice should be: {self.expected_output}")
 
-        if self.__operation == 1:  # cmp
+        if self.__operation in (1, 2, 3, 4):  # cmp
             alice = set(self.alice_set)
             bob = set(self.bob_set)
             self.expected_output = alice.intersection(bob)
@@ -386,6 +1027,58 @@ bob_instance = None
 bob_set_path = None
 
 
+"""
+Run the listening loop of Bob, which is a coroutine for AsyncBob
+:param bob: the Bob or AsyncBob instance
+"""
+def listen(bob):
+    if isinstance(bob, AsyncBob):
+        try:
+            asyncio.run(bob.listen())
+        except KeyboardInterrupt:
+            print("Closing connection")
+    else:
+        bob.listen()
+
+
+"""
+Run a session of Alice and Bob in this process, connected by a util.loopback_pair
+Bob listens in a thread, the circuits are evaluated once Alice's constructor and start return
+:param circuits: the circuits of Alice (see Alice)
+:param alice_set: the set of values of Alice
+:param bob_set: the set of values of Bob
+:param serialize: pickle the messages between the parties, by default they are passed as they are
+:param bob_kwargs: the other arguments of Bob, e.g. 'workers' or 'metrics'
+:param alice_kwargs: the other arguments of Alice
+:return: the Alice instance, e.g. to read its metrics
+"""
+def run_in_process(circuits, alice_set, bob_set, serialize=False, bob_kwargs=None, **alice_kwargs):
+    garbler_socket, evaluator_socket = util.loopback_pair(serialize)
+    bob = Bob(bob_set, socket=evaluator_socket, **(bob_kwargs or {}))
+    errors = []
+
+    def serve():
+        try:
+            bob.listen()
+        except BaseException as error:
+            errors.append(error)
+            garbler_socket.close()  # Alice would wait for Bob's reply
+
+    thread = threading.Thread(target=serve, name="bob", daemon=True)
+    thread.start()
+    try:
+        alice = Alice(circuits, alice_set, socket=garbler_socket, **alice_kwargs)
+        alice.start()
+    except EOFError:
+        if errors:
+            raise errors[0]
+        raise
+    finally:
+        evaluator_socket.close()
+        thread.join()
+    return alice
+
+
 """
 This function intercepts the sequence Ctrl-C.
 It prevents the exit from the program by providing a simulated shell with 4 possible commands:
@@ -402,7 +1095,7 @@ def go_to_dev_mode():
                 print("Commands:\n\tcontinue (it restores the last session)\n\tnew set (Gives you the possibility to "
                       "type a new bob's set\n\texit (Exit from the program)\n")
             elif value == "continue":
-                bob_instance.listen()
+                listen(bob_instance)
 
             elif value == "new set":
                 n = int(input("Enter the number of integers of Bob's set: "))
@@ -430,6 +1123,27 @@ def main(
     operation,
     oblivious_transfer=True,
     print_mode="circuit",
+    prime_groups=None,
+    ot_mode=None,
+    ot_pool=(4096, 1024),
+    scheme="classic",
+    backend="aes-cbc",
+    wire_format="pickle",
+    stream=None,
+    workers=1,
+    balanced=False,
+    adder="ripple",
+    bucketing=(3, 0, 256),
+    cache=True,
+    check=False,
+    optimize=True,
+    circuit_stats=False,
+    metrics=False,
+    metrics_file=None,
+    async_transport=False,
+    sessions=None,
+    backlog=None,
+    idle_timeout=None,
 ):
     global bob_instance
     global bob_set_path
@@ -444,23 +1158,59 @@ def main(
             circuits["filename"] = "set_cmp.json"
             circuits["id_name"] = "set_cmp"
             circuits["circuit_name"] = "set_cmp"
+        elif operation == 2:
+            circuits["filename"] = "set_cmp_all.json"
+            circuits["id_name"] = "set_cmp_all"
+            circuits["circuit_name"] = "set_cmp_all"
+        elif operation == 3:
+            circuits["filename"] = "set_psi.json"
+            circuits["id_name"] = "set_psi"
+            circuits["circuit_name"] = "set_psi"
+        elif operation == 4:
+            circuits["filename"] = "set_psi_bins.json"
+            circuits["id_name"] = "set_psi_bins"
+            circuits["circuit_name"] = "set_psi_bins"
 
         n = int(input("Enter the number of integers of Alice's set: "))
         alice_set = list(int(num) for num in input("Enter the list items separated by space: ").strip().split())[:n]
         save_set_to_file("alice", alice_set)
         # start process Yao's protocol
-        alice = Alice(circuits, alice_set, oblivious_transfer=oblivious_transfer, print_mode=print_mode,
-                      operation=operation)
-        alice.start()
+        options = dict(oblivious_transfer=oblivious_transfer, print_mode=print_mode,
+                       operation=operation, prime_groups=prime_groups,
+                       scheme=scheme, backend=backend, wire_format=wire_format, workers=workers,
+                       balanced=balanced, adder=adder, bucketing=bucketing,
+                       cache=cache, check=check, optimize=optimize, circuit_stats=circuit_stats,
+                       metrics=metrics, metrics_file=metrics_file)
+        if ot_mode is not None:  # the default mode depends on the transport
+            options["ot_mode"] = ot_mode
+        if async_transport:
+            alice = AsyncAlice(circuits, alice_set, stream=stream, **options)
+            asyncio.run(alice.start())
+        else:
+            alice = Alice(circuits, alice_set, ot_pool=ot_pool, stream=stream, **options)
+            alice.start()
     elif party == "bob":
-        atexit.register(go_to_dev_mode)  # the listener for the Ctrl-C termination sequence
+        if sessions is not None and async_transport:
+            print("[ERROR] The server mode does not support the asyncio transport")
+            return
+        if sessions is None:
+            atexit.register(go_to_dev_mode)  # the listener for the Ctrl-C termination sequence
 
         n = int(input("Enter the number of integers of Bob's set: "))
         bob_set = list(int(num) for num in input("Enter the list items separated by space: ").strip().split())[:n]
         bob_set_path = save_set_to_file("bob", bob_set)
-        bob = Bob(bob_set, oblivious_transfer=oblivious_transfer)
+        if sessions is not None:  # one Bob per session, in a pool of processes
+            import server  # not at the top, server imports this module
+            limits = {"backlog": backlog, "idle_timeout": idle_timeout}
+            server.EvaluatorServer(bob_set, sessions=sessions, oblivious_transfer=oblivious_transfer,
+                                   workers=workers, metrics=metrics, metrics_file=metrics_file,
+                                   **{key: value for key, value in limits.items() if value is not None}).serve()
+            return
+        bob_class = AsyncBob if async_transport else Bob
+        bob = bob_class(bob_set, oblivious_transfer=oblivious_transfer, workers=workers, metrics=metrics,
+                        metrics_file=metrics_file)
         bob_instance = bob
-        bob.listen()
+        listen(bob)
 
 
     else:
@@ -481,9 +1231,10 @@ if __name__ == '__main__':
             "-o",
             "--operation",
             metavar="mode",
-            choices=["0", "1"],
+            choices=["0", "1", "2", "3", "4"],
             default="0",
-            help="The operation they want to compute: set sum or compare set values"
+            help="The operation they want to compute: set sum, compare set values, compare all set values at "
+                 "once, sort-compare-shuffle set intersection or hashing-based set intersection"
         )
 
         parser.add_argument(
@@ -493,10 +1244,179 @@ if __name__ == '__main__':
             default="circuit",
             help="the print mode for tests (default 'circuit')")
 
+        parser.add_argument(
+            "-g",
+            "--groups",
+            metavar="path",
+            default=None,
+            help="JSON file of precomputed prime groups for the Oblivious Transfer (Alice only)")
+
+        parser.add_argument(
+            "--ot-mode",
+            metavar="mode",
+            choices=ot.OT_MODES,
+            default=None,
+            help="the Oblivious Transfer mode chosen by Alice (default 'lockstep', 'extension' with --asyncio)")
+
+        parser.add_argument(
+            "--ot-pool",
+            metavar=("size", "threshold"),
+            nargs=2,
+            type=int,
+            default=(4096, 1024),
+            help="capacity and refill threshold of the random OT pool of the 'pool' mode")
+
+        parser.add_argument(
+            "-s",
+            "--scheme",
+            metavar="scheme",
+            choices=yao.SCHEMES,
+            default="classic",
+            help="the garbling scheme used by Alice (default 'classic')")
+
+        parser.add_argument(
+            "-b",
+            "--backend",
+            metavar="backend",
+            choices=yao.BACKENDS,
+            default="aes-cbc",
+            help="the garbling backend used by Alice (default 'aes-cbc')")
+
+        parser.add_argument(
+            "-w",
+            "--wire-format",
+            metavar="format",
+            choices=yao.WIRE_FORMATS,
+            default="pickle",
+            help="how Alice sends the garbled circuits, 'binary' needs fixed-size rows "
+                 "(default 'pickle')")
+
+        parser.add_argument(
+            "--stream",
+            metavar="gates",
+            type=int,
+            default=None,
+            help="garble and stream the circuit to Bob by chunks of this many gates "
+                 "(Alice only, disabled by default)")
+
+        parser.add_argument(
+            "-j",
+            "--workers",
+            metavar="count",
+            type=int,
+            default=1,
+            help="the number of processes garbling the circuits (Alice) or of threads "
+                 "evaluating the aes-cbc ones (Bob) (default 1)")
+
+        parser.add_argument(
+            "--balanced",
+            action="store_true",
+            help="build the compare circuit with balanced reduction trees (Alice only)")
+
+        parser.add_argument(
+            "--adder",
+            metavar="adder",
+            choices=circuit_generator.ADDERS,
+            default="ripple",
+            help="the adder of the set sum circuit (Alice only, default 'ripple')")
+
+        parser.add_argument(
+            "--bucketing",
+            metavar=("hashes", "stash", "batch"),
+            nargs=3,
+            type=int,
+            default=(3, 0, 256),
+            help="hash functions, cuckoo stash size and bins per circuit of the hashing-based set "
+                 "intersection (Alice only)")
+
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="generate the circuits into ./circuits instead of looking them up in the circuit "
+                 "cache (Alice only)")
+
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="evaluate the circuits in plaintext on random inputs before garbling them (Alice only)")
+
+        parser.add_argument(
+            "--no-optimize",
+            action="store_true",
+            help="garble the circuits as generated, without the optimization pass (Alice only)")
+
+        parser.add_argument(
+            "--circuit-stats",
+            action="store_true",
+            help="print the gates, depth and width of the circuits and the gate counts before and after "
+                 "the optimization pass (Alice only)")
+
+        parser.add_argument(
+            "--metrics",
+            action="store_true",
+            help="record the time of each phase, the gates, OTs, messages and bytes of the session "
+                 "and print them (Alice at the end, Bob after each circuit)")
+
+        parser.add_argument(
+            "--metrics-file",
+            metavar="PATH",
+            help="also write the metrics to PATH in the Prometheus text format")
+
+        parser.add_argument(
+            "--asyncio",
+            dest="async_transport",
+            action="store_true",
+            help="pipeline the messages over the asyncio transport instead of REQ/REP sockets, "
+                 "both parties must use it (OT modes 'batched' and 'extension' only)")
+
+        parser.add_argument(
+            "--sessions",
+            metavar="count",
+            type=int,
+            default=None,
+            help="serve up to this many Alices at once, each session being evaluated by one of as many "
+                 "processes (Bob only, disabled by default)")
+
+        parser.add_argument(
+            "--backlog",
+            metavar="count",
+            type=int,
+            default=None,
+            help="sessions waiting for a process of the server before new ones are refused (default 16)")
+
+        parser.add_argument(
+            "--idle-timeout",
+            metavar="seconds",
+            type=float,
+            default=None,
+            help="close a session of the server after this many seconds without a message of Alice "
+                 "(default 60)")
+
         main(
                 party=parser.parse_args().party,
                 operation=int(parser.parse_args().operation),
-                print_mode=parser.parse_args().m
+                print_mode=parser.parse_args().m,
+                prime_groups=parser.parse_args().groups,
+                ot_mode=parser.parse_args().ot_mode,
+                ot_pool=tuple(parser.parse_args().ot_pool),
+                scheme=parser.parse_args().scheme,
+                backend=parser.parse_args().backend,
+                wire_format=parser.parse_args().wire_format,
+                stream=parser.parse_args().stream,
+                workers=parser.parse_args().workers,
+                balanced=parser.parse_args().balanced,
+                adder=parser.parse_args().adder,
+                bucketing=tuple(parser.parse_args().bucketing),
+                cache=not parser.parse_args().no_cache,
+                check=parser.parse_args().check,
+                optimize=not parser.parse_args().no_optimize,
+                circuit_stats=parser.parse_args().circuit_stats,
+                metrics=parser.parse_args().metrics,
+                metrics_file=parser.parse_args().metrics_file,
+                async_transport=parser.parse_args().async_transport,
+                sessions=parser.parse_args().sessions,
+                backlog=parser.parse_args().backlog,
+                idle_timeout=parser.parse_args().idle_timeout
             )
 
 
@@ -0,0 +1,197 @@
+from collections import Counter
+import yao
+
+# Node kinds of the optimized graph
+CONST, INPUT, XOR, AND = range(4)
+NON_FREE_GATES = ("AND", "OR", "NOR", "NAND")  # garbled with free-xor and half-gates
+
+
+def _topological_gates(circuit):
+    """Return the gates of a circuit, each one after the gates computing its
+    inputs (sorted with yao.CompiledCircuit when they are not already)."""
+    known = set(circuit.get("alice", []) + circuit.get("bob", []))
+    for gate in circuit["gates"]:
+        if not known.issuperset(gate["in"]):
+            return yao.CompiledCircuit(circuit).gates
+        known.add(gate["id"])
+    return circuit["gates"]
+
+
+class _Graph:
+    """A graph of XOR and AND nodes whose edges may be complemented.
+
+    A literal is 2 * node + 1 if complemented, 2 * node otherwise, node 0
+    being the constant false: literal 0 is false and literal 1 is true.
+    Nodes are created once per distinct (kind, inputs), which eliminates
+    common subexpressions, and always after their inputs.
+    """
+    def __init__(self, input_count):
+        self.kinds = [CONST] + [INPUT] * input_count
+        self.fanins = [None] * (input_count + 1)
+        self.nodes = {}  # (kind, literal a, literal b) -> node
+
+    def _node(self, kind, a, b):
+        key = (kind, a, b) if a < b else (kind, b, a)
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = len(self.kinds)
+            self.kinds.append(kind)
+            self.fanins.append(key[1:])
+        return 2 * node
+
+    def xor(self, a, b):
+        # complements move to the output, so XOR nodes read plain literals
+        neg = (a ^ b) & 1
+        a, b = a & ~1, b & ~1
+        if a == b:
+            return neg
+        if a == 0 or b == 0:
+            return (a | b) ^ neg
+        return self._node(XOR, a, b) ^ neg
+
+    def and_(self, a, b):
+        if a == 0 or b == 0 or a == b ^ 1:
+            return 0
+        if a == 1 or a == b:
+            return b
+        if b == 1:
+            return a
+        return self._node(AND, a, b)
+
+    def gate(self, gate_type, a, b):
+        """Return the literal of a gate of the circuit format."""
+        if gate_type == "NOT":
+            return a ^ 1
+        if gate_type in ("XOR", "XNOR"):
+            return self.xor(a, b) ^ (gate_type == "XNOR")
+        if gate_type in ("OR", "NOR"):  # De Morgan
+            return self.and_(a ^ 1, b ^ 1) ^ (gate_type == "OR")
+        return self.and_(a, b) ^ (gate_type == "NAND")
+
+
+def optimize_circuit(circuit):
+    """Return an optimized copy of a circuit, computing the same outputs.
+
+    The circuit is rebuilt as a graph of AND and XOR nodes with complemented
+    edges (NOT gates are absorbed, XOR + NOT folds into XNOR, OR and NOR use
+    De Morgan's laws), constants are propagated and equal nodes are shared.
+    Gates are then written back only for the nodes and polarities reachable
+    from the outputs. Each gate takes the form (e.g. AND or NOR of the
+    complements, XOR or XNOR) whose inputs are already computed, so NOT
+    gates remain only for nodes needed with both polarities. Wires are
+    renumbered from 1, Alice's and Bob's inputs first, in the same order.
+
+    Args:
+        circuit: A circuit dict, as in the circuit JSON files.
+
+    Returns:
+        The optimized circuit dict, or 'circuit' itself when it has fewer
+        non-free gates, or as many non-free gates and fewer gates.
+    """
+    alice, bob = circuit.get("alice", []), circuit.get("bob", [])
+    inputs = alice + bob
+    graph = _Graph(len(inputs))
+    literals = {wire: 2 * (i + 1) for i, wire in enumerate(inputs)}
+    for gate in _topological_gates(circuit):
+        a = literals[gate["in"][0]]
+        b = literals[gate["in"][-1]]
+        literals[gate["id"]] = graph.gate(gate["type"], a, b)
+    outputs = [literals[wire] for wire in circuit["out"]]
+
+    # polarities needed of each node: 1 for the node, 2 for its complement
+    needed = bytearray(len(graph.kinds))
+    needed[1:len(inputs) + 1] = b"\x01" * len(inputs)  # inputs are wires
+    for literal in outputs:
+        needed[literal >> 1] |= 1 << (literal & 1)
+    if needed[0] and not inputs:
+        raise ValueError(f"Circuit {circuit['id']} has a constant output and no input")
+
+    def score(*literals):  # prefer literals needed anyway, then plain ones
+        return sum(2 * (needed[lit >> 1] >> (lit & 1) & 1) + 1 - (lit & 1) for lit in literals)
+
+    # gate inputs (literals) and gate types of each polarity of each node, chosen
+    # among equivalent forms from the consumers to the inputs
+    forms = {}
+    for node in range(len(graph.kinds) - 1, len(inputs), -1):
+        if not needed[node]:
+            continue
+        a, b = graph.fanins[node]
+        if graph.kinds[node] == XOR:  # x ^ y = ~x ^ ~y = ~(~x ^ y)
+            a = max(a, a ^ 1, key=score)
+            b = max(b, b ^ 1, key=score)
+            types = ("XOR", "XNOR") if (a ^ b) & 1 == 0 else ("XNOR", "XOR")
+        elif score(a, b) >= score(a ^ 1, b ^ 1):  # x & y = ~(~x | ~y)
+            types = ("AND", "NAND")
+        else:
+            a, b, types = a ^ 1, b ^ 1, ("NOR", "OR")
+        forms[node] = (a, b, types)
+        needed[a >> 1] |= 1 << (a & 1)
+        needed[b >> 1] |= 1 << (b & 1)
+
+    gates = []
+    wires = {2 * (i + 1): i + 1 for i in range(len(inputs))}  # literal -> new wire
+
+    def emit(gate_type, *gate_inputs):
+        gates.append({"id": len(inputs) + len(gates) + 1, "type": gate_type, "in": list(gate_inputs)})
+        return gates[-1]["id"]
+
+    for node, need in enumerate(needed):
+        literal = 2 * node
+        if graph.kinds[node] == INPUT:
+            if need & 2:
+                wires[literal ^ 1] = emit("NOT", wires[literal])
+            continue
+        if not need:
+            continue
+        if graph.kinds[node] == CONST:  # x ^ x and not (x ^ x)
+            types, gate_inputs = ("XOR", "XNOR"), (1, 1)
+        else:
+            a, b, types = forms[node]
+            gate_inputs = (wires[a], wires[b])
+        if need & 1:
+            wires[literal] = emit(types[0], *gate_inputs)
+        if need & 2:  # a NOT is free when the node is also needed
+            wires[literal ^ 1] = emit("NOT", wires[literal]) if need & 1 else emit(types[1], *gate_inputs)
+
+    if _cost(gates) > _cost(circuit["gates"]):  # rare, e.g. NOT gates of both polarities
+        return circuit
+    return {
+        "id": circuit["id"],
+        "alice": list(range(1, len(alice) + 1)),
+        "bob": list(range(len(alice) + 1, len(inputs) + 1)),
+        "out": [wires[literal] for literal in outputs],
+        "gates": gates,
+    }
+
+
+def _cost(gates):
+    return sum(gate["type"] in NON_FREE_GATES for gate in gates), len(gates)
+
+
+def gate_counts(gates):
+    """Return the number of gates of each type."""
+    return Counter(gate["type"] for gate in gates)
+
+
+def optimize_circuits(circuits, verbose=False):
+    """Optimize all circuits (see optimize_circuit).
+
+    Args:
+        circuits: A dict as read from a circuit JSON file.
+        verbose: Optional; print the gate counts by type before and after
+            the optimization of each circuit (Default: False).
+
+    Returns:
+        A new dict of the optimized circuits.
+    """
+    optimized = {"name": circuits["name"], "circuits": []}
+    for circuit in circuits["circuits"]:
+        result = optimize_circuit(circuit)
+        optimized["circuits"].append(result)
+        if verbose:
+            before, after = gate_counts(circuit["gates"]), gate_counts(result["gates"])
+            non_free = [sum(counts[t] for t in NON_FREE_GATES) for counts in (before, after)]
+            types = ", ".join(f"{t} {before[t]} -> {after[t]}" for t in yao.GATE_TYPES if before[t] or after[t])
+            print(f"Optimized {circuit['id']}: {len(circuit['gates'])} -> {len(result['gates'])} gates, "
+                  f"{non_free[0]} -> {non_free[1]} non-free ({types})")
+    return optimized
@@ -1,14 +1,336 @@
+import collections
 import hashlib
+import instrumentation
 import logging
+import os
 import pickle
+import random
+import secrets
 import util
 import yao
 
 
+OT_MODES = ("lockstep", "batched", "extension", "pool")
+KAPPA = 128  # number of base OTs of the OT extension (security parameter)
+POOL_PAD_LENGTH = 48  # bytes of each precomputed random OT message
+
+
+def transpose_bits(columns, length):
+    """Transpose a bit matrix.
+
+    Args:
+        columns: A list of ints, bit j of columns[i] being the entry (i, j).
+        length: The number of bits of each column.
+
+    Returns:
+        A list of 'length' ints, bit i of rows[j] being the entry (i, j).
+    """
+    strings = [f'{column:0{length}b}'[::-1] for column in columns]
+    return [int(''.join(row)[::-1], 2) for row in zip(*strings)]
+
+
+class OTExtension:
+    """IKNP OT extension state of a session.
+
+    KAPPA base OTs are run once per session with the roles reversed: Bob
+    sends pairs of random seeds and Alice picks one seed of each pair
+    according to her secret bits 's'. Any number of OTs is then derived
+    from the seeds with a hash function only.
+
+    Args:
+        seeds: Bob's side: a list of KAPPA pairs of seeds.
+               Alice's side: a list of the KAPPA seeds selected by 's'.
+        choices: Alice's side only; an int holding the KAPPA bits 's'.
+    """
+    def __init__(self, seeds, choices=None):
+        self.seeds = seeds
+        self.choices = choices
+        self.batch = 0  # number of extensions performed in the session
+
+    @staticmethod
+    def prg(seed, batch, length):
+        """Expand a seed into a 'length'-bit int for the given batch."""
+        data = hashlib.shake_128(seed + batch.to_bytes(8, "big"))
+        return int.from_bytes(data.digest((length + 7) // 8), "little") & (
+            (1 << length) - 1)
+
+    @staticmethod
+    def pad(batch, index, row, length):
+        """Hash a row of the extension matrix into a 'length'-byte pad."""
+        data = (batch.to_bytes(8, "big") + index.to_bytes(8, "big") +
+                row.to_bytes(KAPPA // 8, "big"))
+        return hashlib.shake_256(data).digest(length)
+
+    def extend_receiver(self, bits):
+        """Extend the base OTs, Bob's side.
+
+        Args:
+            bits: The list of Bob's choice bits.
+
+        Returns:
+            A tuple (batch, u, t): the batch number, the columns to send to
+            Alice and the rows used to compute the pads of Bob's messages.
+        """
+        length = len(bits)
+        batch, self.batch = self.batch, self.batch + 1
+        r = int(''.join(str(b) for b in reversed(bits)), 2) if bits else 0
+        t_columns, u_columns = [], []
+
+        for seed0, seed1 in self.seeds:
+            t = self.prg(seed0, batch, length)
+            t_columns.append(t)
+            u_columns.append(t ^ self.prg(seed1, batch, length) ^ r)
+
+        return batch, u_columns, transpose_bits(t_columns, length)
+
+    def extend_sender(self, u_columns, length):
+        """Extend the base OTs, Alice's side.
+
+        Args:
+            u_columns: The columns sent by Bob.
+            length: The number of OTs to extend.
+
+        Returns:
+            A tuple (batch, q): the batch number and the rows used to compute
+            the pads of Alice's messages.
+        """
+        batch, self.batch = self.batch, self.batch + 1
+        q_columns = []
+
+        for i, (seed, u) in enumerate(zip(self.seeds, u_columns)):
+            q = self.prg(seed, batch, length)
+            if (self.choices >> i) & 1:
+                q ^= u
+            q_columns.append(q)
+
+        return batch, transpose_bits(q_columns, length)
+
+
+class OTPool:
+    """Pool of precomputed random OTs.
+
+    Alice's entries are pairs of random pads (r0, r1), Bob's entries are
+    pairs (c, r_c) where c is a random choice bit. Both parties consume the
+    pool in the same order.
+
+    Args:
+        capacity: Optional; number of random OTs kept in the pool after a
+            refill (4096 by default).
+        threshold: Optional; a refill is triggered when a query would leave
+            less than 'threshold' random OTs in the pool (1024 by default).
+    """
+    def __init__(self, capacity=4096, threshold=1024):
+        if not 0 <= threshold <= capacity:
+            raise ValueError("The refill threshold must be in [0, capacity]")
+        self.capacity = capacity
+        self.threshold = threshold
+        self.entries = collections.deque()
+        self.stats = {
+            "generated": 0,  # random OTs added to the pool
+            "consumed": 0,  # random OTs used by online queries
+            "offline_refills": 0,  # refills run by precompute
+            "online_refills": 0,  # refills run along with a query
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def refill_count(self, needed):
+        """Return the number of random OTs to generate before a query.
+
+        Args:
+            needed: The number of OTs of the query.
+        """
+        if len(self.entries) - needed >= self.threshold:
+            return 0
+        return self.capacity + needed - len(self.entries)
+
+    def add(self, entries):
+        """Add precomputed random OTs to the pool."""
+        size = len(self.entries)
+        self.entries.extend(entries)
+        self.stats["generated"] += len(self.entries) - size
+
+    def take(self, count):
+        """Remove and return the 'count' oldest random OTs of the pool."""
+        if count > len(self.entries):
+            raise ValueError(f"Only {len(self.entries)} random OTs left in "
+                             f"the pool, {count} needed")
+        self.stats["consumed"] += count
+        return [self.entries.popleft() for _ in range(count)]
+
+    def get_stats(self):
+        """Return a dict with the pool size, limits and counters."""
+        return {"available": len(self.entries), "capacity": self.capacity,
+                "threshold": self.threshold, **self.stats}
+
+
 class ObliviousTransfer:
-    def __init__(self, socket, enabled=True):
+    """Oblivious transfer of Bob's input keys.
+
+    Args:
+        socket: The socket connecting Alice and Bob.
+        enabled: Optional; perform the OT protocol (True by default).
+        prime_groups: Optional; a list of precomputed util.PrimeGroup, one
+            of them is picked for each session instead of generating a new
+            group.
+        mode: Optional; Possible values:
+                            lockstep: one OT conversation per Bob's wire
+                            batched: every OT of a circuit evaluation in
+                                     a single round trip
+                            extension: same round trips as batched, but
+                                       only KAPPA public-key OTs per session
+                                       (see OTExtension)
+                            pool: random OTs are generated ahead of time by
+                                  precompute and queries only derandomize
+                                  them (see OTPool)
+              Default: lockstep. Bob receives the mode chosen by Alice
+              when the session starts.
+        pool_size: Optional; capacity of the random OT pool.
+        pool_threshold: Optional; refill threshold of the random OT pool.
+        metrics: Optional; the instrumentation.Metrics of the session,
+            recording the time of the OT phases and the number of OTs
+            (Default: instrumentation.NULL_METRICS).
+    """
+    def __init__(self, socket, enabled=True, prime_groups=None, mode="lockstep",
+                 pool_size=4096, pool_threshold=1024, metrics=instrumentation.NULL_METRICS):
+        if mode not in OT_MODES:
+            raise ValueError(f"Unknown OT mode '{mode}'")
         self.socket = socket
         self.enabled = enabled
+        self.prime_groups = prime_groups
+        self.mode = mode
+        self.group = None  # prime group shared by every OT of the session
+        self.extension = None  # OTExtension state of the session
+        self._base_ot = None  # (c, seeds) for Bob, (exponents, choices) for Alice while base OTs are running
+        self.pool = OTPool(pool_size, pool_threshold)  # random OTs
+        self.metrics = metrics
+
+    def start_session(self):
+        """Negotiate the OT mode and prime group of the session, Alice's side.
+
+        The group is sent once per connection and reused by every OT of
+        get_result/send_result.
+        """
+        with self.metrics.phase("ot_setup"):
+            if self.enabled:
+                if self.prime_groups:
+                    self.group = random.choice(self.prime_groups)
+                else:
+                    self.group = util.PrimeGroup()
+
+            logging.debug("Sending OT session parameters")
+            reply = self.socket.send_wait({"ot": "session", "mode": self.mode,
+                                           "group": self.group})
+
+            if self.enabled and self.mode in ("extension", "pool"):
+                self._start_extension(reply)
+
+    def _start_extension(self, c):
+        """Run the base OTs of the OT extension, Alice's side.
+
+        Args:
+            c: The public value sent by Bob, sender of the base OTs.
+        """
+        self._finish_extension(self.socket.send_wait(self._base_request(c)))
+
+    def _base_request(self, c):
+        """Return Alice's message of the base OTs (see _start_extension)."""
+        logging.debug("Base OTs started")
+        choices = secrets.randbits(KAPPA)
+        bits = {i: (choices >> i) & 1 for i in range(KAPPA)}
+        xs, hs = self.ot_evaluator_batch(c, bits)
+        self._base_ot = (xs, choices)
+        return {"ot": "base", "h": hs}
+
+    def _finish_extension(self, replies):
+        """Derive the seeds of the OT extension from Bob's base OT replies."""
+        xs, choices = self._base_ot
+        seeds = [self.ot_decrypt(xs[i], replies[i], (choices >> i) & 1)
+                 for i in range(KAPPA)]
+        self.extension = OTExtension(seeds, choices)
+        self._base_ot = None
+        self.metrics.count("base_ots", KAPPA)
+        logging.debug("Base OTs ended")
+
+    def serve_session(self, entry):
+        """Handle a session message sent by start_session, Bob's side.
+
+        Args:
+            entry: A dict containing the OT session message.
+
+        Returns:
+            The reply to send back to Alice.
+        """
+        if entry["ot"] == "session":
+            logging.debug("Received OT session parameters")
+            self.mode = entry["mode"]
+            self.group = entry["group"]
+            self.extension = None
+            self.pool.entries.clear()
+
+            if self.enabled and self.mode in ("extension", "pool"):
+                # Bob is the sender of the base OTs
+                G = self.group
+                seeds = [(os.urandom(16), os.urandom(16))
+                         for _ in range(KAPPA)]
+                self._base_ot = (G.gen_pow(G.rand_int()), seeds)
+                return self._base_ot[0]
+        elif entry["ot"] == "base":
+            c, seeds = self._base_ot
+            with self.metrics.phase("ot_setup"):
+                replies = self.ot_garbler_batch(c, entry["h"], dict(enumerate(seeds)))
+            self.extension = OTExtension(seeds)
+            self._base_ot = None
+            self.metrics.count("base_ots", KAPPA)
+            return replies
+        elif entry["ot"] == "refill":
+            self.pool.stats["offline_refills"] += 1
+            with self.metrics.phase("ot_precompute"):
+                return self._refill_receiver(entry["count"])
+        return True
+
+    def precompute(self):
+        """Fill the random OT pool up to its capacity, Alice's side.
+
+        This is the offline phase of the pool mode: it does not depend on
+        Bob's inputs and can run whenever Bob is listening.
+        """
+        if not self.enabled or self.mode != "pool":
+            return
+
+        count = self.pool.capacity - len(self.pool)
+        if count > 0:
+            logging.debug(f"Precomputing {count} random OTs")
+            with self.metrics.phase("ot_precompute"):
+                u_columns = self.socket.send_wait({"ot": "refill", "count": count})
+                self._refill_sender(u_columns, count)
+            self.pool.stats["offline_refills"] += 1
+
+    def _refill_sender(self, u_columns, count):
+        """Add 'count' random OTs to the pool, Alice's side."""
+        batch, q_rows = self.extension.extend_sender(u_columns, count)
+        s = self.extension.choices
+        pad = self.extension.pad
+        self.pool.add((pad(batch, j, q_rows[j], POOL_PAD_LENGTH),
+                       pad(batch, j, q_rows[j] ^ s, POOL_PAD_LENGTH))
+                      for j in range(count))
+        self.metrics.count("random_ots", count)
+
+    def _refill_receiver(self, count):
+        """Add 'count' random OTs to the pool, Bob's side.
+
+        Returns:
+            The columns of the OT extension to send to Alice.
+        """
+        choices = secrets.randbits(count) if count else 0
+        bits = [(choices >> j) & 1 for j in range(count)]
+        batch, u_columns, t_rows = self.extension.extend_receiver(bits)
+        pad = self.extension.pad
+        self.pool.add((bits[j], pad(batch, j, t_rows[j], POOL_PAD_LENGTH))
+                      for j in range(count))
+        self.metrics.count("random_ots", count)
+        return u_columns
 
     def get_result(self, a_inputs, b_keys):
         """Send Alice's inputs and retrieve Bob's result of evaluation.
@@ -20,6 +342,33 @@ class ObliviousTransfer:
         Returns:
             The result of the yao circuit evaluation.
         """
+        self.send_inputs(a_inputs, b_keys)
+        return self.socket.receive()
+
+    def send_inputs(self, a_inputs, b_keys):
+        """Send Alice's inputs and Bob's keys through oblivious transfer.
+
+        The last message is sent by Alice, so the next one to receive is
+        Bob's reply once he has his inputs (see receive_inputs).
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        if self.enabled:
+            self.metrics.count("ots", len(b_keys))
+        with self.metrics.phase("ot"):
+            self._send_inputs(a_inputs, b_keys)
+
+    def _send_inputs(self, a_inputs, b_keys):
+        """Send Alice's inputs and Bob's keys in the OT mode of the session."""
+        if self.mode == "batched" or (self.mode in ("extension", "pool") and not self.enabled):
+            return self._send_inputs_batched(a_inputs, b_keys)
+        if self.mode == "extension":
+            return self._send_inputs_extension(a_inputs, b_keys)
+        if self.mode == "pool":
+            return self._send_inputs_pool(a_inputs, b_keys)
+
         logging.debug("Sending inputs to Bob")
         self.socket.send(a_inputs)
 
@@ -34,19 +383,134 @@ class ObliviousTransfer:
                 to_send = (b_keys[w][0], b_keys[w][1])
                 self.socket.send(to_send)
 
-        return self.socket.receive()
+    def _send_inputs_batched(self, a_inputs, b_keys):
+        """Batched version of send_inputs.
+
+        Alice's inputs travel with the first OT message and every Bob's wire
+        is transferred at once, so the whole exchange takes two round trips
+        (one without OT) whatever the number of Bob's wires.
+        """
+        logging.debug("Sending inputs to Bob")
+        if not self.enabled:
+            self.socket.send({"a_inputs": a_inputs, "b_keys": b_keys})
+            return
+
+        G = self.group
+        c = G.gen_pow(G.rand_int())
+        h0s = self.socket.send_wait({"a_inputs": a_inputs, "c": c})
+        logging.debug(f"Received {len(h0s)} OT requests")
+
+        pairs = {
+            w: (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
+            for w in h0s
+        }
+        self.socket.send(self.ot_garbler_batch(c, h0s, pairs))
+
+    def _send_inputs_extension(self, a_inputs, b_keys):
+        """OT extension version of send_inputs (same round trips as batched)."""
+        logging.debug("Sending inputs to Bob")
+        u_columns = self.socket.send_wait({"a_inputs": a_inputs})
+
+        wires = sorted(b_keys)
+        batch, q_rows = self.extension.extend_sender(u_columns, len(wires))
+        s = self.extension.choices
+        replies = {}
+
+        for j, w in enumerate(wires):
+            msg0, msg1 = pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1])
+            pad0 = self.extension.pad(batch, j, q_rows[j], len(msg0))
+            pad1 = self.extension.pad(batch, j, q_rows[j] ^ s, len(msg1))
+            replies[w] = (util.xor_bytes(msg0, pad0), util.xor_bytes(msg1, pad1))
+
+        self.socket.send(replies)
 
-    def send_result(self, circuit, g_tables, pbits_out, b_inputs, end=False):
+    def _send_inputs_pool(self, a_inputs, b_keys):
+        """Random OT pool version of send_inputs.
+
+        Bob sends b ^ c for each wire and Alice answers with her messages
+        masked by the pads (r_d, r_(1-d)), so the online phase only XORs.
+        The pool is refilled along with the query when it runs low.
+        """
+        wires = sorted(b_keys)
+        count = self.pool.refill_count(len(wires))
+
+        logging.debug("Sending inputs to Bob")
+        reply = self.socket.send_wait({"a_inputs": a_inputs, "refill": count})
+        if count:
+            self._refill_sender(reply["u"], count)
+            self.pool.stats["online_refills"] += 1
+
+        replies = {}
+        for (r0, r1), w in zip(self.pool.take(len(wires)), wires):
+            msg0, msg1 = pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1])
+            if max(len(msg0), len(msg1)) > POOL_PAD_LENGTH:
+                raise ValueError("OT message longer than the pool pads")
+            pads = (r1, r0) if reply["d"][w] else (r0, r1)
+            replies[w] = (util.xor_bytes(msg0, pads[0]),
+                          util.xor_bytes(msg1, pads[1]))
+
+        self.socket.send(replies)
+
+    def send_result(self, circuit, g_tables, pbits_out, b_inputs,
+                    scheme="classic", backend="aes-cbc", workers=1):
         """Evaluate circuit and send the result to Alice.
 
         Args:
-            circuit: A dict containing circuit spec.
+            circuit: A dict containing circuit spec, or its
+                yao.CompiledCircuit.
             g_tables: Garbled tables of yao circuit.
             pbits_out: p-bits of outputs.
             b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; the garbling scheme of the circuit.
+            backend: Optional; the garbling backend of the circuit.
+            workers: Optional; the number of threads evaluating the circuit
+                (see yao.evaluate).
         """
+        a_inputs, b_inputs_encr = self.receive_inputs(b_inputs)
+        with self.metrics.phase("evaluation"):
+            result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
+                                  b_inputs_encr, scheme, backend, workers)
 
+        if self.metrics.enabled:
+            self.metrics.count("evaluations")
+            self.metrics.count_gates("evaluated", yao.gate_type_counts(circuit))
 
+        logging.debug("Sending circuit evaluation")
+        self.socket.send(result)
+
+    def receive_inputs(self, b_inputs):
+        """Receive Alice's inputs and Bob's keys through oblivious transfer.
+
+        The last message is received by Bob, who must reply to it.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A pair of dicts mapping Alice's and Bob's wires to their
+            (key, encr_bit) inputs.
+        """
+        if self.enabled:
+            self.metrics.count("ots", len(b_inputs))
+        with self.metrics.phase("ot"):
+            if self.mode == "batched" or (self.mode in ("extension", "pool") and not self.enabled):
+                return self._receive_inputs_batched(b_inputs)
+            if self.mode == "extension":
+                return self._receive_inputs_extension(b_inputs)
+            if self.mode == "pool":
+                return self._receive_inputs_pool(b_inputs)
+            return self._receive_inputs(b_inputs)
+
+    def _receive_inputs(self, b_inputs):
+        """Receive Alice's inputs and Bob's keys, one OT per Bob's wire.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A pair of dicts mapping Alice's and Bob's wires to their
+            (key, encr_bit) inputs.
+        """
         # map from Alice's wires to (key, encr_bit) inputs
         a_inputs = self.socket.receive()
         # map from Bob's wires to (key, encr_bit) inputs
@@ -65,14 +529,70 @@ class ObliviousTransfer:
                 logging.debug(f"Received key pair, key {b_input} selected")
                 b_inputs_encr[w] = pair[b_input]
 
-        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
-                              b_inputs_encr)
+        return a_inputs, b_inputs_encr
 
-        if end:
-            result = {"end": True}
-            
-        logging.debug("Sending circuit evaluation")
-        self.socket.send(result)
+    def _receive_inputs_batched(self, b_inputs):
+        """Batched version of _receive_inputs."""
+        entry = self.socket.receive()
+        a_inputs = entry["a_inputs"]
+
+        logging.debug("Received Alice's inputs")
+
+        if not self.enabled:
+            return a_inputs, {w: entry["b_keys"][w][b_input]
+                              for w, b_input in b_inputs.items()}
+
+        exponents, hs = self.ot_evaluator_batch(entry["c"], b_inputs)
+        replies = self.socket.send_wait(hs)
+        b_inputs_encr = {
+            w: pickle.loads(self.ot_decrypt(exponents[w], replies[w], b_input))
+            for w, b_input in b_inputs.items()
+        }
+        return a_inputs, b_inputs_encr
+
+    def _receive_inputs_extension(self, b_inputs):
+        """OT extension version of _receive_inputs."""
+        entry = self.socket.receive()
+        a_inputs = entry["a_inputs"]
+
+        logging.debug("Received Alice's inputs")
+
+        wires = sorted(b_inputs)
+        bits = [b_inputs[w] for w in wires]
+        batch, u_columns, t_rows = self.extension.extend_receiver(bits)
+        replies = self.socket.send_wait(u_columns)
+        b_inputs_encr = {}
+
+        for j, w in enumerate(wires):
+            e = replies[w][bits[j]]
+            pad = self.extension.pad(batch, j, t_rows[j], len(e))
+            b_inputs_encr[w] = pickle.loads(util.xor_bytes(e, pad))
+
+        return a_inputs, b_inputs_encr
+
+    def _receive_inputs_pool(self, b_inputs):
+        """Random OT pool version of _receive_inputs."""
+        entry = self.socket.receive()
+        a_inputs = entry["a_inputs"]
+
+        logging.debug("Received Alice's inputs")
+
+        u_columns = None
+        if entry["refill"]:
+            u_columns = self._refill_receiver(entry["refill"])
+            self.pool.stats["online_refills"] += 1
+
+        wires = sorted(b_inputs)
+        entries = self.pool.take(len(wires))
+        d = {w: b_inputs[w] ^ c for (c, _), w in zip(entries, wires)}
+        replies = self.socket.send_wait({"u": u_columns, "d": d})
+
+        b_inputs_encr = {}
+        for (_, pad), w in zip(entries, wires):
+            e = replies[w][b_inputs[w]]
+            b_inputs_encr[w] = pickle.loads(util.xor_bytes(e, pad))
+
+        return a_inputs, b_inputs_encr
 
     def ot_garbler(self, msgs):
         """Oblivious transfer, Alice's side.
@@ -81,8 +601,7 @@ class ObliviousTransfer:
             msgs: A pair (msg1, msg2) to suggest to Bob.
         """
         logging.debug("OT protocol started")
-        G = util.PrimeGroup()
-        self.socket.send_wait(G)
+        G = self.group
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
         c = G.gen_pow(G.rand_int())
@@ -106,8 +625,7 @@ class ObliviousTransfer:
             The message selected by Bob.
         """
         logging.debug("OT protocol started")
-        G = self.socket.receive()
-        self.socket.send(True)
+        G = self.group
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
         c = self.socket.receive()
@@ -122,9 +640,248 @@ class ObliviousTransfer:
         logging.debug("OT protocol ended")
         return mb
 
+    def ot_garbler_batch(self, c, h0s, msgs):
+        """Batched oblivious transfer, Alice's side.
+
+        Every transfer shares the public value 'c', each one uses its own
+        random exponent.
+
+        Args:
+            c: The public value sent to Bob.
+            h0s: A dict mapping each Bob's wire to the h0 chosen by Bob.
+            msgs: A dict mapping each Bob's wire to a pair (msg1, msg2).
+
+        Returns:
+            A dict mapping each Bob's wire to its (c1, e0, e1) reply.
+        """
+        G = self.group
+        replies = {}
+
+        for w, h0 in h0s.items():
+            h1 = G.mul(c, G.inv(h0))
+            k = G.rand_int()
+            c1 = G.gen_pow(k)
+            e0 = util.xor_bytes(msgs[w][0],
+                                self.ot_hash(G.pow(h0, k), len(msgs[w][0])))
+            e1 = util.xor_bytes(msgs[w][1],
+                                self.ot_hash(G.pow(h1, k), len(msgs[w][1])))
+            replies[w] = (c1, e0, e1)
+
+        return replies
+
+    def ot_evaluator_batch(self, c, b_inputs):
+        """Batched oblivious transfer, Bob's side.
+
+        Args:
+            c: The public value sent by Alice.
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A pair of dicts mapping each Bob's wire to its secret exponent
+            and to the h0 to send to Alice.
+        """
+        G = self.group
+        exponents, hs = {}, {}
+
+        for w, b in b_inputs.items():
+            x = G.rand_int()
+            x_pow = G.gen_pow(x)
+            h = (x_pow, G.mul(c, G.inv(x_pow)))
+            exponents[w] = x
+            hs[w] = h[b]
+
+        return exponents, hs
+
+    def ot_decrypt(self, x, reply, b):
+        """Retrieve the message selected by Bob from Alice's reply.
+
+        Args:
+            x: Bob's secret exponent.
+            reply: The (c1, e0, e1) reply of Alice.
+            b: Bob's input bit.
+
+        Returns:
+            The message selected by Bob.
+        """
+        c1, e0, e1 = reply
+        e = (e0, e1)
+        ot_hash = self.ot_hash(self.group.pow(c1, x), len(e[b]))
+        return util.xor_bytes(e[b], ot_hash)
+
     @staticmethod
     def ot_hash(pub_key, msg_length):
         """Hash function for OT keys."""
         key_length = (pub_key.bit_length() + 7) // 8  # key length in bytes
         bytes = pub_key.to_bytes(key_length, byteorder="big")
         return hashlib.shake_256(bytes).digest(msg_length)
+
+
+ASYNC_OT_MODES = ("batched", "extension")  # modes of AsyncObliviousTransfer
+
+
+class AsyncObliviousTransfer(ObliviousTransfer):
+    """Oblivious transfer over a util.AsyncSocket, with pipelined messages.
+
+    The OT messages travel with the protocol messages of main.AsyncAlice
+    and main.AsyncBob, which dispatch the messages they receive: the
+    session parameters with the first message of the session and Alice's
+    first OT message with her inputs. Bob then transfers the keys of every
+    evaluation of a circuit at once, so that the OT of a circuit costs one
+    request of Bob and one reply of Alice, whatever the number of Bob's
+    values. Nothing waits for a reply in this class.
+
+    Only the "batched" and "extension" modes are supported: the lockstep
+    mode needs a round trip per wire and the pool mode an offline phase.
+
+    Args:
+        socket: The util.AsyncSocket connecting Alice and Bob.
+        enabled: Optional; perform the OT protocol (True by default).
+        prime_groups: Optional; see ObliviousTransfer.
+        mode: Optional; "batched" or "extension" (Default: extension).
+        metrics: Optional; see ObliviousTransfer.
+    """
+    def __init__(self, socket, enabled=True, prime_groups=None, mode="extension",
+                 metrics=instrumentation.NULL_METRICS):
+        if mode not in ASYNC_OT_MODES:
+            raise ValueError(f"The OT mode '{mode}' is not supported over the asyncio transport, "
+                             f"use one of {', '.join(ASYNC_OT_MODES)}")
+        super().__init__(socket, enabled=enabled, prime_groups=prime_groups, mode=mode, metrics=metrics)
+
+    @staticmethod
+    def _keys(count, wires):
+        # the order of the OTs of a request: by evaluation, then by wire
+        return [(i, w) for i in range(count) for w in sorted(wires)]
+
+    def session_request(self):
+        """Return the OT session parameters sent by Alice, see serve_session."""
+        with self.metrics.phase("ot_setup"):
+            if self.enabled:
+                if self.prime_groups:
+                    self.group = random.choice(self.prime_groups)
+                else:
+                    self.group = util.PrimeGroup()
+        return {"ot": "session", "mode": self.mode, "group": self.group}
+
+    async def start_session(self, reply):
+        """Send the base OTs of the extension mode, Alice's side.
+
+        Bob's replies are passed to finish_session when they arrive.
+
+        Args:
+            reply: Bob's reply to the session parameters.
+        """
+        if self.enabled and self.mode == "extension":
+            with self.metrics.phase("ot_setup"):
+                message = self._base_request(reply)
+            await self.socket.send(message)
+
+    def finish_session(self, replies):
+        """Derive the OT extension from Bob's base OT replies, Alice's side."""
+        with self.metrics.phase("ot_setup"):
+            self._finish_extension(replies)
+
+    def inputs_message(self, a_inputs, b_keys):
+        """Return Alice's inputs with her first OT message of a circuit.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+
+        Returns:
+            A pair (message, c): the dict sent with the circuit and the
+            public value of the batched mode, to pass to send_replies.
+        """
+        if not self.enabled:
+            return {"a_inputs": a_inputs, "b_keys": b_keys}, None
+        if self.mode == "batched":
+            G = self.group
+            c = G.gen_pow(G.rand_int())
+            return {"a_inputs": a_inputs, "c": c}, c
+        return {"a_inputs": a_inputs}, None
+
+    async def send_replies(self, request, b_keys, c=None):
+        """Answer Bob's OT request of a circuit, Alice's side.
+
+        Args:
+            request: Bob's request, see request_inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+            c: Optional; the public value returned by inputs_message.
+        """
+        keys = self._keys(request["count"], b_keys)
+        self.metrics.count("ots", len(keys))
+        with self.metrics.phase("ot"):
+            pairs = {w: (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1])) for w in b_keys}
+            if self.mode == "batched":
+                replies = self.ot_garbler_batch(c, request["h"], {key: pairs[key[1]] for key in keys})
+            else:
+                batch, q_rows = self.extension.extend_sender(request["u"], len(keys))
+                s = self.extension.choices
+                replies = []
+                for j, (_, w) in enumerate(keys):
+                    msg0, msg1 = pairs[w]
+                    pad0 = self.extension.pad(batch, j, q_rows[j], len(msg0))
+                    pad1 = self.extension.pad(batch, j, q_rows[j] ^ s, len(msg1))
+                    replies.append((util.xor_bytes(msg0, pad0), util.xor_bytes(msg1, pad1)))
+        await self.socket.send({"replies": replies})
+
+    async def request_inputs(self, inputs, b_inputs_list):
+        """Send Bob's OT request for every evaluation of a circuit.
+
+        Nothing is sent when the OT is disabled, Alice's message then holds
+        both keys of each Bob's wire.
+
+        Args:
+            inputs: Alice's message sent with the circuit, see
+                inputs_message.
+            b_inputs_list: A list of dicts mapping Bob's wires to (clear)
+                input bits, one per evaluation.
+
+        Returns:
+            The pending request, to pass to decrypt_inputs along with
+            Alice's replies.
+        """
+        if not self.enabled:
+            return len(b_inputs_list), None, [{w: inputs["b_keys"][w][b_input] for w, b_input in b_inputs.items()}
+                                              for b_inputs in b_inputs_list]
+
+        bits = {(i, w): b_inputs_list[i][w]
+                for i, w in self._keys(len(b_inputs_list), b_inputs_list[0] if b_inputs_list else ())}
+        self.metrics.count("ots", len(bits))
+        with self.metrics.phase("ot"):
+            if self.mode == "batched":
+                state, hs = self.ot_evaluator_batch(inputs["c"], bits)
+                request = {"h": hs}
+            else:
+                batch, u_columns, t_rows = self.extension.extend_receiver(list(bits.values()))
+                state = (batch, t_rows)
+                request = {"u": u_columns}
+        request["count"] = len(b_inputs_list)
+        await self.socket.send({"request": request})
+        return len(b_inputs_list), bits, state
+
+    def decrypt_inputs(self, pending, replies):
+        """Return Bob's inputs of a circuit from Alice's replies.
+
+        Args:
+            pending: The pending request returned by request_inputs.
+            replies: Alice's replies, None if the OT is disabled.
+
+        Returns:
+            A list of dicts mapping Bob's wires to their (key, encr_bit)
+            inputs, one per evaluation.
+        """
+        count, bits, state = pending
+        if bits is None:
+            return state
+
+        b_inputs_encr = [{} for _ in range(count)]
+        with self.metrics.phase("ot"):
+            for j, ((i, w), b_input) in enumerate(bits.items()):
+                if self.mode == "batched":
+                    message = self.ot_decrypt(state[(i, w)], replies[(i, w)], b_input)
+                else:
+                    batch, t_rows = state
+                    e = replies[j][b_input]
+                    message = util.xor_bytes(e, self.extension.pad(batch, j, t_rows[j], len(e)))
+                b_inputs_encr[i][w] = pickle.loads(message)
+        return b_inputs_encr
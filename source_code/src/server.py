@@ -0,0 +1,370 @@
+import collections
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+import main
+import util
+import zmq
+
+DEFAULT_BACKLOG = 16  # sessions waiting for a worker before new ones are refused
+DEFAULT_IDLE_TIMEOUT = 60  # seconds without a message of Alice before a session is closed
+POLL_INTERVAL = 100  # milliseconds between two checks of the workers
+CLOSED_SESSIONS = 1024  # closed sessions remembered to answer Alice's late messages with an error
+READY = b"ready"  # control messages of the workers, sent with an empty identity
+DONE = b"done"
+FAILED = b"failed"  # followed by the reason
+
+
+class SessionSocket(util.Socket):
+    """The socket of a session of Alice in a worker of an EvaluatorServer.
+
+    It has the interface of util.EvaluatorSocket for main.Bob: the
+    messages go through the DEALER socket of the worker, prefixed with the
+    identity of Alice's connection to the server. poll_socket stops after
+    Alice's last message (see main.Alice.start).
+
+    Args:
+        socket: The DEALER socket of the worker.
+        identity: The identity of Alice's connection.
+        frames: The frames of the first message of the session.
+        idle_timeout: Seconds to wait for a message of Alice.
+        closed: Optional; the ClosedSessions of the worker, whose late
+            messages are answered with an error.
+    """
+    def __init__(self, socket, identity, frames, idle_timeout=DEFAULT_IDLE_TIMEOUT, closed=None):
+        super().__init__()
+        self.socket = socket
+        self.identity = identity
+        self.idle_timeout = idle_timeout
+        self.closed = ClosedSessions() if closed is None else closed
+        self._first = frames
+        self._closed = False
+        self.replied = True  # the last message of Alice was answered
+
+    def send(self, msg):
+        data = pickle.dumps(msg, pickle.DEFAULT_PROTOCOL)
+        self.socket.send_multipart([self.identity, data])
+        self.replied = True
+        if self.metrics.enabled:
+            self._count_sent(len(data))
+
+    def send_frames(self, frames):
+        self.socket.send_multipart([self.identity] + list(frames), copy=False)
+        self.replied = True
+        if self.metrics.enabled:
+            self._count_sent(sum(memoryview(frame).nbytes for frame in frames))
+
+    def receive(self):
+        """Receive a message of Alice, see util.Socket.receive.
+
+        Raises:
+            TimeoutError: Alice sent nothing for 'idle_timeout' seconds.
+        """
+        if self._first is not None:
+            frames, self._first = self._first, None
+        else:
+            deadline = time.monotonic() + self.idle_timeout
+            while True:
+                timeout = max(0, deadline - time.monotonic())
+                if not self.socket.poll(1000 * timeout):
+                    raise TimeoutError(f"No message of Alice for {self.idle_timeout} seconds")
+                frames = self.socket.recv_multipart(copy=False)
+                if frames[0].bytes == self.identity:
+                    frames = frames[1:]  # without the identity
+                    break
+                # routed before the broker knew that a previous session of the worker was closed
+                self.closed.reject(self.socket, frames[0].bytes)
+        self.replied = False
+        return self._load(frames)
+
+    def poll_socket(self, timetick=None):
+        while not self._closed:
+            entry = self.receive()
+            if isinstance(entry, dict) and entry.get("end") is not None:
+                self._closed = True
+            yield entry
+
+
+class ClosedSessions:
+    """The identities of the sessions closed before Alice's last message.
+
+    Alice may still send messages on the connection of a session closed
+    after a failure or an idle timeout, which must not start a new
+    session: they are answered with an error reply (see
+    util.Socket.check_error). Only the last CLOSED_SESSIONS sessions are
+    remembered.
+    """
+    def __init__(self):
+        self.reasons = collections.OrderedDict()  # identity of Alice's connection -> reason
+
+    def add(self, identity, reason):
+        self.reasons[identity] = reason
+        if len(self.reasons) > CLOSED_SESSIONS:
+            self.reasons.popitem(last=False)
+
+    def __contains__(self, identity):
+        return identity in self.reasons
+
+    def error(self, identity):
+        """Return the error reply to a late message of a closed session."""
+        return {"error": f"The session was closed: {self.reasons[identity]}", "refused": False}
+
+    def reject(self, socket, identity):
+        """Answer a late message of a worker's closed session through its DEALER socket."""
+        if identity in self.reasons:
+            socket.send_multipart([identity, pickle.dumps(self.error(identity), pickle.DEFAULT_PROTOCOL)])
+
+
+def _serve_sessions(index, endpoint, bob_set, bob_kwargs, idle_timeout):
+    """Serve sessions one at a time, in a worker process of an EvaluatorServer."""
+    socket = zmq.Context().socket(zmq.DEALER)
+    socket.setsockopt(zmq.IDENTITY, f"worker-{index}".encode())
+    socket.connect(endpoint)
+    socket.send_multipart([b"", READY])
+    parent = multiprocessing.parent_process()
+    closed = ClosedSessions()
+    try:
+        while True:
+            if not socket.poll(POLL_INTERVAL):
+                if not parent.is_alive():  # the server was killed
+                    return
+                continue
+            frames = socket.recv_multipart(copy=False)
+            if frames[0].bytes in closed:  # routed before the broker knew that the session was closed
+                closed.reject(socket, frames[0].bytes)
+                continue
+            session = SessionSocket(socket, frames[0].bytes, frames[1:], idle_timeout, closed)
+            try:
+                main.Bob(bob_set, socket=session, **bob_kwargs).listen()
+            except Exception as error:
+                logging.warning(f"Session of worker {index} failed: {error!r}")
+                reason = str(error)
+                closed.add(session.identity, reason)
+                if not session.replied:  # Alice waits for a reply
+                    session.send(closed.error(session.identity))
+                socket.send_multipart([b"", FAILED, reason.encode()])
+                continue
+            socket.send_multipart([b"", DONE])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        socket.close(linger=0)
+
+
+class Session:
+    """The state of a session of Alice kept by the broker of an EvaluatorServer.
+
+    The state of the protocol is kept by the main.Bob of the worker
+    serving the session.
+
+    Args:
+        identity: The identity of Alice's connection.
+        number: The number of the session since the server started.
+
+    Attributes:
+        worker: The identity of the worker serving the session, None while
+            the session waits for a worker.
+        pending: The frames of the first message while the session waits.
+        created: The time.perf_counter of the first message.
+        started: The time.perf_counter of the assignment to a worker.
+        messages: The number of messages received from Alice.
+    """
+    def __init__(self, identity, number):
+        self.identity = identity
+        self.number = number
+        self.worker = None
+        self.pending = None
+        self.created = time.perf_counter()
+        self.started = None
+        self.messages = 0
+
+
+class EvaluatorServer:
+    """Bob's evaluator server, serving many Alices at once.
+
+    A ROUTER socket receives the messages of every Alice, each one
+    connected with a REQ socket (see util.GarblerSocket), and routes them
+    to a pool of worker processes. A worker serves one session at a time
+    with its own main.Bob, so that the state of a session (operation, bit
+    length, bins, OT) is not shared, and the sessions are evaluated
+    concurrently by as many processes.
+
+    When every worker is busy, new sessions wait in the order they arrive:
+    as Alice waits for a reply to each message, a waiting session holds a
+    single message. Beyond 'backlog' waiting sessions, new sessions are
+    refused with an error reply, which Alice raises as a
+    ConnectionRefusedError. A session ends after Alice's last message or
+    'idle_timeout' seconds without a message. The later messages of a
+    session that ended before Alice's last message, or whose worker died,
+    are answered with an error reply, which Alice raises as a
+    ConnectionAbortedError.
+
+    Args:
+        set: Bob's set of values, shared by every session.
+        sessions: Optional; the maximum number of sessions evaluated
+            concurrently, i.e. the number of worker processes
+            (Default: os.cpu_count()).
+        backlog: Optional; the maximum number of sessions waiting for a
+            worker (Default: DEFAULT_BACKLOG).
+        idle_timeout: Optional; seconds without a message of Alice after
+            which a session is closed (Default: DEFAULT_IDLE_TIMEOUT).
+        endpoint: Optional; the ZeroMQ endpoint to bind (Default: the
+            endpoint of util.EvaluatorSocket).
+        bob_kwargs: The other arguments of main.Bob, e.g. 'workers' or
+            'metrics'.
+
+    Attributes:
+        stats: A dict counting the sessions "served", "refused" and
+            "failed" (closed after a failure or an idle timeout, or whose
+            worker died).
+    """
+    def __init__(self, set, sessions=None, backlog=DEFAULT_BACKLOG, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 endpoint=f"tcp://*:{util.LOCAL_PORT}", **bob_kwargs):
+        sessions = os.cpu_count() if sessions is None else sessions
+        if sessions < 1:
+            raise ValueError("The server needs at least one session")
+        if backlog < 0:
+            raise ValueError("The backlog cannot be negative")
+        self.set = set
+        self.max_sessions = sessions
+        self.backlog = backlog
+        self.idle_timeout = idle_timeout
+        self.endpoint = endpoint
+        self.bob_kwargs = bob_kwargs
+        self.stats = {"served": 0, "refused": 0, "failed": 0}
+        self.sessions = {}  # identity of Alice's connection -> Session
+        self.waiting = collections.deque()  # Sessions waiting for a worker
+        self.idle_workers = collections.deque()
+        self.busy_workers = {}  # identity of a worker -> Session
+        self.processes = {}  # identity of a worker -> multiprocessing.Process
+        self.closed = ClosedSessions()
+        self._count = 0
+
+    def serve(self, ready=None):
+        """Start the workers and route the messages until interrupted.
+
+        Args:
+            ready: Optional; a threading or multiprocessing Event set once
+                every worker is ready to serve a session.
+        """
+        context = zmq.Context()
+        self.frontend = context.socket(zmq.ROUTER)
+        self.frontend.bind(self.endpoint)
+        self.backend = context.socket(zmq.ROUTER)
+        self.backend.setsockopt(zmq.ROUTER_HANDOVER, 1)  # a restarted worker takes over its identity
+        self.backend.bind("tcp://127.0.0.1:*")
+        self._backend_endpoint = self.backend.getsockopt_string(zmq.LAST_ENDPOINT)
+        self._spawn = multiprocessing.get_context("spawn")
+        for index in range(self.max_sessions):
+            self._start_worker(index)
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        print(f"Serving up to {self.max_sessions} sessions at once on {self.endpoint}")
+
+        try:
+            while True:
+                events = dict(poller.poll(POLL_INTERVAL))
+                if self.backend in events:
+                    self._from_worker(self.backend.recv_multipart(copy=False))
+                if self.frontend in events:
+                    self._from_alice(self.frontend.recv_multipart(copy=False))
+                if ready is not None and len(self.idle_workers) + len(self.busy_workers) == self.max_sessions:
+                    ready.set()
+                    ready = None
+                self._check_workers()
+        except KeyboardInterrupt:
+            print("Closing connection")
+        finally:
+            for process in self.processes.values():
+                process.terminate()
+            for process in self.processes.values():
+                process.join()
+            self.frontend.close(linger=0)
+            self.backend.close(linger=0)
+
+    def _start_worker(self, index):
+        process = self._spawn.Process(target=_serve_sessions, daemon=True,
+                                      args=(index, self._backend_endpoint, self.set, self.bob_kwargs,
+                                            self.idle_timeout))
+        process.start()
+        self.processes[f"worker-{index}".encode()] = process
+
+    def _from_alice(self, frames):
+        # frames: identity, empty delimiter of the REQ socket, message
+        identity = frames[0].bytes
+        session = self.sessions.get(identity)
+        if session is None:
+            if identity in self.closed:
+                self._reply(identity, self.closed.error(identity))
+            elif self.idle_workers or len(self.waiting) < self.backlog:
+                self._count += 1
+                session = self.sessions[identity] = Session(identity, self._count)
+            else:
+                self.stats["refused"] += 1
+                self._reply(identity, {"error": f"Bob is serving {self.max_sessions} sessions, "
+                                                f"{len(self.waiting)} waiting", "refused": True})
+            if session is None:
+                return
+        session.messages += 1
+        if session.worker is not None:
+            self.backend.send_multipart([session.worker, identity] + frames[2:], copy=False)
+        elif self.idle_workers:
+            self._assign(session, self.idle_workers.popleft(), frames[2:])
+        else:
+            session.pending = frames[2:]
+            self.waiting.append(session)
+
+    def _from_worker(self, frames):
+        # frames: identity of the worker, identity of Alice's connection or b"" for a control message, message
+        worker, identity = frames[0].bytes, frames[1].bytes
+        if identity:
+            self.frontend.send_multipart([identity, b""] + frames[2:], copy=False)
+            return
+        session = self.busy_workers.pop(worker, None)
+        if session is not None:  # DONE or FAILED
+            self._end(session, frames[3].bytes.decode() if frames[2].bytes == FAILED else None)
+        if self.waiting:
+            session = self.waiting.popleft()
+            self._assign(session, worker, session.pending)
+        else:
+            self.idle_workers.append(worker)
+
+    def _assign(self, session, worker, frames):
+        session.worker = worker
+        session.pending = None
+        session.started = time.perf_counter()
+        self.busy_workers[worker] = session
+        self.backend.send_multipart([worker, session.identity] + frames, copy=False)
+        print(f"Session {session.number} started after waiting {session.started - session.created:.3f} s "
+              f"({len(self.busy_workers)} running, {len(self.waiting)} waiting)")
+
+    def _end(self, session, failure=None):
+        del self.sessions[session.identity]
+        if failure is not None:
+            self.closed.add(session.identity, failure)
+        self.stats["served" if failure is None else "failed"] += 1
+        status = "ended" if failure is None else f"closed ({failure})"
+        print(f"Session {session.number} {status} after {time.perf_counter() - session.started:.3f} s, "
+              f"{session.messages} messages")
+
+    def _check_workers(self):
+        # a worker that died is restarted, Alice gets an error reply if it was serving her session
+        for worker, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            logging.warning(f"Worker {worker.decode()} exited with code {process.exitcode}, restarting it")
+            session = self.busy_workers.pop(worker, None)
+            if session is not None:
+                del self.sessions[session.identity]
+                self.stats["failed"] += 1
+                self.closed.add(session.identity, "the worker of the session died")
+                self._reply(session.identity, self.closed.error(session.identity))  # dropped unless Alice waits
+            if worker in self.idle_workers:
+                self.idle_workers.remove(worker)
+            self._start_worker(int(worker.decode().rsplit("-", 1)[1]))
+
+    def _reply(self, identity, msg):
+        self.frontend.send_multipart([identity, b"", pickle.dumps(msg, pickle.DEFAULT_PROTOCOL)])
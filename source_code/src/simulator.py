@@ -0,0 +1,309 @@
+import random
+import numpy as np
+import circuit_generator
+import yao
+
+# Operations of the gate types on 64 packed input vectors
+GATE_OPS = {
+    "NOT": lambda a, b: ~a,
+    "AND": np.bitwise_and,
+    "OR": np.bitwise_or,
+    "XOR": np.bitwise_xor,
+    "NOR": lambda a, b: ~(a | b),
+    "NAND": lambda a, b: ~(a & b),
+    "XNOR": lambda a, b: ~(a ^ b),
+}
+FREE_GATES = ("XOR", "XNOR", "NOT")  # free with the free-xor and half-gates schemes
+DEFAULT_VECTORS = 1024
+
+
+def pack_vectors(bits):
+    """Pack input vectors into 64-bit words.
+
+    Args:
+        bits: A (vectors, wires) array of 0/1 values.
+
+    Returns:
+        A (wires, ceil(vectors / 64)) uint64 array, bit i of word j of a wire
+        being its value in vector 64 j + i.
+    """
+    bits = np.asarray(bits, dtype=np.uint8)
+    vectors = bits.shape[0]
+    padded = np.zeros((bits.shape[1], -(-vectors // 64) * 64), dtype=np.uint8)
+    padded[:, :vectors] = bits.T
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8")
+
+
+def unpack_vectors(words, vectors):
+    """Inverse of pack_vectors, for the first 'vectors' vectors."""
+    words = np.ascontiguousarray(words, dtype="<u8")
+    bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder="little")
+    return bits[:, :vectors].T
+
+
+class Simulator:
+    """A plaintext evaluator of circuits for many input vectors at once.
+
+    The circuit is evaluated level by level, a gate of level d reading at
+    least one output of level d - 1. The gates of a level are grouped by
+    type, and each group is evaluated with one NumPy operation on the
+    packed values of all vectors (see pack_vectors).
+
+    Args:
+        circuit: A circuit dict, as in the circuit JSON files. Its gates
+            are sorted with yao.CompiledCircuit unless each gate already
+            comes after the gates computing its inputs.
+    """
+    def __init__(self, circuit):
+        self.circuit = circuit
+        inputs = circuit.get("alice", []) + circuit.get("bob", [])
+        gates = circuit["gates"]
+        index = self._index_wires(inputs, gates)
+        if index is None:  # not in topological order
+            gates = yao.CompiledCircuit(circuit).gates
+            index = self._index_wires(inputs, gates)
+
+        # wires are numbered inputs first, then gate outputs in order
+        count = len(gates)
+        self.num_wires = len(inputs) + count
+        self.inputs = np.arange(len(inputs), dtype=np.int64)
+        self.outputs = np.array([index[w] for w in circuit["out"]], dtype=np.int64)
+        types = np.fromiter((yao.GATE_CODES[g["type"]] for g in gates), dtype=np.uint8, count=count)
+        in_a = np.fromiter((index[g["in"][0]] for g in gates), dtype=np.int64, count=count)
+        # NOT gates read their only input twice
+        in_b = np.fromiter((index[g["in"][-1]] for g in gates), dtype=np.int64, count=count)
+        out = np.arange(len(inputs), self.num_wires, dtype=np.int64)
+
+        depth = [0] * self.num_wires
+        a_list, b_list = in_a.tolist(), in_b.tolist()
+        for g, wire in enumerate(out.tolist()):
+            depth_a, depth_b = depth[a_list[g]], depth[b_list[g]]
+            depth[wire] = (depth_a if depth_a > depth_b else depth_b) + 1
+        levels = np.array(depth[len(inputs):], dtype=np.int64) - 1
+
+        self.type_counts = np.bincount(types, minlength=len(yao.GATE_TYPES))
+        self.level_widths = np.bincount(levels) if count else np.zeros(0, dtype=np.int64)
+
+        # (operation, first inputs, second inputs, outputs) of each type of each level
+        order = np.lexsort((types, levels))
+        keys = levels[order] * len(yao.GATE_TYPES) + types[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        self.groups = [(GATE_OPS[yao.GATE_TYPES[types[group[0]]]], in_a[group], in_b[group], out[group])
+                       for group in np.split(order, bounds) if len(group)]
+
+    @staticmethod
+    def _index_wires(inputs, gates):
+        """Map wires to their numbers, or return None if a gate reads a
+        wire computed after it."""
+        index = {wire: i for i, wire in enumerate(inputs)}
+        for g, gate in enumerate(gates, len(inputs)):
+            for wire in gate["in"]:
+                if wire not in index:
+                    return None
+            index[gate["id"]] = g
+        return index
+
+    def evaluate_packed(self, words):
+        """Evaluate the circuit on packed inputs.
+
+        Args:
+            words: A (inputs, words) uint64 array of the packed values of
+                Alice's then Bob's wires (see pack_vectors).
+
+        Returns:
+            A (outputs, words) uint64 array of the packed output values.
+        """
+        values = np.zeros((self.num_wires, words.shape[1]), dtype=np.uint64)
+        values[self.inputs] = words
+        for operation, in_a, in_b, out in self.groups:
+            values[out] = operation(values[in_a], values[in_b])
+        return values[self.outputs]
+
+    def evaluate(self, alice_bits, bob_bits):
+        """Evaluate the circuit for many input vectors.
+
+        Args:
+            alice_bits: A (vectors, alice wires) array of Alice's input bits.
+            bob_bits: A (vectors, bob wires) array of Bob's input bits.
+
+        Returns:
+            A (vectors, outputs) uint8 array of the output bits.
+        """
+        alice_bits = np.asarray(alice_bits, dtype=np.uint8)
+        bob_bits = np.asarray(bob_bits, dtype=np.uint8)
+        vectors = max(len(alice_bits), len(bob_bits))
+        bits = np.hstack([alice_bits.reshape(vectors, -1), bob_bits.reshape(vectors, -1)])
+        return unpack_vectors(self.evaluate_packed(pack_vectors(bits)), vectors)
+
+    def stats(self):
+        """Return the gate statistics of the circuit.
+
+        Returns:
+            A dict with the number of gates, of gates of each type and of
+            non-free gates, the depth and the width (see
+            circuit_generator.circuit_stats).
+        """
+        counts = {gate_type: int(count) for gate_type, count in zip(yao.GATE_TYPES, self.type_counts) if count}
+        return {
+            "gates": int(self.type_counts.sum()),
+            "types": counts,
+            "non_free": sum(count for gate_type, count in counts.items() if gate_type not in FREE_GATES),
+            "depth": len(self.level_widths),
+            "width": int(self.level_widths.max(initial=0)),
+        }
+
+
+def value_bits(values, width):
+    """Return the bits (least significant first) of an array of values, as
+    an array with one more axis of size 'width'."""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values[..., None] >> np.arange(width)) & 1).astype(np.uint8)
+
+
+def _near_values(rng, alice, shape, bit_length):
+    """Random values of bob: a third are values of alice, a third are values
+    of alice with one bit flipped (the hardest mismatches for equality
+    circuits) and a third are uniform.
+
+    Args:
+        alice: A (vectors, values) array of Alice's values.
+        shape: The shape (vectors, values) of Bob's values.
+    """
+    rows = np.arange(shape[0]).reshape(-1, *([1] * (len(shape) - 1)))
+    picked = alice[rows, rng.integers(0, alice.shape[1], size=shape)]
+    flipped = picked ^ (1 << rng.integers(0, bit_length, size=shape))
+    choice = rng.integers(0, 3, size=shape)
+    uniform = rng.integers(0, 1 << bit_length, size=shape)
+    return np.where(choice == 0, picked, np.where(choice == 1, flipped, uniform))
+
+
+def _compare_vectors(rng, vectors, bit_length, capacity):
+    """Random inputs and expected outputs of compare(bit_length, capacity)."""
+    alice = rng.integers(0, 1 << bit_length, size=(vectors, capacity))
+    bob = _near_values(rng, alice, (vectors,), bit_length)
+    match = (alice == bob[:, None]).any(axis=1)
+    expected = np.hstack([match[:, None], value_bits(np.where(match, bob, 0), bit_length)])
+    return value_bits(alice, bit_length).reshape(vectors, -1), value_bits(bob, bit_length), expected
+
+
+def _sample_sets(vectors, bit_length, alice_set_cardinality, bob_set_cardinality):
+    """Random pairs of sets of distinct values with a random number of
+    common values."""
+    k, m = alice_set_cardinality, bob_set_cardinality
+    sets = []
+    for _ in range(vectors):
+        values = random.sample(range(1 << bit_length), min(k + m, 1 << bit_length))
+        alice = values[:k]
+        common = random.randint(max(0, k + m - len(values)), min(k, m))
+        bob = random.sample(alice, common) + values[k:k + m - common]
+        sets.append((alice, bob))
+    return sets
+
+
+def sample_vectors(circuit, params, vectors=DEFAULT_VECTORS, rng=None):
+    """Random inputs of a circuit of circuit_generator and its expected
+    outputs.
+
+    Args:
+        circuit: One circuit dict of the circuits built with 'params'.
+        params: The keyword arguments of circuit_generator.build_circuit,
+            whose bin_capacities are the ones of the circuit's bins for
+            operation 4.
+        vectors: The number of input vectors.
+        rng: Optional; a numpy.random.Generator.
+
+    Returns:
+        A tuple (alice_bits, bob_bits, expected) of (vectors, wires) arrays.
+        For operation 3 the outputs are shuffled, so expected holds each
+        vector's output elements sorted (see check_circuit).
+    """
+    rng = rng or np.random.default_rng()
+    operation = params.get("operation", 0)
+    b = params["bit_number"]
+
+    if operation == 0:  # addition
+        a_values = rng.integers(0, 1 << b, size=vectors)
+        b_values = rng.integers(0, 1 << b, size=vectors)
+        return value_bits(a_values, b), value_bits(b_values, b), value_bits(a_values + b_values, b + 1)
+
+    if operation == 1:
+        return _compare_vectors(rng, vectors, b, params["alice_set_cardinality"])
+
+    if operation == 2:  # one compare per value of bob
+        k, m = params["alice_set_cardinality"], params["bob_set_cardinality"]
+        alice = rng.integers(0, 1 << b, size=(vectors, k))
+        bob = _near_values(rng, alice, (vectors, m), b)
+        match = (alice[:, :, None] == bob[:, None, :]).any(axis=1)
+        expected = np.concatenate([match[:, :, None], value_bits(np.where(match, bob, 0), b)], axis=2)
+        return (value_bits(alice, b).reshape(vectors, -1), value_bits(bob, b).reshape(vectors, -1),
+                expected.reshape(vectors, -1))
+
+    if operation == 3:  # random switches shuffle the output elements, which are compared sorted
+        k, m = params["alice_set_cardinality"], params["bob_set_cardinality"]
+        switches = len(circuit["bob"]) - m * (b + 1)
+        alice_bits, bob_bits, expected = [], [], []
+        for alice, bob in _sample_sets(vectors, b, k, m):
+            values = circuit_generator.sort_compare_shuffle_alice_values(alice, m, b)
+            alice_bits.append(value_bits(values, b + 1).reshape(-1))
+            bob_bits.append(np.concatenate([value_bits(sorted(bob, reverse=True), b + 1).reshape(-1),
+                                            rng.integers(0, 2, size=switches)]))
+            common = sorted(set(alice) & set(bob))
+            elements = [(0, 0)] * (circuit_generator.merged_list_size(k, m) - len(common))
+            expected.append(sorted(elements + [(1, value) for value in common]))
+        return np.array(alice_bits), np.array(bob_bits), expected
+
+    if operation == 4:  # compare(b + 1, capacity) of each bin, see circuit_generator.bucketed_intersection
+        parts = [_compare_vectors(rng, vectors, b + 1, capacity) for capacity in params["bin_capacities"]]
+        return tuple(np.hstack([part[i] for part in parts]) for i in range(3))
+
+    raise ValueError(f"Unknown operation {operation}")
+
+
+def check_circuit(circuit, params, vectors=DEFAULT_VECTORS, rng=None):
+    """Check a circuit of circuit_generator on random input vectors.
+
+    Args:
+        circuit: One circuit dict of the circuits built with 'params'.
+        params: The keyword arguments of circuit_generator.build_circuit
+            (see sample_vectors).
+        vectors: The number of input vectors.
+        rng: Optional; a numpy.random.Generator.
+
+    Returns:
+        The gate statistics of the circuit (see Simulator.stats).
+
+    Raises:
+        ValueError: The circuit outputs differ from the expected ones.
+    """
+    simulator = Simulator(circuit)
+    alice_bits, bob_bits, expected = sample_vectors(circuit, params, vectors, rng)
+    outputs = simulator.evaluate(alice_bits, bob_bits)
+    if params.get("operation", 0) == 3:
+        b = params["bit_number"]
+        elements = outputs.reshape(len(outputs), -1, b + 1)
+        values = (elements[:, :, 1:].astype(np.int64) << np.arange(b)).sum(axis=2)
+        failures = sum(sorted(zip(elements[i, :, 0].tolist(), values[i].tolist())) != expected[i]
+                       for i in range(len(outputs)))
+    else:
+        failures = int((outputs != expected).any(axis=1).sum())
+    if failures:
+        raise ValueError(f"Circuit {circuit['id']} is wrong for {failures} of {len(outputs)} input vectors")
+    return simulator.stats()
+
+
+def check_circuits(circuits, params, vectors=DEFAULT_VECTORS, rng=None):
+    """Check all the circuits built with 'params' (see check_circuit).
+
+    Returns:
+        A dict mapping circuit IDs to their gate statistics.
+    """
+    stats = {}
+    first = 0  # the first bin of the circuit for operation 4
+    for circuit in circuits["circuits"]:
+        circuit_params = params
+        if params.get("operation") == 4:
+            bins = len(circuit["bob"]) // (params["bit_number"] + 1)
+            circuit_params = dict(params, bin_capacities=params["bin_capacities"][first:first + bins])
+            first += bins
+        stats[circuit["id"]] = check_circuit(circuit, circuit_params, vectors, rng)
+    return stats
@@ -1,10 +1,15 @@
+import hashlib
+import instrumentation
 import json
 import math
 import operator
+import pickle
+import queue
 import random
 import secrets
 import sympy
 import zmq
+import zmq.asyncio
 
 # SOCKET
 LOCAL_PORT = 4080
@@ -13,21 +18,109 @@ SERVER_PORT = 4080
 
 
 class Socket:
-    def __init__(self, socket_type):
+    """A ZeroMQ socket sending pickled objects.
+
+    Args:
+        socket_type: Optional; the ZeroMQ socket type, or None for the
+            transports without ZeroMQ socket, see LoopbackSocket.
+
+    Attributes:
+        metrics: The instrumentation.Metrics counting the messages, bytes
+            and round trips (Default: instrumentation.NULL_METRICS).
+        raise_errors: Raise the error replies of Bob instead of returning
+            them, see check_error (True for the sockets of Alice).
+    """
+    raise_errors = False
+
+    def __init__(self, socket_type=None):
+        self.metrics = instrumentation.NULL_METRICS
+        self._replying = False  # a message was sent since the last one received
+        if socket_type is not None:
+            self._open(socket_type)
+
+    def _open(self, socket_type):
+        """Create the ZeroMQ socket and its poller."""
         self.socket = zmq.Context().socket(socket_type)
         self.poller = zmq.Poller()
         self.poller.register(self.socket, zmq.POLLIN)
 
     def send(self, msg):
-        self.socket.send_pyobj(msg)
+        if not self.metrics.enabled:
+            self.socket.send_pyobj(msg)
+            return
+        data = pickle.dumps(msg, pickle.DEFAULT_PROTOCOL)
+        self.socket.send(data)
+        self._count_sent(len(data))
+
+    def _count_sent(self, size):
+        self.metrics.count("messages_sent")
+        self.metrics.count("bytes_sent", size)
+        self._replying = True
+
+    def _count_received(self, size):
+        self.metrics.count("messages_received")
+        self.metrics.count("bytes_received", size)
+        if self._replying:
+            self.metrics.count("round_trips")
+            self._replying = False
 
     def receive(self):
-        return self.socket.recv_pyobj()
+        """Receive a message.
+
+        Returns:
+            The unpickled object of a single-frame message, or the list of
+            frame buffers (memoryviews, not copied) of a multipart message
+            sent with send_frames.
+
+        Raises:
+            ConnectionError: An error reply, see check_error.
+        """
+        return self._load(self.socket.recv_multipart(copy=False))
+
+    def _load(self, frames):
+        if self.metrics.enabled:
+            self._count_received(sum(frame.buffer.nbytes for frame in frames))
+        if len(frames) == 1:
+            return self.check_error(pickle.loads(frames[0].buffer))
+        return [frame.buffer for frame in frames]
+
+    def check_error(self, msg):
+        """Return a message received, unless it is an error reply of Bob.
+
+        A server.EvaluatorServer answers {"error": reason, "refused": bool}
+        instead of a protocol message when it refuses or closes a session.
+        With 'raise_errors', the socket is then closed and the error is
+        raised.
+
+        Raises:
+            ConnectionRefusedError: The session was refused.
+            ConnectionAbortedError: The session was closed.
+        """
+        if self.raise_errors and isinstance(msg, dict) and "error" in msg:
+            self.close()
+            if msg.get("refused"):
+                raise ConnectionRefusedError(msg["error"])
+            raise ConnectionAbortedError(msg["error"])
+        return msg
+
+    def close(self):
+        """Close the socket without waiting for the messages not sent yet."""
+        self.socket.close(linger=0)
 
     def send_wait(self, msg):
         self.send(msg)
         return self.receive()
 
+    def send_frames(self, frames):
+        """Send a list of buffers as one multipart message without copying.
+
+        Args:
+            frames: A list of at least two bytes-like objects.
+        """
+        self.socket.send_multipart(frames, copy=False)
+        if self.metrics.enabled:
+            self._count_sent(sum(memoryview(frame).nbytes for frame in frames))
+
     """
         Piece of code from:
         https://stackoverflow.com/questions/17174001/stop-pyzmq-receiver-by-keyboardinterrupt
@@ -39,7 +132,7 @@ class Socket:
             while True:
                 obj = dict(self.poller.poll(timetick))
                 if self.socket in obj and obj[self.socket] == zmq.POLLIN:
-                    yield self.socket.recv_pyobj()
+                    yield self.receive()
         except KeyboardInterrupt:
             pass
 
@@ -51,11 +144,161 @@ class EvaluatorSocket(Socket):
 
 
 class GarblerSocket(Socket):
+    raise_errors = True
+
     def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
         super().__init__(zmq.REQ)
         self.socket.connect(endpoint)
 
 
+class LoopbackSocket(Socket):
+    """One end of an in-process connection, see loopback_pair.
+
+    It has the interface of Socket without ZeroMQ: the messages are put on
+    the queue of the other end, read by another thread. Unless
+    'serialize', the objects themselves are passed instead of pickled
+    copies, so that the parties must not modify what they send or
+    receive, and the metrics count the messages but not their bytes.
+
+    Args:
+        incoming: The queue of the messages received.
+        outgoing: The queue of the other end.
+        serialize: Optional; pickle the messages as Socket does
+            (Default: False).
+    """
+    _CLOSED = object()  # put on the incoming queue by close
+
+    def __init__(self, incoming, outgoing, serialize=False):
+        super().__init__()
+        self.incoming = incoming
+        self.outgoing = outgoing
+        self.serialize = serialize
+
+    def send(self, msg):
+        size = 0
+        if self.serialize:
+            msg = pickle.dumps(msg, pickle.DEFAULT_PROTOCOL)
+            size = len(msg)
+        self.outgoing.put((False, msg))
+        if self.metrics.enabled:
+            self._count_sent(size)
+
+    def send_frames(self, frames):
+        """Send a list of buffers as one multipart message, see Socket.send_frames."""
+        if self.serialize:
+            frames = [bytes(frame) for frame in frames]
+        self.outgoing.put((True, [memoryview(frame).cast("B") for frame in frames]))  # bytes, as ZeroMQ frames
+        if self.metrics.enabled:
+            self._count_sent(sum(memoryview(frame).nbytes for frame in frames) if self.serialize else 0)
+
+    def receive(self):
+        """Receive a message, see Socket.receive.
+
+        Raises:
+            EOFError: This end was closed.
+        """
+        multipart, msg = self.incoming.get()
+        if msg is self._CLOSED:
+            raise EOFError("The loopback connection is closed")
+        size = 0
+        if multipart:
+            size = sum(frame.nbytes for frame in msg) if self.serialize else 0
+        elif self.serialize:
+            size = len(msg)
+            msg = pickle.loads(msg)
+        if self.metrics.enabled:
+            self._count_received(size)
+        return msg if multipart else self.check_error(msg)
+
+    def poll_socket(self, timetick=None):
+        """Yield the messages received until this end is closed."""
+        try:
+            while True:
+                yield self.receive()
+        except EOFError:
+            pass
+
+    def close(self):
+        """Close this end: its pending and next receive raise EOFError."""
+        self.incoming.put((False, self._CLOSED))
+
+
+def loopback_pair(serialize=False):
+    """Return the two ends of an in-process connection.
+
+    Alice and Bob then run in the same process, e.g. Bob listening in a
+    thread, with no socket and optionally no serialization, so that the
+    timings isolate the cryptography.
+
+    Args:
+        serialize: Optional; pickle the messages, see LoopbackSocket
+            (Default: False).
+
+    Returns:
+        A pair (garbler_socket, evaluator_socket) of LoopbackSocket, to
+        pass to main.Alice and main.Bob.
+    """
+    garbler_queue, evaluator_queue = queue.SimpleQueue(), queue.SimpleQueue()
+    garbler_socket = LoopbackSocket(garbler_queue, evaluator_queue, serialize)
+    garbler_socket.raise_errors = True
+    return garbler_socket, LoopbackSocket(evaluator_queue, garbler_queue, serialize)
+
+
+class AsyncSocket(Socket):
+    """An asyncio ZeroMQ DEALER socket sending pickled objects.
+
+    Unlike the REQ/REP sockets of GarblerSocket and EvaluatorSocket, any
+    number of messages can be sent before the next one is received, so
+    that messages are pipelined instead of acknowledged. send, receive,
+    send_wait and send_frames are coroutines and poll_socket is an
+    asynchronous generator.
+    """
+    def __init__(self, socket_type=zmq.DEALER):
+        super().__init__(socket_type)
+
+    def _open(self, socket_type):
+        """Create the asyncio ZeroMQ socket, polled by its coroutines."""
+        self.socket = zmq.asyncio.Context().socket(socket_type)
+
+    async def send(self, msg):
+        data = pickle.dumps(msg, pickle.DEFAULT_PROTOCOL)
+        await self.socket.send(data)
+        if self.metrics.enabled:
+            self._count_sent(len(data))
+
+    async def receive(self):
+        """Receive a message, see Socket.receive."""
+        return self._load(await self.socket.recv_multipart(copy=False))
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
+
+    async def send_frames(self, frames):
+        """Send a list of buffers as one multipart message, see Socket.send_frames."""
+        await self.socket.send_multipart(frames, copy=False)
+        if self.metrics.enabled:
+            self._count_sent(sum(memoryview(frame).nbytes for frame in frames))
+
+    async def poll_socket(self):
+        while True:
+            yield await self.receive()
+
+
+class AsyncEvaluatorSocket(AsyncSocket):
+    def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}"):
+        super().__init__()
+        self.socket.bind(endpoint)
+
+
+class AsyncGarblerSocket(AsyncSocket):
+    raise_errors = True
+
+    def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
+        super().__init__()
+        self.socket.connect(endpoint)
+
+
 # PRIME GROUP
 PRIME_BITS = 64  # order of magnitude of prime in base 2
 
@@ -83,11 +326,11 @@ def bits(num, width):
 
 class PrimeGroup:
     """Cyclic abelian group of prime order 'prime'."""
-    def __init__(self, prime=None):
+    def __init__(self, prime=None, generator=None):
         self.prime = prime or gen_prime(num_bits=PRIME_BITS)
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
-        self.generator = self.find_generator()
+        self.generator = generator or self.find_generator()
 
     def mul(self, num1, num2):
         "Multiply two elements." ""
@@ -109,19 +352,165 @@ class PrimeGroup:
         "Return an random int in [1, prime - 1]." ""
         return random.randint(1, self.prime_m1)
 
+    def is_generator(self, candidate, factors=None):
+        """Return True if 'candidate' generates the whole group.
+
+        Args:
+            candidate: An element of the group.
+            factors: Optional; the prime factors of prime - 1, computed
+                when not given.
+        """
+        if factors is None:
+            factors = sympy.primefactors(self.prime_m1)
+        return all(self.pow(candidate, self.prime_m1 // factor) != 1
+                   for factor in factors)
+
     def find_generator(self):  # find random generator for group
         """Find a random generator for the group."""
         factors = sympy.primefactors(self.prime_m1)
 
         while True:
             candidate = self.rand_int()
-            for factor in factors:
-                if 1 == self.pow(candidate, self.prime_m1 // factor):
-                    break
-            else:
+            if self.is_generator(candidate, factors):
                 return candidate
 
 
+def load_prime_groups(json_path):
+    """Load precomputed prime groups from a JSON file.
+
+    The file holds a list of {"prime": p, "generator": g} objects, e.g. as
+    written by save_prime_groups. Each group is checked before being used:
+    the prime must be prime and the generator must generate the group (see
+    PrimeGroup.is_generator).
+    """
+    groups = []
+    for entry in parse_json(json_path):
+        prime, generator = entry["prime"], entry["generator"]
+        if not sympy.isprime(prime) or not 1 < generator < prime:
+            raise ValueError(f"Invalid prime group {entry} in {json_path}")
+        group = PrimeGroup(prime, generator)
+        if not group.is_generator(generator):
+            raise ValueError(f"Invalid prime group {entry} in {json_path}: "
+                             f"{generator} does not generate the group")
+        groups.append(group)
+    if not groups:
+        raise ValueError(f"No prime group found in {json_path}")
+    return groups
+
+
+def save_prime_groups(json_path, count):
+    """Generate 'count' prime groups and store them in a JSON file."""
+    groups = [PrimeGroup() for _ in range(count)]
+    with open(json_path, mode='w+') as json_file:
+        json.dump([{"prime": G.prime, "generator": G.generator}
+                   for G in groups], json_file)
+    return json_path
+
+
+# HASHING
+CUCKOO_BIN_FACTORS = {2: 2.4, 3: 1.27, 4: 1.09, 5: 1.05}  # bins per value for each hash count
+CUCKOO_MAX_EVICTIONS = 500  # evictions before a value goes to the stash
+CUCKOO_MAX_ATTEMPTS = 16  # seeds tried before giving up
+STATISTICAL_SECURITY = 40  # bins overflow with probability below 2^-40
+
+
+def cuckoo_bin_count(count, hashes):
+    """Return the number of bins of a cuckoo table of 'count' values."""
+    if hashes not in CUCKOO_BIN_FACTORS:
+        raise ValueError(f"Unsupported hash count {hashes}, choose one of {sorted(CUCKOO_BIN_FACTORS)}")
+    return max(hashes, math.ceil(CUCKOO_BIN_FACTORS[hashes] * count))
+
+
+def bin_positions(value, seed, hashes, bins):
+    """Return the bins of a value for each of the 'hashes' hash functions.
+
+    The hash functions are slices of a BLAKE2b digest keyed with 'seed'.
+
+    Raises:
+        ValueError: The value is negative or has more than 128 bits.
+    """
+    if not 0 <= value < 1 << 128:
+        raise ValueError(f"Only values from 0 to 2^128 - 1 can be hashed into bins, not {value}")
+    digest = hashlib.blake2b(value.to_bytes(16, "little"), digest_size=8 * hashes, key=seed).digest()
+    return [int.from_bytes(digest[8 * i:8 * (i + 1)], "little") % bins for i in range(hashes)]
+
+
+def cuckoo_hash(values, bins, hashes, stash_size):
+    """Store each value in one of its bins, evicting values when needed.
+
+    Values that cannot be placed after CUCKOO_MAX_EVICTIONS evictions go to
+    a stash; a new seed is tried when the stash overflows.
+
+    Returns:
+        A tuple (seed, table, stash): the key of the hash functions, the
+        list of bins holding a value or None, and the stashed values.
+    """
+    values = list(dict.fromkeys(values))
+    rand = secrets.SystemRandom()
+    for _ in range(CUCKOO_MAX_ATTEMPTS):
+        seed = secrets.token_bytes(16)
+        positions = {value: bin_positions(value, seed, hashes, bins) for value in values}
+        table = [None] * bins
+        stash = []
+        for value in values:
+            for _ in range(CUCKOO_MAX_EVICTIONS):
+                free = next((p for p in positions[value] if table[p] is None), None)
+                if free is not None:
+                    table[free], value = value, None
+                    break
+                evicted = rand.choice(positions[value])
+                table[evicted], value = value, table[evicted]
+            if value is not None:
+                if len(stash) == stash_size:
+                    break
+                stash.append(value)
+        else:
+            return seed, table, stash
+    raise ValueError(f"Cuckoo hashing of {len(values)} values into {bins} bins failed "
+                     f"{CUCKOO_MAX_ATTEMPTS} times, use a larger stash")
+
+
+def simple_hash(values, seed, hashes, bins):
+    """Store each value in all its bins.
+
+    Returns:
+        The list of bins, each one a list of values.
+    """
+    table = [[] for _ in range(bins)]
+    for value in dict.fromkeys(values):
+        for p in set(bin_positions(value, seed, hashes, bins)):
+            table[p].append(value)
+    return table
+
+
+def max_bin_load(balls, bins, sigma=STATISTICAL_SECURITY):
+    """Return a load that none of 'bins' bins exceeds with probability
+    1 - 2^-sigma when 'balls' balls are thrown at random.
+
+    It is the smallest load whose binomial tail probability, times the
+    number of bins, is below 2^-sigma. It only depends on public sizes,
+    unlike the actual maximum load.
+    """
+    if balls == 0:
+        return 0
+    p = 1 / bins
+    target = -sigma * math.log(2) - math.log(bins)
+
+    def log_pmf(i):  # log P[load = i]
+        return (math.lgamma(balls + 1) - math.lgamma(i + 1) - math.lgamma(balls - i + 1)
+                + i * math.log(p) + (balls - i) * math.log1p(-p))
+
+    load = math.floor(balls * p)
+    while load < balls:
+        # the terms of P[load > x] decrease at least geometrically past the mean
+        terms = [log_pmf(i) for i in range(load + 1, min(balls, load + 64) + 1)]
+        top = max(terms)
+        if top + math.log(sum(math.exp(t - top) for t in terms)) < target:
+            return load
+        load += 1
+    return balls
+
+
 # HELPER FUNCTIONS
 def parse_json(json_path):
     with open(json_path) as json_file:
@@ -147,9 +536,9 @@ def get_single_permutation(elements):
     if len(elements) > 5:
         for i in range(0, len(elements)-4):
             if i == len(elements)-5:
-                int_list = int_list[:i] + list(all_perms(int_list[i:]))[random.randint(0, 120)]
+                int_list = int_list[:i] + list(all_perms(int_list[i:]))[random.randint(0, 119)]
             else:
-                int_list = int_list[:i] + list(all_perms(int_list[i:i+5]))[random.randint(0, 120)] + int_list[i+5:]
+                int_list = int_list[:i] + list(all_perms(int_list[i:i+5]))[random.randint(0, 119)] + int_list[i+5:]
     else:
         int_list = list(all_perms(int_list))[random.randint(0, math.factorial(len(int_list))-1)]
 
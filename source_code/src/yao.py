@@ -1,10 +1,114 @@
+import heapq
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import repeat
 import pickle
 import random
+from array import array
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives import padding
 import os
 
+# Gate type codes of compiled circuits
+GATE_TYPES = ("NOT", "AND", "OR", "XOR", "NOR", "NAND", "XNOR")
+GATE_CODES = {gate_type: code for code, gate_type in enumerate(GATE_TYPES)}
+NOT, XOR, XNOR = GATE_CODES["NOT"], GATE_CODES["XOR"], GATE_CODES["XNOR"]
+
+# Garbling schemes:
+#   classic: every gate has a garbled table
+#   free-xor: wire keys share a global offset R, XOR/XNOR/NOT gates have
+#             no garbled table and are evaluated by XORing labels
+#   half-gates: free-xor, and AND/OR/NAND/NOR gates are garbled as two
+#               half gates (two ciphertexts instead of four)
+SCHEMES = ("classic", "free-xor", "half-gates")
+FREE_GATES = ("XOR", "XNOR", "NOT")
+
+# Garbling backends (encryption of the garbled tables):
+#   aes-cbc: each row encrypts the pickled (key, encr_bit) output twice with
+#            AES-CBC, tables are dicts indexed by the encrypted input bits
+#   fixed-key: each row is H(keys) ^ output key with the fixed-key AES hash,
+#              the encrypted bit being the lowest bit of the key; tables are
+#              bytes made of 16-byte rows
+# Half gates always use the fixed-key AES hash.
+BACKENDS = ("aes-cbc", "fixed-key")
+
+# Wire formats of garbled circuits sent to the evaluator:
+#   pickle: the circuit spec and garbled tables dicts are pickled
+#   binary: the compiled arrays and the tables concatenated in evaluation
+#           order are sent as multipart frames (see pack_circuit), for the
+#           fixed-key backend or the half-gates scheme
+WIRE_FORMATS = ("pickle", "binary")
+
+# Minimum number of gates of a circuit level evaluated concurrently, and the
+# backends evaluated on a thread pool at all: the fixed-key gates are mostly
+# Python code holding the GIL, so threads only add dispatch costs to them
+PARALLEL_MIN_WIDTH = 1024
+PARALLEL_BACKENDS = ("aes-cbc",)
+
+# Minimum number of gates of a circuit garbled by a process pool, which costs
+# about 20 ms to start and to send the keys of the gates to
+PARALLEL_MIN_GATES = 2048
+
+# Half gates garble f(a, b) = ((a ^ alpha) and (b ^ beta)) ^ gamma
+HALF_GATES = {
+    "AND": (0, 0, 0),
+    "NAND": (0, 0, 1),
+    "OR": (1, 1, 1),
+    "NOR": (1, 1, 0),
+}
+
+
+def xor_keys(key_a, key_b):
+    """XOR two keys of the same length."""
+    return (int.from_bytes(key_a, "big") ^ int.from_bytes(key_b, "big")).to_bytes(
+        len(key_a), "big")
+
+
+def random_key(lsb):
+    """Return a random 16-byte key whose lowest bit is 'lsb'."""
+    key = bytearray(os.urandom(16))
+    key[-1] = (key[-1] & 0xfe) | lsb
+    return bytes(key)
+
+
+# FIXED-KEY AES HASH
+# Hash function H(K) = AES_FK(K) ^ K where FK is a public fixed key, so a
+# single key schedule is shared by every gate. Blocks are 128-bit ints.
+FIXED_KEY = bytes(range(16))
+_fixed_aes = threading.local()  # encryptors are not thread-safe
+MASK_128 = (1 << 128) - 1
+
+
+def double(block):
+    """Multiply a 128-bit int by 2 in GF(2^128)."""
+    return ((block << 1) & MASK_128) ^ (0x87 if block >> 127 else 0)
+
+
+def fixed_key_hash(blocks):
+    """Hash a list of 128-bit ints with a single call to fixed-key AES."""
+    data = b"".join(block.to_bytes(16, "big") for block in blocks)
+    encryptor = getattr(_fixed_aes, "encryptor", None)
+    if encryptor is None:  # first call in this thread
+        encryptor = _fixed_aes.encryptor = Cipher(
+            algorithms.AES(FIXED_KEY), modes.ECB()).encryptor()
+    ct = encryptor.update(data)
+    return [int.from_bytes(ct[16 * i:16 * i + 16], "big") ^ block
+            for i, block in enumerate(blocks)]
+
+
+def gate_hash_inputs(keys, tweak):
+    """Return the block to hash for a row with input keys 'keys'.
+
+    The block is 2A ^ T for one input key A, 4A ^ 2B ^ T for two.
+    """
+    block = 0
+    for key in keys:
+        block = double(block ^ int.from_bytes(key, "big"))
+    return block ^ tweak
+
 
 def encrypt(key, data):
     """Encrypt a message.
@@ -48,52 +152,532 @@ def decrypt(key, data):
     return unpadded_data
 
 
-def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
-    """Evaluate yao circuit with given inputs.
+class CompiledCircuit:
+    """A topologically ordered, array-backed representation of a circuit.
+
+    Wires are renumbered from 0 to num_wires - 1 and gate g reads the wires
+    in_a[g] (and in_b[g], -1 for NOT gates) and writes the wire out[g].
+    Gate types are stored as GATE_CODES.
 
     Args:
         circuit: A dict containing circuit spec.
-        g_tables: The yao circuit garbled tables.
-        pbits_out: The pbits of outputs.
-        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
-        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+    """
+    def __init__(self, circuit):
+        self.circuit = circuit
+        self.gates = self._sort_gates(circuit["gates"])  # list of gates
+        self.gate_ids = [gate["id"] for gate in self.gates]
 
-    Returns:
-        A dict mapping output wires with their result bit.
+        # Input wires first, then gate outputs in evaluation order
+        wires = circuit.get("alice", []) + circuit.get("bob", [])
+        for gate in self.gates:
+            wires.extend(gate["in"])
+            wires.append(gate["id"])
+        self.wires = list(dict.fromkeys(wires))
+        self.wire_index = {wire: i for i, wire in enumerate(self.wires)}
+        self.num_wires = len(self.wires)
+
+        index = self.wire_index
+        self.types = array("B", (GATE_CODES[g["type"]] for g in self.gates))
+        self.in_a = array("q", (index[g["in"][0]] for g in self.gates))
+        self.in_b = array("q", (index[g["in"][1]] if len(g["in"]) > 1 else -1
+                                for g in self.gates))
+        self.out = array("q", (index[g["id"]] for g in self.gates))
+        self.outputs = circuit["out"]
+        self.levels = None  # computed by get_levels
+
+    @classmethod
+    def from_arrays(cls, circuit, gate_ids, types, in_a, in_b, out,
+                    wire_index):
+        """Build a compiled circuit from its arrays, without gate dicts.
+
+        The arrays may be any indexable sequences such as memoryviews of a
+        received buffer; they are used as they are.
+
+        Args:
+            circuit: A dict containing the circuit spec without its gates.
+            gate_ids: The gate IDs in evaluation order.
+            types: The gate type codes.
+            in_a: The first input wire index of each gate.
+            in_b: The second input wire index of each gate (-1 if none).
+            out: The output wire index of each gate.
+            wire_index: A dict mapping (at least) the input and output wires
+                of the circuit to their index.
+        """
+        compiled = cls.__new__(cls)
+        compiled.circuit = circuit
+        compiled.gates = None
+        compiled.gate_ids = gate_ids
+        compiled.wires = None
+        compiled.wire_index = wire_index
+        compiled.num_wires = max(max(out, default=-1),
+                                 max(wire_index.values(), default=-1)) + 1
+        compiled.types = types
+        compiled.in_a = in_a
+        compiled.in_b = in_b
+        compiled.out = out
+        compiled.outputs = circuit["out"]
+        compiled.levels = None
+        return compiled
+
+    @staticmethod
+    def _sort_gates(gates):
+        """Return gates in topological order (by ID among ready gates)."""
+        gate_ids = {gate["id"] for gate in gates}
+        waiting = {}  # gate ID -> number of inputs not computed yet
+        consumers = {}  # wire -> gates reading it
+        ready = []
+
+        for gate in gates:
+            pending = [w for w in gate["in"] if w in gate_ids]
+            waiting[gate["id"]] = len(pending)
+            for w in pending:
+                consumers.setdefault(w, []).append(gate)
+            if not pending:
+                ready.append((gate["id"], gate))
+
+        heapq.heapify(ready)
+        ordered = []
+        while ready:
+            gate_id, gate = heapq.heappop(ready)
+            ordered.append(gate)
+            for consumer in consumers.get(gate_id, []):
+                waiting[consumer["id"]] -= 1
+                if waiting[consumer["id"]] == 0:
+                    heapq.heappush(ready, (consumer["id"], consumer))
+
+        if len(ordered) != len(gates):
+            raise ValueError("The circuit gates contain a cycle")
+        return ordered
+
+    def get_levels(self):
+        """Return the gate positions grouped by level, computed once.
+
+        A gate of level d reads at least one output of level d - 1 and no
+        output of a later level, so the gates of a level are independent.
+        """
+        if self.levels is None:
+            depth = array("q", bytes(8 * self.num_wires))
+            levels = []
+            for g in range(len(self.types)):
+                level = depth[self.in_a[g]]
+                if self.in_b[g] >= 0:
+                    level = max(level, depth[self.in_b[g]])
+                depth[self.out[g]] = level + 1
+                if level == len(levels):
+                    levels.append(array("q"))
+                levels[level].append(g)
+            self.levels = levels
+        return self.levels
+
+    def order_tables(self, g_tables):
+        """Return the garbled tables as a list in evaluation order.
+
+        Args:
+            g_tables: A dict mapping each gate ID to its garbled table.
+        """
+        return [g_tables[gate_id] for gate_id in self.gate_ids]
+
+    def table_offsets(self, scheme, backend):
+        """Return the offsets of the garbled tables in a packed buffer.
+
+        Gate g's table is buffer[offsets[g]:offsets[g + 1]]. Only schemes
+        and backends with fixed-size tables (of 16-byte rows) can be packed.
+
+        Args:
+            scheme: The garbling scheme (see SCHEMES).
+            backend: The garbling backend (see BACKENDS).
+        """
+        if scheme != "half-gates" and backend != "fixed-key":
+            raise ValueError(f"Garbled tables of the {scheme} scheme with "
+                             f"the {backend} backend cannot be packed")
+        sizes = [32 if code == NOT else 64
+                 for code in range(len(GATE_TYPES))]
+        if scheme != "classic":
+            for gate_type in FREE_GATES:
+                sizes[GATE_CODES[gate_type]] = 0
+        if scheme == "half-gates":
+            for gate_type in HALF_GATES:
+                sizes[GATE_CODES[gate_type]] = 32
+
+        offsets = array("q", [0])
+        total = 0
+        for code in self.types:
+            total += sizes[code]
+            offsets.append(total)
+        return offsets
+
+    def new_labels(self, a_inputs, b_inputs):
+        """Return the preallocated label buffer filled with the inputs.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        """
+        labels = [None] * self.num_wires
+        for inputs in (a_inputs, b_inputs):
+            for wire, label in inputs.items():
+                labels[self.wire_index[wire]] = label
+        return labels
+
+
+def gate_type_counts(circuit):
+    """Return a Counter of the gate types of a circuit dict or CompiledCircuit."""
+    if isinstance(circuit, CompiledCircuit):
+        return Counter({GATE_TYPES[code]: count for code, count in Counter(circuit.types).items()})
+    return Counter(gate["type"] for gate in circuit["gates"])
+
+
+def _evaluate_gates(compiled, tables, labels, gates, scheme="classic",
+                    backend="aes-cbc", tables_start=0):
+    """Evaluate some gates of a compiled circuit.
+
+    Args:
+        compiled: A CompiledCircuit.
+        tables: The garbled tables in evaluation order.
+        labels: The label buffer, updated in place.
+        gates: The positions of the gates to evaluate, whose inputs must
+            already be evaluated (e.g. a range or a level).
+        scheme: Optional; the garbling scheme (see SCHEMES).
+        backend: Optional; the garbling backend (see BACKENDS).
+        tables_start: Optional; the position of the gate of tables[0], when
+            tables only hold a chunk of the garbled tables.
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
+    types, in_a, in_b, out = (compiled.types, compiled.in_a, compiled.in_b,
+                              compiled.out)
+    free_xor = scheme != "classic"
+    half_gates = scheme == "half-gates"
+    fixed_key = backend == "fixed-key"
 
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
+    for g in gates:
+        gate_type = types[g]
+        # Free gates: XOR the labels, a NOT gate keeps its input label
+        if free_xor and gate_type in (XOR, XNOR):
+            key_a, encr_bit_a = labels[in_a[g]]
+            key_b, encr_bit_b = labels[in_b[g]]
+            labels[out[g]] = (xor_keys(key_a, key_b), encr_bit_a ^ encr_bit_b)
+            continue
+        if free_xor and gate_type == NOT:
+            labels[out[g]] = labels[in_a[g]]
+            continue
+        table = tables[g - tables_start]
+        if half_gates:
+            labels[out[g]] = _evaluate_half_gate(
+                table, labels[in_a[g]], labels[in_b[g]],
+                compiled.gate_ids[g])
+            continue
+        if fixed_key:
+            labels[out[g]] = _evaluate_fixed_key_gate(
+                table, labels[in_a[g]],
+                labels[in_b[g]] if gate_type != NOT else None,
+                compiled.gate_ids[g])
+            continue
 
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
         # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
+        if gate_type == NOT:
             # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in, )]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
+            key_in, encr_bit_in = labels[in_a[g]]
+            # Decrypt the message in the gate's garbled table
+            msg = decrypt(key_in, table[(encr_bit_in, )])
         # Else the gate has two input wires (same model)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
+        else:
+            key_a, encr_bit_a = labels[in_a[g]]
+            key_b, encr_bit_b = labels[in_b[g]]
+            encr_msg = table[(encr_bit_a, encr_bit_b)]
             msg = decrypt(key_b, decrypt(key_a, encr_msg))
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
+        labels[out[g]] = pickle.loads(msg)
+
+
+def _evaluate_half_gate(table, label_a, label_b, gate_id):
+    """Evaluate a half-gates garbled gate.
+
+    Args:
+        table: The two 16-byte ciphertexts TG | TE of the gate.
+        label_a: The (key, encr_bit) label of the first input.
+        label_b: The (key, encr_bit) label of the second input.
+        gate_id: The ID of the gate, used as hash tweak.
+
+    Returns:
+        The (key, encr_bit) label of the output.
+    """
+    t_g = int.from_bytes(table[:16], "big")
+    t_e = int.from_bytes(table[16:32], "big")
+    a = int.from_bytes(label_a[0], "big")
+    b = int.from_bytes(label_b[0], "big")
+    h_a, h_b = fixed_key_hash([double(a) ^ (2 * gate_id),
+                               double(b) ^ (2 * gate_id + 1)])
+    # The encrypted bits play the role of the point-and-permute bits
+    w_g = h_a ^ (t_g if label_a[1] else 0)
+    w_e = h_b ^ ((t_e ^ a) if label_b[1] else 0)
+    c = w_g ^ w_e
+    return c.to_bytes(16, "big"), c & 1
+
+
+def _evaluate_fixed_key_gate(table, label_a, label_b, gate_id):
+    """Evaluate a gate garbled with the fixed-key backend.
+
+    Args:
+        table: The 16-byte rows of the gate, indexed by the encrypted bits.
+        label_a: The (key, encr_bit) label of the first input.
+        label_b: The (key, encr_bit) label of the second input, None for a
+            NOT gate.
+        gate_id: The ID of the gate, used as hash tweak.
+
+    Returns:
+        The (key, encr_bit) label of the output.
+    """
+    if label_b is None:
+        row, keys = label_a[1], (label_a[0], )
+    else:
+        row, keys = 2 * label_a[1] + label_b[1], (label_a[0], label_b[0])
+    pad, = fixed_key_hash([gate_hash_inputs(keys, gate_id)])
+    key = (int.from_bytes(table[16 * row:16 * row + 16], "big") ^ pad)
+    return key.to_bytes(16, "big"), key & 1
+
+
+def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs,
+             scheme="classic", backend="aes-cbc", workers=1):
+    """Evaluate yao circuit with given inputs.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        g_tables: The yao circuit garbled tables, either a dict mapping each
+            gate ID to its table or a list in evaluation order (see
+            CompiledCircuit.order_tables).
+        pbits_out: The pbits of outputs.
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the garbling scheme used by the garbler (see
+            SCHEMES).
+        backend: Optional; the garbling backend used by the garbler (see
+            BACKENDS).
+        workers: Optional; the number of threads evaluating the gates of
+            each level of the circuit concurrently (see evaluate_levels),
+            ignored by the backends not in PARALLEL_BACKENDS.
+
+    Returns:
+        A dict mapping output wires with their result bit.
+    """
+    if not isinstance(circuit, CompiledCircuit):
+        circuit = CompiledCircuit(circuit)
+    if isinstance(g_tables, dict):
+        g_tables = circuit.order_tables(g_tables)
+
+    labels = circuit.new_labels(a_inputs, b_inputs)
+    if workers > 1 and backend in PARALLEL_BACKENDS:
+        evaluate_levels(circuit, g_tables, labels, workers, scheme, backend)
+    else:
+        _evaluate_gates(circuit, g_tables, labels, range(len(circuit.types)),
+                        scheme, backend)
 
     # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ pbits_out[out]
+    index = circuit.wire_index
+    return {out: labels[index[out]][1] ^ pbits_out[out]
+            for out in circuit.outputs}
+
+
+_thread_pools = {}  # number of workers -> shared ThreadPoolExecutor
+_thread_pools_lock = threading.Lock()
+
+
+def _get_thread_pool(workers):
+    """Return the thread pool of 'workers' threads, created once."""
+    with _thread_pools_lock:
+        if workers not in _thread_pools:
+            _thread_pools[workers] = ThreadPoolExecutor(
+                workers, thread_name_prefix="yao-eval")
+        return _thread_pools[workers]
+
+
+def evaluate_levels(compiled, tables, labels, workers, scheme="classic",
+                    backend="aes-cbc", min_width=PARALLEL_MIN_WIDTH):
+    """Evaluate a compiled circuit level by level with a thread pool.
+
+    The gates of a level are split into one slice per worker and evaluated
+    concurrently. Levels narrower than 'min_width' gates are evaluated in
+    the calling thread, where the dispatch would cost more than the gates.
 
-    return evaluation
+    Args:
+        compiled: A CompiledCircuit.
+        tables: The garbled tables in evaluation order.
+        labels: The label buffer, updated in place.
+        workers: The number of threads of the pool.
+        scheme: Optional; the garbling scheme (see SCHEMES).
+        backend: Optional; the garbling backend (see BACKENDS).
+        min_width: Optional; the number of gates from which a level is
+            evaluated concurrently.
+    """
+    executor = _get_thread_pool(workers)
+    for level in compiled.get_levels():
+        if len(level) < min_width:
+            _evaluate_gates(compiled, tables, labels, level, scheme, backend)
+            continue
+        step = -(-len(level) // workers)
+        futures = [executor.submit(_evaluate_gates, compiled, tables, labels,
+                                   level[i:i + step], scheme, backend)
+                   for i in range(0, len(level), step)]
+        for future in wait(futures)[0]:
+            future.result()  # raise the exceptions of the workers
+
+
+class StreamEvaluator:
+    """Evaluate a circuit while its garbled tables are being received.
+
+    The circuit is evaluated for several inputs at once, so that each chunk
+    of garbled tables is only needed until it has been fed.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        inputs: A list of pairs of dicts mapping Alice's and Bob's wires to
+            their (key, encr_bit) inputs, one pair per evaluation.
+        scheme: Optional; the garbling scheme (see SCHEMES).
+        backend: Optional; the garbling backend (see BACKENDS).
+    """
+    def __init__(self, circuit, inputs, scheme="classic", backend="aes-cbc"):
+        if not isinstance(circuit, CompiledCircuit):
+            circuit = CompiledCircuit(circuit)
+        self.compiled = circuit
+        self.scheme = scheme
+        self.backend = backend
+        self.labels = [circuit.new_labels(a_inputs, b_inputs)
+                       for a_inputs, b_inputs in inputs]
+        self.position = 0  # position of the next gate to evaluate
+
+    def feed(self, tables):
+        """Evaluate the gates of the next chunk of garbled tables.
+
+        Args:
+            tables: The garbled tables of the next gates in evaluation order
+                (see GarbledCircuit.stream).
+        """
+        stop = self.position + len(tables)
+        if stop > len(self.compiled.types):
+            raise ValueError("Received more garbled tables than gates")
+        for labels in self.labels:
+            _evaluate_gates(self.compiled, tables, labels,
+                            range(self.position, stop), self.scheme,
+                            self.backend, self.position)
+        self.position = stop
+
+    def get_results(self, pbits_out):
+        """Return the results of all evaluations once every gate is fed.
+
+        Args:
+            pbits_out: The pbits of outputs.
+
+        Returns:
+            A list of dicts mapping output wires with their result bit.
+        """
+        if self.position != len(self.compiled.types):
+            raise ValueError(f"Only {self.position} of "
+                             f"{len(self.compiled.types)} garbled tables "
+                             f"were received")
+        index = self.compiled.wire_index
+        return [{out: labels[index[out]][1] ^ pbits_out[out]
+                 for out in self.compiled.outputs} for labels in self.labels]
+
+
+class PackedTables:
+    """Garbled tables stored in one contiguous buffer, in evaluation order.
+
+    Indexing returns a memoryview of the gate's table, without copying.
+
+    Args:
+        buffer: A bytes-like object holding the concatenated tables.
+        offsets: The table offsets (see CompiledCircuit.table_offsets).
+    """
+    def __init__(self, buffer, offsets):
+        self.buffer = memoryview(buffer)
+        self.offsets = offsets
+        if offsets[-1] != len(self.buffer):
+            raise ValueError(f"Expected {offsets[-1]} bytes of garbled "
+                             f"tables, got {len(self.buffer)}")
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, g):
+        return self.buffer[self.offsets[g]:self.offsets[g + 1]]
+
+
+def pack_circuit(compiled, g_tables, pbits_out, scheme="classic",
+                 backend="aes-cbc"):
+    """Serialize a garbled circuit into a list of binary frames.
+
+    The frames are a JSON header followed by the int64 arrays of gate IDs,
+    first inputs, second inputs and outputs, the uint8 array of gate types
+    and the garbled tables concatenated in evaluation order. They are meant
+    to be sent as one multipart message and read with unpack_circuit.
+
+    Args:
+        compiled: The CompiledCircuit of the circuit.
+        g_tables: The garbled tables, as a dict or a list in evaluation
+            order, made of 16-byte rows (see CompiledCircuit.table_offsets).
+        pbits_out: The pbits of outputs.
+        scheme: Optional; the garbling scheme (see SCHEMES).
+        backend: Optional; the garbling backend (see BACKENDS).
+
+    Returns:
+        A list of bytes-like frames.
+    """
+    if isinstance(g_tables, dict):
+        g_tables = compiled.order_tables(g_tables)
+    compiled.table_offsets(scheme, backend)  # check tables can be packed
+
+    circuit = compiled.circuit
+    inputs = circuit.get("alice", []) + circuit.get("bob", [])
+    header = {
+        "id": circuit["id"],
+        "alice": circuit.get("alice", []),
+        "bob": circuit.get("bob", []),
+        "out": circuit["out"],
+        "wire_index": [(wire, compiled.wire_index[wire])
+                       for wire in inputs + circuit["out"]],
+        "pbits_out": list(pbits_out.items()),
+        "scheme": scheme,
+        "backend": backend,
+    }
+    return [
+        json.dumps(header).encode(),
+        array("q", compiled.gate_ids),
+        compiled.in_a,
+        compiled.in_b,
+        compiled.out,
+        compiled.types,
+        b"".join(g_tables),
+    ]
+
+
+def unpack_circuit(frames):
+    """Read a garbled circuit from the frames written by pack_circuit.
+
+    The arrays and tables are memoryviews of the frames, not copies.
+
+    Args:
+        frames: The list of received frame buffers.
+
+    Returns:
+        A dict with the CompiledCircuit ("circuit"), its PackedTables
+        ("garbled_tables"), "pbits_out", "scheme" and "backend".
+    """
+    if len(frames) != 7:
+        raise ValueError(f"Expected 7 circuit frames, got {len(frames)}")
+    header = json.loads(bytes(frames[0]))
+    gate_ids, in_a, in_b, out = (memoryview(frame).cast("q")
+                                 for frame in frames[1:5])
+    types = memoryview(frames[5]).cast("B")
+
+    circuit = {key: header[key] for key in ("id", "alice", "bob", "out")}
+    compiled = CompiledCircuit.from_arrays(circuit, gate_ids, types, in_a,
+                                           in_b, out,
+                                           dict(header["wire_index"]))
+    offsets = compiled.table_offsets(header["scheme"], header["backend"])
+    return {
+        "circuit": compiled,
+        "garbled_tables": PackedTables(frames[6], offsets),
+        "pbits_out": dict(header["pbits_out"]),
+        "scheme": header["scheme"],
+        "backend": header["backend"],
+    }
 
 
 class GarbledGate:
@@ -103,14 +687,19 @@ class GarbledGate:
         gate: A dict containing gate spec.
         keys: A dict mapping each wire to a pair of keys.
         pbits: A dict mapping each wire to its p-bit.
+        backend: Optional; the garbling backend, see BACKENDS (Default:
+            aes-cbc).
     """
-    def __init__(self, gate, keys, pbits):
+    def __init__(self, gate, keys, pbits, backend="aes-cbc"):
         self.keys = keys  # dict of yao circuit keys
         self.pbits = pbits  # dict of p-bits
         self.input = gate["in"]  # list of inputs'ID
         self.output = gate["id"]  # ID of output
         self.gate_type = gate["type"]  # Gate type: OR, AND, ...
+        self.backend = backend
         self.garbled_table = {}  # The garbled table of the gate
+        # Rows of the fixed-key backend: (row index, block to hash, key_out)
+        self.rows = []
         # A clear representation of the garbled table for debugging purposes
         self.clear_garbled_table = {}
 
@@ -131,6 +720,9 @@ class GarbledGate:
             operator = switch[self.gate_type]
             self._gen_garbled_table(operator)
 
+        if self.backend == "fixed-key":
+            self._encrypt_rows()
+
     def _gen_garbled_table_not(self):
         """Create the garbled table of a NOT gate."""
         inp, out = self.input[0], self.output
@@ -147,10 +739,14 @@ class GarbledGate:
             key_in = self.keys[inp][bit_in]
             key_out = self.keys[out][bit_out]
 
-            # Serialize the output key along with the encrypted bit
-            msg = pickle.dumps((key_out, encr_bit_out))
-            # Encrypt message and add it to the garbled table
-            self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
+            if self.backend == "fixed-key":
+                self.rows.append((encr_bit_in,
+                                  gate_hash_inputs((key_in, ), out), key_out))
+            else:
+                # Serialize the output key along with the encrypted bit
+                msg = pickle.dumps((key_out, encr_bit_out))
+                # Encrypt message and add it to the garbled table
+                self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
             # Add to the clear table indexes of each keys
             self.clear_garbled_table[(encr_bit_in, )] = [(inp, bit_in),
                                                          (out, bit_out),
@@ -175,13 +771,32 @@ class GarbledGate:
                 key_b = self.keys[in_b][bit_b]
                 key_out = self.keys[out][bit_out]
 
-                msg = pickle.dumps((key_out, encr_bit_out))
-                self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
-                    key_a, encrypt(key_b, msg))
+                if self.backend == "fixed-key":
+                    self.rows.append((2 * encr_bit_a + encr_bit_b,
+                                      gate_hash_inputs((key_a, key_b), out),
+                                      key_out))
+                else:
+                    msg = pickle.dumps((key_out, encr_bit_out))
+                    self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
+                        key_a, encrypt(key_b, msg))
                 self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
                     (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
                 ]
 
+    def _encrypt_rows(self):
+        """Encrypt the rows of the fixed-key backend into 16-byte rows.
+
+        The encrypted bit needs no encryption: it is the lowest bit of the
+        output key.
+        """
+        pads = fixed_key_hash([block for _, block, _ in self.rows])
+        table = [b""] * len(self.rows)
+        for (row, _, key_out), pad in zip(self.rows, pads):
+            table[row] = (int.from_bytes(key_out, "big") ^ pad).to_bytes(
+                16, "big")
+        self.garbled_table = b"".join(table)
+        self.rows = []
+
     def print_garbled_table(self):
         """Print a clear representation of the garbled table."""
         print(f"GATE: {self.output}, TYPE: {self.gate_type}")
@@ -206,56 +821,250 @@ class GarbledGate:
         return self.garbled_table
 
 
+class HalfGate:
+    """A gate garbled with the half-gates technique.
+
+    The gate needs a free-xor key pair (key0, key0 ^ R) on each wire, the
+    lowest bit of each key being its encrypted bit. Its garbled table is
+    made of two 16-byte ciphertexts TG | TE and its output keys and p-bit
+    are derived from the inputs.
+
+    Args:
+        gate: A dict containing gate spec.
+        keys: A dict mapping each wire to a pair of keys.
+        pbits: A dict mapping each wire to its p-bit.
+        offset: The global offset R of the free-xor keys.
+    """
+    def __init__(self, gate, keys, pbits, offset):
+        self.input = gate["in"]  # list of inputs'ID
+        self.output = gate["id"]  # ID of output
+        self.gate_type = gate["type"]  # Gate type: OR, AND, ...
+        alpha, beta, gamma = HALF_GATES[self.gate_type]
+        in_a, in_b = self.input
+
+        # Keys are 128-bit ints whose lowest bit is the encrypted bit, the
+        # lowest bit of R is 1. a0 and b0 are the keys of value 0 of
+        # (a ^ alpha) and (b ^ beta).
+        r = int.from_bytes(offset, "big")
+        a0 = int.from_bytes(keys[in_a][0], "big") ^ (r if alpha else 0)
+        b0 = int.from_bytes(keys[in_b][0], "big") ^ (r if beta else 0)
+        p_a, p_b = a0 & 1, b0 & 1
+        tweak_g, tweak_e = 2 * self.output, 2 * self.output + 1
+        h_a0, h_a1, h_b0, h_b1 = fixed_key_hash([
+            double(a0) ^ tweak_g, double(a0 ^ r) ^ tweak_g,
+            double(b0) ^ tweak_e, double(b0 ^ r) ^ tweak_e])
+
+        # Garbler half gate
+        t_g = h_a0 ^ h_a1 ^ (r if p_b else 0)
+        w_g0 = h_a0 ^ (t_g if p_a else 0)
+        # Evaluator half gate
+        t_e = h_b0 ^ h_b1 ^ a0
+        w_e0 = h_b0 ^ ((t_e ^ a0) if p_b else 0)
+
+        c0 = w_g0 ^ w_e0 ^ (r if gamma else 0)
+        self.key0, self.pbit = c0.to_bytes(16, "big"), c0 & 1
+        self.garbled_table = t_g.to_bytes(16, "big") + t_e.to_bytes(16, "big")
+
+    def print_garbled_table(self):
+        """Print the two ciphertexts of the gate."""
+        t_g, t_e = self.garbled_table[:16], self.garbled_table[16:]
+        print(f"GATE: {self.output}, TYPE: {self.gate_type} (half-gates)")
+        print(f"TG: {t_g.hex()}\nTE: {t_e.hex()}")
+
+    def get_garbled_table(self):
+        """Return the garbled table of the gate."""
+        return self.garbled_table
+
+
+def _garble_gates(gates, keys, pbits, backend):
+    """Return the garbled tables of gates (run by GarbledCircuit workers)."""
+    return [GarbledGate(gate, keys, pbits, backend).get_garbled_table()
+            for gate in gates]
+
+
 class GarbledCircuit:
     """A representation of a garbled circuit.
 
+    Gates are garbled in the order of the circuit's CompiledCircuit, which
+    is available as the 'compiled' attribute.
+
     Args:
         circuit: A dict containing circuit spec.
-        pbits: Optional; a dict of p-bits for the given circuit.
+        pbits: Optional; a dict of p-bits for the given circuit. With the
+            free-xor scheme, p-bits of free gate outputs are derived from
+            their inputs.
+        scheme: Optional; the garbling scheme, "classic", "free-xor" or
+            "half-gates" (Default: classic).
+        backend: Optional; the garbling backend, "aes-cbc" or "fixed-key"
+            (Default: aes-cbc).
+        lazy: Optional; do not garble the gates up front, they are garbled
+            on demand by stream (Default: False). The keys and p-bits of
+            wires derived from their gate inputs are then only known once
+            their gate is garbled.
+        workers: Optional; the number of processes garbling the gates up
+            front (Default: 1). Half gates are always garbled in one process
+            since their output keys come out of their garbling, and so are
+            circuits of less than PARALLEL_MIN_GATES gates.
     """
-    def __init__(self, circuit, pbits={}):
+    def __init__(self, circuit, pbits={}, scheme="classic", backend="aes-cbc",
+                 lazy=False, workers=1):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown garbling scheme '{scheme}'")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown garbling backend '{backend}'")
         self.circuit = circuit
-        self.gates = circuit["gates"]  # list of gates
-        self.wires = set()  # list of circuit wires
+        self.scheme = scheme
+        self.backend = backend
+        self.lazy = lazy
+        self.workers = workers
+        self.compiled = CompiledCircuit(circuit)
+        self.gates = self.compiled.gates  # list of gates in evaluation order
+        self.wires = self.compiled.wires  # list of circuit wires
 
         self.pbits = {}  # dict of p-bits
         self.keys = {}  # dict of keys
+        self.offset = None  # global offset R of the free-xor scheme
         self.garbled_tables = {}  # dict of garbled tables
-
-        # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
+        self.half_gates = {}  # dict of HalfGate of the half-gates scheme
 
         self._gen_pbits(pbits)
         self._gen_keys()
-        self._gen_garbled_tables()
+        if not lazy:
+            self._gen_garbled_tables()
+
+    def _is_free(self, gate):
+        """Return True if the gate has no garbled table."""
+        return self.scheme != "classic" and gate["type"] in FREE_GATES
 
     def _gen_pbits(self, pbits):
         """Create a dict mapping each wire to a random p-bit."""
         if pbits:
-            self.pbits = pbits
+            self.pbits = dict(pbits)
         else:
             self.pbits = {wire: random.randint(0, 1) for wire in self.wires}
 
     def _gen_keys(self):
-        """Create pair of keys for each wire."""
+        """Create pair of keys for each wire.
+
+        The lowest bit of each key is its encrypted bit (bit ^ p-bit).
+        """
+        if self.scheme == "classic":
+            for wire in self.wires:
+                pbit = self.pbits[wire]
+                self.keys[wire] = (random_key(pbit), random_key(pbit ^ 1))
+            return
+
+        # Every pair of keys is (key0, key0 ^ R). Keys and p-bits of free
+        # gate (and half gate) outputs are replaced by the ones derived from
+        # their inputs when the gate is garbled.
+        self.offset = random_key(1)
         for wire in self.wires:
-            self.keys[wire] = (os.urandom(16), os.urandom(16))
+            key0 = random_key(self.pbits[wire])
+            self.keys[wire] = (key0, xor_keys(key0, self.offset))
+
+    def _garble_gate(self, gate):
+        """Garble a gate and return its garbled table.
+
+        Gates must be garbled in evaluation order since the keys and p-bit
+        of free gate and half gate outputs derive from their inputs.
+        """
+        if self.scheme == "half-gates" and not self._is_free(gate):
+            half_gate = HalfGate(gate, self.keys, self.pbits, self.offset)
+            if not self.lazy:
+                self.half_gates[gate["id"]] = half_gate
+            self.keys[gate["id"]] = (half_gate.key0, xor_keys(
+                half_gate.key0, self.offset))
+            self.pbits[gate["id"]] = half_gate.pbit
+            return half_gate.get_garbled_table()
+        if not self._is_free(gate):
+            return GarbledGate(gate, self.keys, self.pbits,
+                               self.backend).get_garbled_table()
+
+        inp, out = gate["in"], gate["id"]
+        key0, pbit = self.keys[inp[0]][0], self.pbits[inp[0]]
+        if gate["type"] != "NOT":
+            key0 = xor_keys(key0, self.keys[inp[1]][0])
+            pbit ^= self.pbits[inp[1]]
+        if gate["type"] != "XOR":  # the output is inverted
+            key0 = xor_keys(key0, self.offset)
+            pbit ^= 1
+        self.keys[out] = (key0, xor_keys(key0, self.offset))
+        self.pbits[out] = pbit
+        return b""
 
     def _gen_garbled_tables(self):
         """Create the garbled table of each gate."""
+        if (self.workers > 1 and self.scheme != "half-gates"
+                and len(self.gates) >= PARALLEL_MIN_GATES):
+            self._gen_garbled_tables_parallel()
+            return
+        for gate in self.gates:
+            self.garbled_tables[gate["id"]] = self._garble_gate(gate)
+
+    def _gen_garbled_tables_parallel(self):
+        """Create the garbled table of each gate with a process pool.
+
+        Free gates are garbled first since they derive the keys of their
+        outputs. The other gates only need the keys and p-bits of their
+        wires: they are split into a few chunks per worker and the tables
+        are merged back in evaluation order.
+        """
+        self.garbled_tables = dict.fromkeys(self.compiled.gate_ids)
+        gates = []
+        for gate in self.gates:
+            if self._is_free(gate):
+                self.garbled_tables[gate["id"]] = self._garble_gate(gate)
+            else:
+                gates.append(gate)
+
+        chunk_size = max(1, -(-len(gates) // (4 * self.workers)))
+        chunks = [gates[i:i + chunk_size]
+                  for i in range(0, len(gates), chunk_size)]
+        chunk_keys, chunk_pbits = [], []
+        for chunk in chunks:
+            wires = {wire for gate in chunk for wire in gate["in"]}
+            wires.update(gate["id"] for gate in chunk)
+            chunk_keys.append({wire: self.keys[wire] for wire in wires})
+            chunk_pbits.append({wire: self.pbits[wire] for wire in wires})
+
+        with ProcessPoolExecutor(self.workers) as executor:
+            results = executor.map(_garble_gates, chunks, chunk_keys,
+                                   chunk_pbits, repeat(self.backend))
+            for chunk, tables in zip(chunks, results):
+                for gate, table in zip(chunk, tables):
+                    self.garbled_tables[gate["id"]] = table
+
+    def stream(self, chunk_size):
+        """Yield the garbled tables in evaluation order, by chunks.
+
+        With lazy garbling, each chunk is garbled when it is requested and
+        is not kept, so only one chunk of tables is held at a time.
+
+        Args:
+            chunk_size: The number of gates per chunk.
+        """
+        chunk = []
         for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.pbits)
-            self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+            if self.lazy:
+                chunk.append(self._garble_gate(gate))
+            else:
+                chunk.append(self.garbled_tables[gate["id"]])
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
     def print_garbled_tables(self):
         """Print p-bits and a clear representation of all garbled tables."""
         print(f"======== {self.circuit['id']} ========")
         print(f"P-BITS: {self.pbits}")
         for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.pbits)
+            if self._is_free(gate):
+                print(f"GATE: {gate['id']}, TYPE: {gate['type']} (free)")
+                continue
+            garbled_table = self.half_gates.get(gate["id"]) or GarbledGate(
+                gate, self.keys, self.pbits)
             garbled_table.print_garbled_table()
         print()
 
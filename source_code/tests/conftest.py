@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# the modules of src import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import circuit_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def memory_circuit_cache(monkeypatch):
+    """Keep the circuits built by Alice in memory instead of src/circuits/cache."""
+    monkeypatch.setattr(circuit_cache, "_default_cache", circuit_cache.CircuitCache(directory=None))
@@ -0,0 +1,47 @@
+import json
+import os
+import struct
+
+import pytest
+
+import circuit_cache
+
+PARAMS = {"bit_number": 4, "name": "test", "id_name": "test", "operation": 1, "alice_set_cardinality": 2}
+
+
+def _header(header):
+    data = json.dumps(header).encode()
+    return circuit_cache.MAGIC + struct.pack("<Q", len(data)) + data
+
+
+def test_dump_load_round_trip():
+    circuits = circuit_cache.CircuitCache(directory=None).get_or_build(PARAMS)
+    assert circuit_cache.load_circuits(circuit_cache.dump_circuits(circuits)) == circuits
+
+
+def test_disk_hit(tmp_path):
+    circuits = circuit_cache.CircuitCache(str(tmp_path)).get_or_build(PARAMS)
+    cache = circuit_cache.CircuitCache(str(tmp_path))
+    assert cache.get_or_build(PARAMS) == circuits
+    assert cache.stats() == {"memory_hits": 0, "disk_hits": 1, "misses": 0}
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: b"",
+    lambda data: data[:12],  # shorter than the magic and the header length
+    lambda data: data[:40],  # truncated header
+    lambda data: data[:-5],  # truncated arrays
+    lambda data: data[:-1] + bytes([data[-1] ^ 1]),
+    lambda data: _header({"name": "test"}),  # header without byteorder, digest and circuits
+    lambda data: _header(["test"]),
+], ids=["empty", "short", "header", "arrays", "flipped", "keys", "list"])
+def test_corrupt_entry_is_a_miss(tmp_path, corrupt):
+    circuits = circuit_cache.CircuitCache(str(tmp_path)).get_or_build(PARAMS)
+    [path] = tmp_path.iterdir()
+    path.write_bytes(corrupt(path.read_bytes()))
+
+    cache = circuit_cache.CircuitCache(str(tmp_path))
+    assert cache.get(circuit_cache.cache_key(PARAMS)) is None
+    assert not path.exists()
+    assert cache.get_or_build(PARAMS) == circuits
+    assert cache.stats()["misses"] == 1 and os.path.exists(path)
@@ -0,0 +1,50 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+import circuit_generator
+import simulator
+
+
+def _sums(adder, bits, pairs):
+    alice, bob, outputs, gates = circuit_generator.addition(bits, 1, adder)
+    circuit = {"id": "sum", "alice": alice, "bob": bob, "out": outputs, "gates": gates}
+    a_values, b_values = np.array(pairs).T
+    result = simulator.Simulator(circuit).evaluate(simulator.value_bits(a_values, bits),
+                                                   simulator.value_bits(b_values, bits))
+    return (result.astype(np.int64) << np.arange(len(outputs))).sum(axis=1).tolist()
+
+
+@pytest.mark.parametrize("adder", circuit_generator.ADDERS)
+@pytest.mark.parametrize("bits", [1, 2, 3, 5])
+def test_adder_all_inputs(adder, bits):
+    pairs = list(itertools.product(range(1 << bits), repeat=2))
+    assert _sums(adder, bits, pairs) == [a + b for a, b in pairs]
+
+
+@pytest.mark.parametrize("adder", circuit_generator.ADDERS)
+@pytest.mark.parametrize("bits", [16, 31])
+def test_adder_random_inputs(adder, bits):
+    rng = random.Random(bits)
+    pairs = [(rng.getrandbits(bits), rng.getrandbits(bits)) for _ in range(500)]
+    pairs += [((1 << bits) - 1, (1 << bits) - 1), ((1 << bits) - 1, 1), (0, 0)]  # longest carry chains
+    assert _sums(adder, bits, pairs) == [a + b for a, b in pairs]
+
+
+def test_unknown_adder():
+    with pytest.raises(ValueError):
+        circuit_generator.addition(8, 1, "carry-lookahead")
+
+
+@pytest.mark.parametrize("alice_set,bob_set", [([5, 5], [7]), ([3, 1, 3], [3, 3, 2]), ([4], [4, 4])])
+def test_sort_compare_shuffle_inputs_without_duplicates(alice_set, bob_set):
+    k, m = len(set(alice_set)), len(set(bob_set))
+    values = circuit_generator.sort_compare_shuffle_alice_values(alice_set, m, 4)
+    bob_bits = circuit_generator.sort_compare_shuffle_bob_bits(bob_set, k, 4)
+    assert values[:k] == sorted(set(alice_set))
+    assert len(values) + m == circuit_generator.merged_list_size(k, m)
+    switches = circuit_generator.benes_switch_count(circuit_generator.merged_list_size(k, m))
+    assert len(bob_bits) == 5 * m + switches
+
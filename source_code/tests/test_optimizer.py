@@ -0,0 +1,37 @@
+import pytest
+
+import circuit_generator
+import optimizer
+import simulator
+
+PARAMS = [
+    {"operation": 0, "bit_number": 8, "adder": "ripple"},
+    {"operation": 0, "bit_number": 8, "adder": "kogge-stone"},
+    {"operation": 1, "bit_number": 8, "alice_set_cardinality": 5},
+    {"operation": 1, "bit_number": 8, "alice_set_cardinality": 5, "balanced": True},
+    {"operation": 2, "bit_number": 6, "alice_set_cardinality": 3, "bob_set_cardinality": 4},
+    {"operation": 3, "bit_number": 6, "alice_set_cardinality": 3, "bob_set_cardinality": 4},
+    {"operation": 4, "bit_number": 6, "bin_capacities": [1, 1, 3, 2, 4], "batch_size": 2},
+]
+
+
+@pytest.mark.parametrize("params", PARAMS, ids=lambda params: "-".join(f"{k}={v}" for k, v in params.items()))
+def test_optimized_circuits_are_equivalent(params):
+    params = {"name": "test", "id_name": "test", **params}
+    circuits = circuit_generator.build_circuit(**params)
+    optimized = optimizer.optimize_circuits(circuits)
+    simulator.check_circuits(circuits, params, vectors=256)
+    stats = simulator.check_circuits(optimized, params, vectors=256)
+
+    for before, after in zip(circuits["circuits"], optimized["circuits"]):
+        assert len(after["gates"]) <= len(before["gates"])
+        assert stats[after["id"]]["gates"] == len(after["gates"])
+
+
+def test_check_circuits_detects_a_wrong_circuit():
+    params = {"name": "test", "id_name": "test", "operation": 1, "bit_number": 4, "alice_set_cardinality": 2}
+    circuits = circuit_generator.build_circuit(**params)
+    gate = next(gate for gate in circuits["circuits"][0]["gates"] if gate["type"] == "XOR")
+    gate["type"] = "XNOR"
+    with pytest.raises(ValueError):
+        simulator.check_circuits(optimizer.optimize_circuits(circuits), params, vectors=256)
@@ -0,0 +1,95 @@
+import random
+import threading
+
+import pytest
+
+import ot
+import util
+import yao
+
+# messages of the session exchanged before the inputs, see ObliviousTransfer.serve_session
+SESSION_MESSAGES = {"lockstep": 1, "batched": 1, "extension": 2, "pool": 3}
+
+
+@pytest.fixture(scope="module")
+def group():
+    return util.PrimeGroup()
+
+
+def _transfer(mode, b_keys, b_inputs, group, enabled=True, queries=1, pool=(4096, 1024)):
+    """Run 'queries' transfers of Bob's keys over a loopback connection.
+
+    Returns:
+        The list of Bob's (a_inputs, b_inputs_encr) of each query.
+    """
+    garbler_socket, evaluator_socket = util.loopback_pair(serialize=True)
+    alice = ot.ObliviousTransfer(garbler_socket, enabled, [group], mode, *pool)
+    bob = ot.ObliviousTransfer(evaluator_socket, enabled, pool_size=pool[0], pool_threshold=pool[1])
+    received, errors = [], []
+
+    def serve():
+        try:
+            for _ in range(SESSION_MESSAGES[mode] if enabled else 1):
+                evaluator_socket.send(bob.serve_session(evaluator_socket.receive()))
+            for _ in range(queries):
+                received.append(bob.receive_inputs(b_inputs))
+                evaluator_socket.send(True)
+        except BaseException as error:
+            errors.append(error)
+            garbler_socket.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        alice.start_session()
+        alice.precompute()
+        for _ in range(queries):
+            alice.send_inputs({"a": 1}, b_keys)
+            garbler_socket.receive()
+    finally:
+        evaluator_socket.close()
+        thread.join()
+    if errors:
+        raise errors[0]
+    return received
+
+
+def _keys(wires):
+    return {w: ((yao.random_key(0), 0), (yao.random_key(1), 1)) for w in wires}
+
+
+@pytest.mark.parametrize("mode", ot.OT_MODES)
+def test_transfers_the_chosen_keys(mode, group):
+    rng = random.Random(0)
+    b_keys = _keys(range(10, 30))
+    b_inputs = {w: rng.randint(0, 1) for w in b_keys}
+    for a_inputs, b_inputs_encr in _transfer(mode, b_keys, b_inputs, group, queries=2):
+        assert a_inputs == {"a": 1}
+        assert b_inputs_encr == {w: b_keys[w][bit] for w, bit in b_inputs.items()}
+
+
+@pytest.mark.parametrize("mode", ot.OT_MODES)
+def test_transfers_without_oblivious_transfer(mode, group):
+    b_keys = _keys(range(4))
+    b_inputs = {0: 0, 1: 1, 2: 1, 3: 0}
+    [(_, b_inputs_encr)] = _transfer(mode, b_keys, b_inputs, group, enabled=False)
+    assert b_inputs_encr == {w: b_keys[w][bit] for w, bit in b_inputs.items()}
+
+
+def test_pool_refills_online(group):
+    b_keys = _keys(range(40))
+    b_inputs = {w: w & 1 for w in b_keys}
+    results = _transfer("pool", b_keys, b_inputs, group, queries=3, pool=(64, 32))
+    assert all(b_inputs_encr == {w: b_keys[w][w & 1] for w in b_keys} for _, b_inputs_encr in results)
+
+
+def test_ot_extension_matrix():
+    seeds = [(bytes([i]) * 16, bytes([i + 1]) * 16) for i in range(ot.KAPPA)]
+    choices = random.Random(1).getrandbits(ot.KAPPA)
+    sender = ot.OTExtension([pair[(choices >> i) & 1] for i, pair in enumerate(seeds)], choices)
+    receiver = ot.OTExtension(seeds)
+    bits = [1, 0, 0, 1, 1, 0, 1]
+    _, u_columns, t_rows = receiver.extend_receiver(bits)
+    _, q_rows = sender.extend_sender(u_columns, len(bits))
+    # q_j = t_j ^ (b_j * s): Bob's pad is the one of his message
+    assert [q ^ t for q, t in zip(q_rows, t_rows)] == [choices if bit else 0 for bit in bits]
@@ -0,0 +1,65 @@
+import pytest
+
+import main
+
+CIRCUITS = {"filename": "test_psi.json", "id_name": "test_psi", "circuit_name": "test_psi"}
+
+SETS = [
+    ([3, 5, 9, 12], [5, 7, 12]),
+    ([1, 2, 3], [4, 5, 6]),  # no common value
+    ([5, 5, 9], [9, 5, 5, 2]),  # duplicates in both sets
+    ([8], [8]),
+    (list(range(20, 36)), list(range(30, 40))),
+]
+OPTIONS = [
+    {},
+    {"ot_mode": "extension", "scheme": "half-gates", "backend": "fixed-key", "wire_format": "binary"},
+    {"ot_mode": "pool", "scheme": "free-xor", "stream": 16},
+]
+
+
+@pytest.fixture
+def outputs(monkeypatch):
+    """Record the outputs Alice computes instead of comparing them with the set files."""
+    recorded = []
+    monkeypatch.setattr(main.ExpectedOutput, "compare_outputs", lambda self, out: recorded.append(out))
+    return recorded
+
+
+def _intersection(alice_set, bob_set, outputs, operation, **alice_kwargs):
+    main.run_in_process(CIRCUITS, alice_set, bob_set, operation=operation, **alice_kwargs)
+    return outputs[-1]
+
+
+@pytest.mark.parametrize("options", OPTIONS, ids=["default", "extension", "pool"])
+@pytest.mark.parametrize("alice_set,bob_set", SETS)
+@pytest.mark.parametrize("operation", [2, 3, 4])
+def test_intersection(operation, alice_set, bob_set, options, outputs):
+    assert _intersection(alice_set, bob_set, outputs, operation, **options) == set(alice_set) & set(bob_set)
+
+
+@pytest.mark.parametrize("operation", [2, 3, 4])
+def test_intersection_over_serialized_loopback(operation, outputs):
+    main.run_in_process(CIRCUITS, [3, 5, 9, 12], [5, 7, 12], serialize=True, operation=operation)
+    assert outputs[-1] == {5, 12}
+
+
+@pytest.mark.parametrize("operation", [1, 2, 3, 4])
+def test_empty_alice_set(operation, outputs):
+    with pytest.raises(ValueError, match="at least one value of Alice"):
+        main.run_in_process(CIRCUITS, [], [1, 2], operation=operation)
+
+
+@pytest.mark.parametrize("operation", [1, 2, 3])
+def test_empty_bob_set(operation, outputs):
+    with pytest.raises(ValueError, match="at least one value of Bob"):
+        main.run_in_process(CIRCUITS, [1, 2], [], operation=operation)
+
+
+def test_empty_bob_set_bucketed(outputs):
+    assert _intersection([1, 2], [], outputs, 4) == set()
+
+
+def test_sum(outputs):
+    main.run_in_process(CIRCUITS, [3, 5, 9], [7, 11], operation=0)
+    assert outputs == [35]
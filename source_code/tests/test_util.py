@@ -0,0 +1,41 @@
+import pytest
+
+import util
+
+
+@pytest.mark.parametrize("value", [-1, 1 << 128])
+def test_bin_positions_out_of_range(value):
+    with pytest.raises(ValueError, match="2\\^128"):
+        util.bin_positions(value, bytes(16), 3, 8)
+
+
+def test_bin_positions_in_range():
+    for value in (0, 12345, (1 << 128) - 1):
+        positions = util.bin_positions(value, bytes(16), 3, 8)
+        assert len(positions) == 3 and all(0 <= position < 8 for position in positions)
+
+
+def test_load_prime_groups(tmp_path):
+    path = util.save_prime_groups(str(tmp_path / "groups.json"), 2)
+    groups = util.load_prime_groups(path)
+    assert len(groups) == 2
+    assert all(group.is_generator(group.generator) for group in groups)
+
+
+@pytest.mark.parametrize("entry", [
+    {"prime": 22, "generator": 5},  # not prime
+    {"prime": 23, "generator": 23},  # not an element
+    {"prime": 23, "generator": 2},  # generates a subgroup of order 11
+])
+def test_load_invalid_prime_groups(tmp_path, entry):
+    path = tmp_path / "groups.json"
+    path.write_text(f'[{{"prime": {entry["prime"]}, "generator": {entry["generator"]}}}]')
+    with pytest.raises(ValueError, match="Invalid prime group"):
+        util.load_prime_groups(str(path))
+
+
+def test_load_no_prime_group(tmp_path):
+    path = tmp_path / "groups.json"
+    path.write_text("[]")
+    with pytest.raises(ValueError, match="No prime group"):
+        util.load_prime_groups(str(path))
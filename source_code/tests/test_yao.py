@@ -0,0 +1,85 @@
+import pickle
+import random
+
+import pytest
+
+import circuit_generator
+import simulator
+import yao
+
+COMBINATIONS = [(scheme, backend) for scheme in yao.SCHEMES for backend in yao.BACKENDS
+                if not (scheme == "half-gates" and backend == "aes-cbc")]  # half gates use the fixed-key hash
+
+
+@pytest.fixture(scope="module", params=[0, 2], ids=["addition", "all-pairs"])
+def circuit(request):
+    params = {"bit_number": 4, "name": "test", "id_name": "test", "operation": request.param}
+    if request.param == 2:
+        params.update(alice_set_cardinality=3, bob_set_cardinality=2)
+    return circuit_generator.build_circuit(**params)["circuits"][0]
+
+
+def _random_inputs(circuit, garbled, rng):
+    """Return the garbled inputs of random input bits and the expected outputs."""
+    keys, pbits = garbled.get_keys(), garbled.get_pbits()
+    bits = {wire: rng.randint(0, 1) for wire in circuit["alice"] + circuit["bob"]}
+    a_inputs = {w: (keys[w][bits[w]], pbits[w] ^ bits[w]) for w in circuit["alice"]}
+    b_inputs = {w: (keys[w][bits[w]], pbits[w] ^ bits[w]) for w in circuit["bob"]}
+    outputs = simulator.Simulator(circuit).evaluate([[bits[w] for w in circuit["alice"]]],
+                                                     [[bits[w] for w in circuit["bob"]]])[0]
+    return a_inputs, b_inputs, dict(zip(circuit["out"], outputs.tolist()))
+
+
+def _transfer(garbled, wire_format):
+    """Return what Bob evaluates: (circuit, garbled tables, pbits_out)."""
+    pbits_out = {w: garbled.get_pbits()[w] for w in garbled.circuit["out"]}
+    if wire_format == "pickle":
+        return pickle.loads(pickle.dumps((garbled.circuit, garbled.get_garbled_tables(), pbits_out)))
+    frames = yao.pack_circuit(garbled.compiled, garbled.get_garbled_tables(), pbits_out,
+                              garbled.scheme, garbled.backend)
+    unpacked = yao.unpack_circuit([bytes(frame) for frame in frames])
+    return unpacked["circuit"], unpacked["garbled_tables"], unpacked["pbits_out"]
+
+
+@pytest.mark.parametrize("wire_format", yao.WIRE_FORMATS)
+@pytest.mark.parametrize("scheme,backend", COMBINATIONS)
+def test_garble_evaluate_round_trip(circuit, scheme, backend, wire_format):
+    rng = random.Random(0)
+    garbled = yao.GarbledCircuit(circuit, scheme=scheme, backend=backend)
+    if wire_format == "binary" and scheme != "half-gates" and backend != "fixed-key":
+        with pytest.raises(ValueError):
+            _transfer(garbled, wire_format)
+        return
+
+    compiled, tables, pbits_out = _transfer(garbled, wire_format)
+    for _ in range(8):
+        a_inputs, b_inputs, expected = _random_inputs(circuit, garbled, rng)
+        assert yao.evaluate(compiled, tables, pbits_out, a_inputs, b_inputs, scheme, backend) == expected
+
+
+@pytest.mark.parametrize("scheme,backend", COMBINATIONS)
+def test_parallel_garbling_and_evaluation(circuit, scheme, backend, monkeypatch):
+    monkeypatch.setattr(yao, "PARALLEL_MIN_GATES", 0)
+    rng = random.Random(1)
+    garbled = yao.GarbledCircuit(circuit, scheme=scheme, backend=backend, workers=2)
+    a_inputs, b_inputs, expected = _random_inputs(circuit, garbled, rng)
+    pbits_out = {w: garbled.get_pbits()[w] for w in circuit["out"]}
+
+    compiled = garbled.compiled
+    labels = compiled.new_labels(a_inputs, b_inputs)
+    yao.evaluate_levels(compiled, compiled.order_tables(garbled.get_garbled_tables()), labels, 2, scheme,
+                        backend, min_width=1)
+    index = compiled.wire_index
+    assert {out: labels[index[out]][1] ^ pbits_out[out] for out in circuit["out"]} == expected
+
+
+@pytest.mark.parametrize("scheme,backend", COMBINATIONS)
+def test_stream_evaluation(circuit, scheme, backend):
+    rng = random.Random(2)
+    garbled = yao.GarbledCircuit(circuit, scheme=scheme, backend=backend, lazy=True)
+    a_inputs, b_inputs, expected = _random_inputs(circuit, garbled, rng)
+    evaluator = yao.StreamEvaluator(garbled.compiled, [(a_inputs, b_inputs)], scheme, backend)
+    for tables in garbled.stream(16):
+        evaluator.feed(tables)
+    pbits_out = {w: garbled.get_pbits()[w] for w in circuit["out"]}
+    assert evaluator.get_results(pbits_out) == [expected]